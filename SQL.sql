@@ -36,6 +36,7 @@ CREATE TABLE sales (
     customer_id INTEGER,
     employee_id INTEGER,
     total_amount REAL,
+    total_kop INTEGER,
     FOREIGN KEY(customer_id) REFERENCES customers(id),
     FOREIGN KEY(employee_id) REFERENCES employees(id)
 );
@@ -46,6 +47,93 @@ CREATE TABLE sale_items (
     product_id INTEGER,
     quantity INTEGER,
     price REAL,
+    price_kop INTEGER,
+    discount_kop INTEGER,
     FOREIGN KEY(sale_id) REFERENCES sales(id),
     FOREIGN KEY(product_id) REFERENCES products(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE promotions (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    percent REAL,
+    category_id INTEGER,
+    product_id INTEGER,
+    customer_id INTEGER,
+    starts_at TEXT,
+    ends_at TEXT,
+    weekdays TEXT,
+    hour_from INTEGER,
+    hour_to INTEGER
+);
+
+CREATE TABLE csv_imports (
+    table_name TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    sha256 TEXT,
+    imported_at TEXT
+);
+
+CREATE TABLE daily_sales_agg (
+    day TEXT,
+    employee_id INTEGER,
+    customer_id INTEGER,
+    sales_count INTEGER,
+    revenue_kop INTEGER,
+    PRIMARY KEY (day, employee_id, customer_id)
+) WITHOUT ROWID;
+
+CREATE TABLE daily_product_agg (
+    day TEXT,
+    product_id INTEGER,
+    quantity INTEGER,
+    revenue_kop INTEGER,
+    PRIMARY KEY (day, product_id)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE products_fts USING fts5(
+    name, content='products', content_rowid='id', tokenize='trigram'
+);
+
+CREATE VIRTUAL TABLE customers_fts USING fts5(
+    name, phone, content='customers', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TABLE product_forecast (
+    product_id INTEGER PRIMARY KEY,
+    velocity REAL,
+    days_left REAL,
+    reorder_point INTEGER,
+    updated_at TEXT
+);
+
+CREATE TABLE forecast_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_sale_id INTEGER,
+    last_day TEXT
+);
+
+CREATE INDEX idx_sales_datetime ON sales(datetime);
+CREATE INDEX idx_sales_employee ON sales(employee_id);
+CREATE INDEX idx_sales_customer ON sales(customer_id);
+CREATE INDEX idx_sale_items_sale_product ON sale_items(sale_id, product_id);
+
+CREATE TABLE stock_movements (
+    id INTEGER PRIMARY KEY,
+    product_id INTEGER NOT NULL,
+    moment TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('sale', 'restock', 'adjustment', 'import')),
+    ref_id INTEGER
+);
+
+CREATE TABLE stock_snapshots (
+    product_id INTEGER,
+    movement_id INTEGER,
+    moment TEXT,
+    stock INTEGER,
+    PRIMARY KEY (product_id, movement_id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_stock_movements_product ON stock_movements(product_id, moment);
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""Перенос закрытых месяцев продаж из рабочей БД в годовые файлы db.archive_<год>.sqlite3."""
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import db
+import replication
+from warehouse import month_bounds
+
+ARCHIVE_KEEP_MONTHS = 12
+# Строки месяца в рабочей БД, подлежащие переносу: параметры — начало и конец месяца, last_own_sale().
+# Продажа с наибольшим id своего диапазона остаётся: от неё replication.new_id выдаёт id новым продажам
+MONTH_SALES = "SELECT id FROM main.sales WHERE datetime >= ? AND datetime < ? AND id IS NOT ?"
+# Колонки, которые покрывает контрольная сумма в манифесте: колонки, добавленные позже,
+# не должны менять суммы уже заархивированных месяцев
+CHECKSUM_COLUMNS = {
+    "sales": "id, datetime, customer_id, employee_id, total_amount",
+    "sale_items": "id, sale_id, product_id, quantity, price",
+}
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_sales_datetime ON sales(datetime)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_sale_items_sale_product ON sale_items(sale_id, product_id)",
+)
+
+
+def cutoff(keep_months, now=None):
+    """Первый день самого старого месяца, остающегося в рабочей БД."""
+    if keep_months < 1:
+        raise Exception("В рабочей БД должен оставаться хотя бы текущий месяц")
+    now = now or datetime.now()
+    index = now.year * 12 + now.month - 1 - (keep_months - 1)
+    return f"{index // 12}-{index % 12 + 1:02d}-01"
+
+
+def last_own_sale(conn):
+    low, high = replication.own_range(conn)
+    return conn.execute("SELECT MAX(id) FROM main.sales WHERE id BETWEEN ? AND ?", (low, high)).fetchone()[0]
+
+
+def pending_months(conn, before):
+    """[(месяц, продаж, позиций)] рабочей БД до даты before."""
+    return conn.execute("""
+        SELECT substr(s.datetime, 1, 7), COUNT(*),
+               SUM((SELECT COUNT(*) FROM main.sale_items si WHERE si.sale_id = s.id))
+        FROM main.sales s
+        WHERE s.datetime < ? AND s.id IS NOT ?
+        GROUP BY 1
+        ORDER BY 1
+    """, (before, last_own_sale(conn))).fetchall()
+
+
+def checksum(conn, sql, params=()):
+    """(строк, sha256) результата запроса; порядок строк задаёт сам запрос."""
+    digest = hashlib.sha256()
+    count = 0
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            return count, digest.hexdigest()
+        for row in rows:
+            digest.update(repr(row).encode())
+        count += len(rows)
+
+
+def _ensure_archive(conn, schema):
+    """Создаёт в архиве таблицы с колонками рабочей БД, индексы и манифест."""
+    for table in db.ARCHIVED_TABLES:
+        columns = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        present = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+        if not present:
+            definition = ", ".join(
+                f"{name} {kind}" + (" PRIMARY KEY" if pk else "") for _, name, kind, _, _, pk in columns
+            )
+            conn.execute(f"CREATE TABLE {schema}.{table} ({definition})")
+        else:
+            for _, name, kind, _, _, _ in columns:
+                if name not in present:
+                    conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {kind}")
+    for ddl in INDEXES:
+        conn.execute(ddl.format(schema=schema))
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.archive_manifest (
+            month TEXT PRIMARY KEY,
+            sales INTEGER,
+            items INTEGER,
+            sales_sha256 TEXT,
+            items_sha256 TEXT,
+            archived_at TEXT
+        )""")
+
+
+def month_checksums(conn, schema, month):
+    """Контрольные суммы всех продаж и позиций месяца в базе schema."""
+    start, end = month_bounds(month)
+    sales = checksum(conn, f"""
+        SELECT {CHECKSUM_COLUMNS["sales"]} FROM {schema}.sales
+        WHERE datetime >= ? AND datetime < ?
+        ORDER BY id
+    """, (start, end))
+    items = checksum(conn, f"""
+        SELECT {CHECKSUM_COLUMNS["sale_items"]} FROM {schema}.sale_items
+        WHERE sale_id IN (SELECT id FROM {schema}.sales WHERE datetime >= ? AND datetime < ?)
+        ORDER BY id
+    """, (start, end))
+    return sales, items
+
+
+def archive_month(conn, schema, month, kept_id):
+    """Переносит месяц в архив schema одной транзакцией; возвращает (продаж, позиций)."""
+    # Копия, сверка контрольных сумм и удаление — в одной транзакции; если процесс упадёт между
+    # фиксацией двух файлов, строки останутся в обоих, и повторный запуск довершит перенос
+    params = month_bounds(month) + (kept_id,)
+    sales_cols = ", ".join(row[1] for row in conn.execute("PRAGMA main.table_info(sales)"))
+    items_cols = ", ".join(row[1] for row in conn.execute("PRAGMA main.table_info(sale_items)"))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"""
+            INSERT OR IGNORE INTO {schema}.sales ({sales_cols})
+            SELECT {sales_cols} FROM main.sales WHERE id IN ({MONTH_SALES})
+        """, params)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO {schema}.sale_items ({items_cols})
+            SELECT {items_cols} FROM main.sale_items WHERE sale_id IN ({MONTH_SALES})
+        """, params)
+
+        # Сверка: копия в архиве должна совпасть с оригиналом строка в строку
+        for table, key in (("sales", "id"), ("sale_items", "sale_id")):
+            cols = sales_cols if table == "sales" else items_cols
+            source = checksum(conn, f"SELECT {cols} FROM main.{table} WHERE {key} IN ({MONTH_SALES}) ORDER BY id",
+                              params)
+            copy = checksum(conn, f"SELECT {cols} FROM {schema}.{table} WHERE {key} IN ({MONTH_SALES}) ORDER BY id",
+                            params)
+            if source != copy:
+                raise Exception(
+                    f"Архив {month}: контрольная сумма {table} не совпала "
+                    f"({source[0]} строк в БД, {copy[0]} в архиве) — перенос отменён"
+                )
+        moved_items = conn.execute(f"DELETE FROM main.sale_items WHERE sale_id IN ({MONTH_SALES})", params).rowcount
+        moved_sales = conn.execute(f"DELETE FROM main.sales WHERE id IN ({MONTH_SALES})", params).rowcount
+
+        (sales, sales_sha), (items, items_sha) = month_checksums(conn, schema, month)
+        conn.execute(f"""
+            INSERT INTO {schema}.archive_manifest (month, sales, items, sales_sha256, items_sha256, archived_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(month) DO UPDATE SET
+                sales = excluded.sales,
+                items = excluded.items,
+                sales_sha256 = excluded.sales_sha256,
+                items_sha256 = excluded.items_sha256,
+                archived_at = excluded.archived_at
+        """, (month, sales, items, sales_sha, items_sha, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return moved_sales, moved_items
+
+
+def run(keep_months=ARCHIVE_KEEP_MONTHS, dry_run=False, vacuum=True, now=None):
+    """Переносит в архивы месяцы старше последних keep_months; dry_run — только показать их."""
+    start = time.perf_counter()
+    before = cutoff(keep_months, now)
+    path = db.get_pool().path
+    conn = db.connect(path)
+    try:
+        months = pending_months(conn, before)
+        stats = {
+            "cutoff": before,
+            "months": [(month, sales, items or 0, db.archive_path(month[:4], path)) for month, sales, items in months],
+            "size_before": os.path.getsize(path),
+            "dry_run": dry_run,
+        }
+        if dry_run or not months:
+            stats["size_after"] = stats["size_before"]
+            stats["seconds"] = time.perf_counter() - start
+            return stats
+
+        kept_id = last_own_sale(conn)
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        for month, _, _, file in stats["months"]:
+            schema = f"archive_{month[:4]}"
+            if schema not in attached:
+                conn.execute("ATTACH DATABASE ? AS " + schema, (file,))
+                conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+                attached.add(schema)
+            _ensure_archive(conn, schema)
+            archive_month(conn, schema, month, kept_id)
+        if vacuum:
+            conn.execute("VACUUM main")
+            conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+    # Соединения пула подключат новые архивы и пересоздадут представления
+    db.refresh_archives()
+    stats["size_after"] = os.path.getsize(path)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def verify(path=None):
+    """Пересчитывает контрольные суммы archive_manifest; возвращает (проверено месяцев, расхождения)."""
+    path = path or db.get_pool().path
+    checked, problems = 0, []
+    for file in db.archive_paths(path).values():
+        conn = sqlite3.connect(file)
+        try:
+            for month, sales, items, sales_sha, items_sha in conn.execute(
+                "SELECT month, sales, items, sales_sha256, items_sha256 FROM archive_manifest ORDER BY month"
+            ).fetchall():
+                actual = month_checksums(conn, "main", month)
+                if actual != ((sales, sales_sha), (items, items_sha)):
+                    problems.append(
+                        f"{os.path.basename(file)}, {month}: ожидалось {sales} продаж и {items} позиций, "
+                        f"найдено {actual[0][0]} и {actual[1][0]}, контрольные суммы "
+                        f"{'совпали' if actual[0][1] == sales_sha and actual[1][1] == items_sha else 'не совпали'}"
+                    )
+                checked += 1
+        finally:
+            conn.close()
+    return checked, problems
@@ -0,0 +1,105 @@
+"""Авторизация администратора: хеш пароля scrypt с солью и короткие сессии в памяти процесса."""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+import db
+import metrics
+
+# Проверка пароля намеренно медленная (десятки–сотни мс): login() вызывается вне потока Tk
+KDF_COST = int(os.environ.get("SUPERMARKET_KDF_COST", 2 ** 15))  # параметр n scrypt, степень двойки
+KDF_BLOCK_SIZE = 8
+KDF_PARALLEL = 1
+SALT_BYTES = 16
+SESSION_TTL = 15 * 60  # секунд бездействия, после которых нужен повторный вход
+
+_lock = threading.Lock()
+_sessions = {}  # токен -> [логин, срок действия по time.monotonic()]
+
+
+def _scrypt(password, salt, n, r, p):
+    with metrics.timed("auth.kdf", kind="auth"):
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32
+        )
+
+
+def hash_password(password, cost=None):
+    """Хеш для admins.password_hash с новой солью."""
+    n, salt = cost or KDF_COST, secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, n, KDF_BLOCK_SIZE, KDF_PARALLEL)
+    return f"scrypt${n}${KDF_BLOCK_SIZE}${KDF_PARALLEL}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """(пароль верен, хеш нужно пересчитать с текущими параметрами)."""
+    # Старый несолёный SHA-256 ещё принимается; login() перезапишет его в формат scrypt$n$r$p$соль$хеш
+    if not stored.startswith("scrypt$"):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    _, n, r, p, salt, digest = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    actual = _scrypt(password, bytes.fromhex(salt), n, r, p)
+    return hmac.compare_digest(actual.hex(), digest), (n, r, p) != (KDF_COST, KDF_BLOCK_SIZE, KDF_PARALLEL)
+
+
+def set_password(login, password):
+    """Задаёт пароль администратора; нового администратора заводит."""
+    password_hash = hash_password(password)
+
+    def work(conn):
+        conn.execute("""
+            INSERT INTO admins (login, password_hash) VALUES (?, ?)
+            ON CONFLICT(login) DO UPDATE SET password_hash = excluded.password_hash
+        """, (login, password_hash))
+
+    db.run_in_transaction(work)
+    # Прежние сессии этого администратора больше не действуют
+    with _lock:
+        for token in [token for token, session in _sessions.items() if session[0] == login]:
+            del _sessions[token]
+
+
+def login(login, password):
+    """Проверяет логин и пароль; возвращает токен сессии. Медленно: вызывать вне потока Tk."""
+    with metrics.timed("auth.login", kind="auth"):
+        with db.connection() as conn:
+            admin = conn.execute("SELECT password_hash FROM admins WHERE login = ?", (login,)).fetchone()
+        if not admin:
+            raise Exception("Неверный логин")
+        valid, outdated = verify_password(password, admin[0])
+        if not valid:
+            raise Exception("Неверный пароль")
+        if outdated:
+            password_hash = hash_password(password)
+            db.run_in_transaction(lambda conn: conn.execute(
+                "UPDATE admins SET password_hash = ? WHERE login = ? AND password_hash = ?",
+                (password_hash, login, admin[0])
+            ))
+        token = secrets.token_urlsafe(32)
+        with _lock:
+            _sessions[token] = [login, time.monotonic() + SESSION_TTL]
+        return token
+
+
+def check(token):
+    """Логин администратора по живой сессии (и продление её) или None."""
+    with metrics.timed("auth.session", kind="auth"):
+        now = time.monotonic()
+        with _lock:
+            session = _sessions.get(token) if token else None
+            if session is None:
+                return None
+            if session[1] <= now:
+                del _sessions[token]
+                return None
+            session[1] = now + SESSION_TTL
+            return session[0]
+
+
+def logout(token):
+    with _lock:
+        _sessions.pop(token, None)
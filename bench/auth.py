@@ -0,0 +1,91 @@
+"""Задержка входа администратора и повторной проверки прав по сессии.
+
+Во временной БД для каждой стоимости scrypt (--costs) пароль задаётся заново,
+затем --logins раз выполняется полный вход auth.login (чтение admins + хеш) и
+--checks раз — проверка токена auth.check, которой обходятся повторные
+действия администратора. Время входа и хеша берётся из
+метрик (auth.login, auth.kdf). Проверяется также, что старый SHA-256 хеш принимается и при
+входе заменяется на scrypt, а неверный пароль отклоняется.
+
+    python -m bench.auth --costs 16384 32768 65536 --logins 10 --checks 10000
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import auth
+import db
+import metrics
+
+PASSWORD = "admin123"
+
+
+def prepare(path):
+    db.configure(path)
+    import main
+    main.bootstrap()
+
+
+def legacy_upgrade():
+    """Вход со старым хешем: проходит и перезаписывает хеш в формате scrypt; чужой пароль не проходит."""
+    auth.set_password("legacy", "x")
+    with db.connection() as conn:
+        conn.execute("UPDATE admins SET password_hash = ? WHERE login = 'legacy'",
+                     (hashlib.sha256(PASSWORD.encode()).hexdigest(),))
+    auth.login("legacy", PASSWORD)
+    with db.connection() as conn:
+        stored = conn.execute("SELECT password_hash FROM admins WHERE login = 'legacy'").fetchone()[0]
+    try:
+        auth.login("legacy", "wrong")
+        rejected = False
+    except Exception:
+        rejected = True
+    return stored.startswith("scrypt$") and auth.verify_password(PASSWORD, stored)[0] and rejected
+
+
+def run(cost, logins, checks):
+    auth.KDF_COST = cost
+    auth.set_password("admin", PASSWORD)
+    metrics.reset()
+    token = None
+    for _ in range(logins):
+        token = auth.login("admin", PASSWORD)
+    start = time.perf_counter()
+    valid = all(auth.check(token) == "admin" for _ in range(checks))
+    check_us = (time.perf_counter() - start) / checks * 1e6
+    stats = metrics.snapshot()["metrics"]
+    return {
+        "cost": cost,
+        "login_ms": stats["auth.login"]["mean_ms"],
+        "kdf_ms": stats["auth.kdf"]["mean_ms"],
+        "check_us": check_us,
+        "valid": valid and auth.check("unknown") is None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--costs", type=int, nargs="+", default=[2 ** 14, 2 ** 15, 2 ** 16], help="параметр n scrypt")
+    parser.add_argument("--logins", type=int, default=10, help="полных входов на стоимость")
+    parser.add_argument("--checks", type=int, default=10000, help="проверок токена на стоимость")
+    args = parser.parse_args()
+    metrics.enable()
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare(os.path.join(workdir, "auth.sqlite3"))
+        upgraded = legacy_upgrade()
+        print(f"{'n scrypt':>9} {'вход мс':>8} {'хеш мс':>7} {'сессия мкс':>11}  сверка")
+        failed = not upgraded
+        for cost in args.costs:
+            r = run(cost, args.logins, args.checks)
+            failed |= not r["valid"]
+            print(f"{r['cost']:>9} {r['login_ms']:>8.1f} {r['kdf_ms']:>7.1f} {r['check_us']:>11.2f}  "
+                  f"{'да' if r['valid'] else 'НЕТ'}")
+        print(f"Старый SHA-256 хеш принят и заменён на scrypt: {'да' if upgraded else 'НЕТ'}")
+        db.close_all() if hasattr(db, "close_all") else None
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
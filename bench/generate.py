@@ -0,0 +1,123 @@
+"""Генератор синтетической БД супермаркета заданного размера.
+
+Данные детерминированы зерном: одинаковые параметры дают одинаковую БД, поэтому
+результаты бенчмарков разных версий можно сравнивать между собой.
+
+    python -m bench.generate bench.sqlite3 --products 10000 --sales 2500000 --items-per-sale 4
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import db
+import ledger
+import pricing
+
+BATCH = 50000
+START_DATE = datetime(2024, 1, 1)  # фиксированная дата, чтобы БД не зависела от дня запуска
+
+FIRST_NAMES = ("Иван", "Мария", "Алексей", "Ольга", "Петр", "Анна", "Сергей", "Елена", "Дмитрий", "Наталья")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов")
+WORDS = ("Молоко", "Хлеб", "Сыр", "Чай", "Кофе", "Сок", "Шоколад", "Печенье", "Масло", "Йогурт", "Крупа", "Вода")
+ROLES = ("Кассир", "Кассир", "Кассир", "Администратор", "Кладовщик")
+
+
+def person(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def insert_many(conn, sql, rows):
+    for start in range(0, len(rows), BATCH):
+        conn.executemany(sql, rows[start:start + BATCH])
+
+
+def generate(path, products=10000, customers=5000, employees=50, categories=20,
+             sales=100000, items_per_sale=4, days=365, seed=42):
+    """Создаёт БД path со схемой приложения и синтетическими данными; возвращает время генерации."""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} уже существует")
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    db.configure(path)
+    import main
+    main.bootstrap()  # схема, миграции и справочники из CSV
+
+    with db.transaction() as conn:
+        # Справочники из CSV (и начальные остатки товаров в журнале) заменяются сгенерированными
+        for table in ("stock_movements", "products", "customers", "employees", "categories"):
+            conn.execute(f"DELETE FROM {table}")
+        insert_many(conn, "INSERT INTO categories (id, name) VALUES (?, ?)",
+                    [(i, f"Категория {i}") for i in range(1, categories + 1)])
+        insert_many(conn, "INSERT INTO products (id, name, price, stock, category_id) VALUES (?, ?, ?, ?, ?)", [
+            (i, f"{rng.choice(WORDS)} {rng.choice(WORDS).lower()} №{i}",
+             round(rng.uniform(20, 2000), 2), rng.randint(0, 500), rng.randint(1, categories))
+            for i in range(1, products + 1)
+        ])
+        ledger.record_new_products(conn)
+        insert_many(conn, "INSERT INTO customers (id, name, phone) VALUES (?, ?, ?)",
+                    [(i, person(rng), f"89{i:09d}") for i in range(1, customers + 1)])
+        insert_many(conn, "INSERT INTO employees (id, name, role) VALUES (?, ?, ?)",
+                    [(i, person(rng), rng.choice(ROLES)) for i in range(1, employees + 1)])
+
+    prices = {}
+    with db.connection() as conn:
+        prices.update((row[0], pricing.kopecks(row[1])) for row in conn.execute("SELECT id, price FROM products"))
+    # Правил скидок в синтетической БД нет: каждой позиции — базовая скидка, как в pricing.quote
+    points = pricing.BASE_PERCENT * pricing.BASIS_POINTS
+    span = days * 24 * 3600
+    for first in range(1, sales + 1, BATCH):
+        sale_rows, item_rows = [], []
+        for sale_id in range(first, min(first + BATCH, sales + 1)):
+            # Продажи упорядочены во времени, как при реальной работе касс
+            moment = START_DATE + timedelta(seconds=span * (sale_id - 1) // max(sales, 1) + rng.randint(0, 59))
+            total = 0
+            for product_id in rng.sample(range(1, products + 1), min(rng.randint(1, 2 * items_per_sale - 1), products)):
+                quantity = rng.randint(1, 5)
+                price = prices[product_id]
+                discount = (quantity * price * points + 5000) // 10000
+                item_rows.append((sale_id, product_id, quantity, price / 100, price, discount))
+                total += quantity * price - discount
+            sale_rows.append((sale_id, moment.strftime("%Y-%m-%d %H:%M:%S"),
+                              rng.randint(1, customers), rng.randint(1, employees), total / 100, total))
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO sales (id, datetime, customer_id, employee_id, total_amount, total_kop) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                sale_rows
+            )
+            conn.executemany(
+                "INSERT INTO sale_items (sale_id, product_id, quantity, price, price_kop, discount_kop) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                item_rows
+            )
+    with db.connection() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.get_pool().close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл создаваемой БД")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--employees", type=int, default=50)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--sales", type=int, default=100000)
+    parser.add_argument("--items-per-sale", type=int, default=4, help="среднее число позиций в чеке")
+    parser.add_argument("--days", type=int, default=365, help="длина истории продаж в днях")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    elapsed = generate(
+        args.path, products=args.products, customers=args.customers, employees=args.employees,
+        categories=args.categories, sales=args.sales, items_per_sale=args.items_per_sale,
+        days=args.days, seed=args.seed,
+    )
+    print(f"БД {args.path} сгенерирована за {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Сравнение фиксации по продаже и групповой фиксации (SALE_GROUP_COMMIT).
+
+Несколько потоков одного процесса продают одновременно: в первом режиме
+каждая продажа — своя транзакция и свой COMMIT, во втором продажи уходят в
+поток-писатель db.GroupCommitWriter и фиксируются пачками. Для каждого режима
+выводятся продаж в секунду, задержка продажи (p50, p95), число транзакций и
+проверка, что каждая продажа с возвращённым id записана.
+
+--synchronous FULL включает fsync на каждый COMMIT. На быстром SSD он почти
+бесплатен; --commit-delay-ms имитирует медленный диск — пауза внутри каждой
+транзакции, пока удерживается блокировка на запись.
+
+    python -m bench.group_commit --threads 1 4 16 --sales 200 --synchronous FULL --commit-delay-ms 5
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+
+STOCK = 10 ** 6  # остатка хватает на все продажи: меряется фиксация, а не отказы
+
+
+def prepare_template(path):
+    db.configure(path)
+    import main
+    main.bootstrap()
+    with db.connection() as conn:
+        conn.execute("UPDATE products SET stock = ?", (STOCK,))
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.configure(db.DB_PATH)
+
+
+def run(template, workdir, mode, threads, sales, commit_delay=0.0, seed=1):
+    import main
+
+    path = os.path.join(workdir, f"{mode}_{threads}.sqlite3")
+    shutil.copy(template, path)
+    db.configure(path)
+    main.SALE_GROUP_COMMIT = mode == "group"
+    with db.connection() as conn:
+        products = [row[0] for row in conn.execute("SELECT id FROM products")]
+        customers = [row[0] for row in conn.execute("SELECT id FROM customers")]
+        employees = [row[0] for row in conn.execute("SELECT id FROM employees")]
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+    # Транзакции считаются по вызовам run_in_transaction: им пользуются и make_sale, и поток-писатель
+    transactions = [0]
+    original = db.run_in_transaction
+
+    def counted(work, *args, **kwargs):
+        transactions[0] += 1
+        if not commit_delay:
+            return original(work, *args, **kwargs)
+
+        def slow(conn):
+            result = work(conn)
+            time.sleep(commit_delay)
+            return result
+
+        return original(slow, *args, **kwargs)
+
+    db.run_in_transaction = counted
+
+    barrier = threading.Barrier(threads)
+    latencies = []
+    sale_ids = []
+    lock = threading.Lock()
+
+    def till(number):
+        rng = random.Random(seed * 1000 + number)
+        own_latencies, own_ids = [], []
+        barrier.wait()
+        for _ in range(sales):
+            items = [(rng.choice(products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+            start = time.perf_counter()
+            own_ids.append(main.make_sale(items, rng.choice(customers), rng.choice(employees)))
+            own_latencies.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(own_latencies)
+            sale_ids.extend(own_ids)
+
+    pool = [threading.Thread(target=till, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    try:
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        db.run_in_transaction = original
+        db.configure(db.DB_PATH)
+
+    with sqlite3.connect(path) as conn:
+        recorded = {row[0] for row in conn.execute("SELECT id FROM sales WHERE id > ?", (first_id,))}
+    latencies.sort()
+    return {
+        "mode": mode,
+        "threads": threads,
+        "sales": len(sale_ids),
+        "transactions": transactions[0],
+        "consistent": recorded == set(sale_ids) and len(sale_ids) == threads * sales,
+        "sales_per_sec": round(len(sale_ids) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16], help="число продающих потоков")
+    parser.add_argument("--sales", type=int, default=200, help="продаж на поток")
+    parser.add_argument("--synchronous", choices=("NORMAL", "FULL"), default="NORMAL",
+                        help="PRAGMA synchronous: FULL — fsync на каждый COMMIT")
+    parser.add_argument("--commit-delay-ms", type=float, default=0.0,
+                        help="имитация медленного диска: задержка каждой транзакции, мс")
+    args = parser.parse_args()
+    db.PRAGMAS = tuple(p for p in db.PRAGMAS if "synchronous" not in p) + (f"PRAGMA synchronous = {args.synchronous}",)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "template.sqlite3")
+        prepare_template(template)
+        print(f"synchronous = {args.synchronous}, задержка транзакции {args.commit_delay_ms} мс")
+        print(f"{'режим':>8} {'потоков':>8} {'продаж':>7} {'транзакций':>11} {'продаж/с':>9} "
+              f"{'p50 мс':>7} {'p95 мс':>7}  все записаны")
+        failed = False
+        for threads in args.threads:
+            for mode in ("single", "group"):
+                r = run(template, workdir, mode, threads, args.sales, args.commit_delay_ms / 1000)
+                failed |= not r["consistent"]
+                print(f"{r['mode']:>8} {r['threads']:>8} {r['sales']:>7} {r['transactions']:>11} "
+                      f"{r['sales_per_sec']:>9} {r['p50_ms']:>7} {r['p95_ms']:>7}  {'да' if r['consistent'] else 'НЕТ'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
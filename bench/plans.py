@@ -0,0 +1,74 @@
+"""Проверка планов запросов: отчёты и страница истории не читают sales/sale_items полным проходом.
+
+Без --db генерирует БД (bench.generate) во временном каталоге и переносит
+закрытые месяцы в архивы, чтобы запросы шли и через представления all_*.
+Печатает EXPLAIN QUERY PLAN проблемных запросов и завершается с кодом 1,
+если хотя бы один из них сканирует таблицу фактов без индекса.
+
+    python -m bench.plans --db bench.sqlite3
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import archive
+import db
+
+
+def history_queries(conn):
+    """Варианты страницы истории: первая, глубже по ключу, назад, с фильтрами."""
+    import main
+
+    last = conn.execute("SELECT MAX(datetime), MAX(id) FROM all_sales").fetchone()
+    key = (last[0] or "2024-01-01 00:00:00", last[1] or 0)
+    day = key[0][:10]
+    variants = {
+        "history.first": {},
+        "history.after": {"after": key},
+        "history.before": {"before": key},
+        "history.period": {"filters": {"date_from": day[:8] + "01", "date_to": day}},
+        "history.employee": {"filters": {"employee_id": 1}},
+        "history.customer": {"filters": {"customer_id": 1}, "after": key},
+    }
+    return {name: main.sales_page_query(conn, **kwargs) for name, kwargs in variants.items()}
+
+
+def check(path):
+    import main
+
+    db.configure(path)
+    main.bootstrap()
+    with db.connection() as conn:
+        last = conn.execute("SELECT MAX(datetime) FROM all_sales").fetchone()[0]
+        year, month = (int(part) for part in (last or datetime.now().strftime("%Y-%m")).split("-")[:2])
+        print(f"архивов подключено: {len(db.archived_selects(conn, 'sales')) - 1}")
+        problems = main.report_plan_problems(conn, year, month) + main.plan_problems(conn, history_queries(conn))
+    db.get_pool().close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="БД для проверки (по умолчанию — сгенерированная с архивами)")
+    parser.add_argument("--sales", type=int, default=20000, help="продаж в сгенерированной БД")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = args.db
+        if path is None:
+            from bench.generate import START_DATE, generate
+
+            path = os.path.join(workdir, "plans.sqlite3")
+            generate(path, products=1000, customers=1000, sales=args.sales, days=800)
+            db.configure(path)
+            archive.run(keep_months=3, now=START_DATE.replace(year=START_DATE.year + 2, month=3))
+        problems = check(path)
+    for name, detail in problems:
+        print(f"ОШИБКА: {name}: {detail}")
+    print("полных проходов нет" if not problems else f"полных проходов: {len(problems)}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
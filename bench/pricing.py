@@ -0,0 +1,106 @@
+"""Время расчёта корзины pricing.quote при множестве правил скидок.
+
+Правила и корзина генерируются (без БД): правила на категории, товары,
+покупателя, по дням недели и часам, часть — с периодом действия. Выводит
+среднее и p99 времени одного расчёта, а также проверку: скидка каждой позиции
+равна наибольшей из подходящих правил (или базовой), посчитанной построчно на
+Python.
+
+    python -m bench.pricing --lines 100 --rules 40 --repeat 2000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pricing
+
+CATEGORIES = 20
+PRODUCTS = 10000
+CUSTOMERS = 5000
+
+
+def make_rules(count, rng, now):
+    rows = []
+    for rule_id in range(1, count + 1):
+        kind = rng.choice(("category", "product", "customer", "happy_hour", "weekend"))
+        starts = (now - timedelta(days=rng.randint(0, 30))).strftime("%Y-%m-%d") if rng.random() < 0.5 else None
+        ends = (now + timedelta(days=rng.randint(-3, 30))).strftime("%Y-%m-%d") if rng.random() < 0.5 else None
+        rows.append((
+            rule_id, f"Акция {rule_id}", rng.choice((5, 12.5, 15, 20, 30)),
+            rng.randint(1, CATEGORIES) if kind in ("category", "happy_hour", "weekend") else None,
+            rng.randint(1, PRODUCTS) if kind == "product" else None,
+            rng.randint(1, CUSTOMERS) if kind == "customer" else None,
+            starts, ends,
+            "67" if kind == "weekend" else None,
+            *((rng.randint(0, 23), rng.randint(0, 23)) if kind == "happy_hour" else (None, None)),
+        ))
+    return rows
+
+
+def reference(rows, lines, customer_id, moment):
+    """Та же скидка построчно, без NumPy: правило за правилом."""
+    stamp = moment.strftime("%Y-%m-%d %H:%M:%S")
+    discounts = []
+    for product_id, quantity, price, category_id in lines:
+        best = pricing.BASE_PERCENT * pricing.BASIS_POINTS
+        for _, _, percent, category, product, customer, starts, ends, weekdays, hour_from, hour_to in rows:
+            start, end = (0 if hour_from is None else hour_from), (24 if hour_to is None else hour_to)
+            in_hours = start <= moment.hour < end if start <= end else (moment.hour >= start or moment.hour < end)
+            if ((starts or "") <= stamp < (ends or "9999") and in_hours
+                    and (not weekdays or str(moment.weekday() + 1) in weekdays)
+                    and category in (None, category_id) and product in (None, product_id)
+                    and customer in (None, customer_id)):
+                best = max(best, round(percent * pricing.BASIS_POINTS))
+        discounts.append((quantity * price * best + 5000) // 10000)
+    return discounts
+
+
+def run(lines=100, rules=40, repeat=2000, seed=1):
+    rng = random.Random(seed)
+    now = datetime(2025, 5, 17, 18, 30)  # суббота, вечер: действуют и часы, и выходные
+    rows = make_rules(rules, rng, now)
+    compiled = pricing.Rules(rows, version=0)
+    # Товары корзины берутся из правил, чтобы правила на товар тоже срабатывали
+    products = [row[4] for row in rows if row[4]] + rng.sample(range(1, PRODUCTS + 1), lines)
+    basket = [(product_id, rng.randint(1, 5), rng.randint(1000, 200000), rng.randint(1, CATEGORIES))
+              for product_id in products[:lines]]
+    customer_id = next((row[5] for row in rows if row[5]), 1)
+
+    quote = pricing.quote(basket, customer_id, now, compiled)
+    consistent = [line[3] for line in quote.lines] == reference(rows, basket, customer_id, now)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pricing.quote(basket, customer_id, now, compiled)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return {
+        "lines": len(basket),
+        "rules": rules,
+        "active": int(compiled.active([customer_id], [now]).sum()),
+        "discounted": sum(line[3] > (line[1] * line[2] * pricing.BASE_PERCENT + 50) // 100 for line in quote.lines),
+        "mean_us": sum(timings) / len(timings),
+        "p99_us": timings[int(len(timings) * 0.99)],
+        "consistent": consistent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=100, help="позиций в корзине")
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 40, 100], help="число правил скидок")
+    parser.add_argument("--repeat", type=int, default=2000, help="повторов расчёта")
+    args = parser.parse_args()
+    failed = False
+    print(f"{'правил':>7} {'действует':>10} {'позиций':>8} {'со скидкой':>11} {'среднее мкс':>12} {'p99 мкс':>8}  сверка")
+    for rules in args.rules:
+        r = run(args.lines, rules, args.repeat)
+        failed |= not r["consistent"]
+        print(f"{r['rules']:>7} {r['active']:>10} {r['lines']:>8} {r['discounted']:>11} {r['mean_us']:>12.1f} "
+              f"{r['p99_us']:>8.1f}  {'да' if r['consistent'] else 'НЕТ'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Проверка синхронизации касс (replication.py) на локальных файлах.
+
+Создаёт центральную БД и несколько касс во временном каталоге, продаёт на
+каждой кассе, синхронизирует их через LoopbackTransport и проверяет:
+  * все продажи касс есть в центре, позиции и суммы совпадают;
+  * остаток в центре = начальный минус проданное всеми кассами;
+  * после pull остатки касс совпадают с центром;
+  * остатки центра и касс сходятся с их журналами движения (ledger.AUDIT_STOCK);
+  * потерянный ответ на push и повтор уже применённой пачки ничего не дублируют;
+  * повторный sync ничего не отправляет;
+  * покупатели центра и касс получают id из своих диапазонов, а покупатель
+    кассы, чей id в центре занят другими данными, отклоняет push, а не
+    теряется и не затирается при pull;
+  * продажи центра (окно продажи и загрузка журнала) не занимают id касс,
+    продажа кассы с занятым в центре id отклоняет push, а повтор пачки
+    не возвращает в рабочую БД центра уже перенесённую в архив продажу.
+Печатает объём переданных данных и завершается с кодом 1 при расхождении.
+
+    python -m bench.replication_check --tills 2 --sales 300
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+
+import catalog
+import db
+import ledger
+import replication
+
+STOCK = 10 ** 5
+
+
+class FlakyTransport(replication.LoopbackTransport):
+    """Теряет ответ на первый push (центр его уже применил) и запоминает отправленные пачки."""
+
+    def __init__(self, central_path):
+        super().__init__(central_path)
+        self.pushes = []
+        self.dropped = False
+
+    def request(self, payload):
+        reply = super().request(payload)
+        if replication.decode(payload)["type"] == "push":
+            self.pushes.append(payload)
+            if not self.dropped:
+                self.dropped = True
+                raise ConnectionError("ответ потерян")
+        return reply
+
+
+def sell(path, sales, seed):
+    import main
+
+    db.configure(path)
+    main.bootstrap()
+    catalog.invalidate("products", "customers", "employees")
+    rng = random.Random(seed)
+    products = [row[0] for row in main.get_products()]
+    customers = [row[0] for row in main.get_customers()]
+    employees = [row[0] for row in main.get_employees()]
+    main.add_customer(f"Покупатель кассы {seed}", f"+7{seed:010d}")
+    for _ in range(sales):
+        items = [(rng.choice(products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+        main.make_sale(items, rng.choice(customers), rng.choice(employees))
+
+
+def snapshot(conn, low=None, high=None):
+    where = "" if low is None else f"WHERE s.id BETWEEN {low} AND {high}"
+    sales = conn.execute(f"SELECT s.id, s.total_amount FROM sales s {where} ORDER BY s.id").fetchall()
+    items = conn.execute(f"""
+        SELECT si.sale_id, si.product_id, si.quantity, si.price
+        FROM sale_items si JOIN sales s ON s.id = si.sale_id {where}
+        ORDER BY 1, 2
+    """).fetchall()
+    return sales, items
+
+
+def customer_name(path, customer_id):
+    conn = db.connect(path)
+    try:
+        row = conn.execute("SELECT name FROM customers WHERE id = ?", (customer_id,)).fetchone()
+    finally:
+        conn.close()
+    return row and row[0]
+
+
+def customer_collisions(central, till_path):
+    """Покупатели, заведённые в центре и на кассе после синхронизации; занятый в центре id."""
+    import main
+
+    problems = []
+    db.configure(central)
+    central_id = main.add_customer("Покупатель центра", "+79990000000")
+    if central_id >= replication.TILL_ID_SPAN:
+        problems.append(f"покупатель центра получил id {central_id} из диапазона касс")
+
+    db.configure(till_path)
+    catalog.invalidate("products", "customers", "employees")
+    with db.connection() as conn:
+        low, high = replication.own_range(conn)
+    till_id = main.add_customer("Новый покупатель кассы", "+79990000001")
+    if not low <= till_id <= high:
+        problems.append(f"покупатель кассы получил id {till_id} вне её диапазона")
+    sale_id = main.make_sale([(main.get_products()[0][0], 1)], till_id, main.get_employees()[0][0])
+    # id, уже занятый в центре другим покупателем (как у центра до диапазонов): push должен отказать
+    taken_id = main.add_customer("Ещё покупатель кассы", "+79990000002")
+    db.get_pool().close()
+    central_conn = db.connect(central)
+    with central_conn:
+        central_conn.execute("INSERT INTO customers (id, name) VALUES (?, 'Чужой покупатель')", (taken_id,))
+    transport = replication.LoopbackTransport(central)
+    try:
+        replication.sync(transport, till_path)
+        problems.append(f"push покупателя {taken_id}, занятого в центре, не отклонён")
+    except Exception:
+        pass
+    with central_conn:
+        central_conn.execute("DELETE FROM customers WHERE id = ?", (taken_id,))
+    replication.sync(transport, till_path)
+    transport.close()
+
+    for customer_id, name in ((till_id, "Новый покупатель кассы"), (taken_id, "Ещё покупатель кассы")):
+        if customer_name(central, customer_id) != name:
+            problems.append(f"покупатель кассы {customer_id} в центре: {customer_name(central, customer_id)}")
+        if customer_name(till_path, customer_id) != name:
+            problems.append(f"покупатель кассы {customer_id} затёрт при pull: {customer_name(till_path, customer_id)}")
+    if customer_name(till_path, central_id) != "Покупатель центра":
+        problems.append("покупатель центра не дошёл до кассы")
+    if central_conn.execute("SELECT customer_id FROM sales WHERE id = ?", (sale_id,)).fetchone() != (till_id,):
+        problems.append(f"продажа {sale_id} в центре приписана не своему покупателю")
+    central_conn.close()
+    return problems
+
+
+def central_sales(central, till_path, workdir):
+    """Продажи центра после синхронизации кассы; занятый id продажи; повтор push после архивации."""
+    import ingest
+    import main
+
+    problems = []
+    db.configure(central)
+    catalog.invalidate("products", "customers", "employees")
+    product, customer, employee = main.get_products()[0][0], main.get_customers()[0][0], main.get_employees()[0][0]
+    sale_ids = [main.make_sale([(product, 1)], customer, employee)]
+    journal = os.path.join(workdir, "central.jsonl")
+    with open(journal, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"datetime": "2025-05-14 10:00:00", "customer_id": customer, "employee_id": employee,
+                            "items": [{"product_id": product, "quantity": 2}]}) + "\n")
+    ingest.ingest_sales(journal)
+    with db.connection() as conn:
+        sale_ids.append(conn.execute("SELECT MAX(id) FROM sales WHERE datetime = '2025-05-14 10:00:00'").fetchone()[0])
+    if any(sale_id >= replication.TILL_ID_SPAN for sale_id in sale_ids):
+        problems.append(f"продажи центра получили id из диапазона касс: {sale_ids}")
+    db.get_pool().close()
+
+    def till_sale():
+        db.configure(till_path)
+        catalog.invalidate("products", "customers", "employees")
+        sale_id = main.make_sale([(main.get_products()[1][0], 1)], main.get_customers()[0][0], employee)
+        db.get_pool().close()
+        return sale_id
+
+    sale_id = till_sale()
+    transport = FlakyTransport(central)
+    transport.dropped = True
+    replication.sync(transport, till_path)
+    central_conn = db.connect(central)
+    till_conn = db.connect(till_path)
+    low, high = replication.id_range(till_conn.execute("SELECT till_id FROM replica_state").fetchone()[0])
+    if snapshot(central_conn, low, high) != snapshot(till_conn):
+        problems.append(f"продажа кассы {sale_id} после продаж центра не совпадает с центром")
+
+    # Продажа ушла в архив центра, затем касса повторила пачку: в рабочую БД центра она не возвращается
+    with central_conn:
+        central_conn.execute("DELETE FROM sale_items WHERE sale_id = ?", (sale_id,))
+        central_conn.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
+    transport.request(transport.pushes[-1])
+    if central_conn.execute("SELECT 1 FROM sales WHERE id = ?", (sale_id,)).fetchone():
+        problems.append(f"повтор push вернул в рабочую БД центра продажу {sale_id}")
+
+    # id следующей продажи кассы уже занят в центре другой продажей: push должен отказать
+    with central_conn:
+        central_conn.execute("INSERT INTO sales (id, datetime, customer_id, employee_id, total_amount, total_kop) "
+                             "VALUES (?, '2025-05-14 11:00:00', ?, ?, 1, 100)", (sale_id + 1, customer, employee))
+    taken_id = till_sale()
+    try:
+        replication.sync(transport, till_path)
+        problems.append(f"push продажи {taken_id}, id которой занят в центре, не отклонён")
+    except Exception:
+        pass
+    with central_conn:
+        central_conn.execute("DELETE FROM sales WHERE id = ?", (taken_id,))
+    replication.sync(transport, till_path)
+    transport.close()
+    items = central_conn.execute("SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (taken_id,)).fetchall()
+    if items != till_conn.execute("SELECT product_id, quantity FROM sale_items WHERE sale_id = ?", (taken_id,)).fetchall():
+        problems.append(f"позиции продажи кассы {taken_id} в центре не совпадают с кассой")
+    if dict(central_conn.execute("SELECT id, stock FROM products")) != dict(till_conn.execute("SELECT id, stock FROM products")):
+        problems.append("остатки кассы после продаж центра не совпадают с центром")
+    central_conn.close()
+    till_conn.close()
+    return problems
+
+
+def check(tills=2, sales=300):
+    import main
+
+    problems = []
+    with tempfile.TemporaryDirectory() as workdir:
+        central = os.path.join(workdir, "central.sqlite3")
+        db.configure(central)
+        main.bootstrap()
+        with db.transaction() as conn:
+            before = ledger.stocks(conn)
+            conn.execute("UPDATE products SET stock = ?", (STOCK,))
+            ledger.record_changes(conn, before)
+        db.get_pool().close()
+
+        paths = {}
+        for till_id in range(1, tills + 1):
+            paths[till_id] = os.path.join(workdir, f"till_{till_id}.sqlite3")
+            replication.init_till(paths[till_id], till_id, main.SCHEMA)
+            db.configure(paths[till_id])
+            main.bootstrap()
+            transport = replication.LoopbackTransport(central)
+            replication.sync(transport, paths[till_id])  # первичная загрузка справочников и остатков
+            transport.close()
+            sell(paths[till_id], sales, till_id)
+            db.get_pool().close()
+
+        sent = received = 0
+        for till_id, path in paths.items():
+            transport = FlakyTransport(central)
+            try:
+                replication.sync(transport, path)
+                problems.append(f"касса {till_id}: потеря ответа не дошла до sync")
+            except ConnectionError:
+                pass
+            stats = replication.sync(transport, path)
+            # Повтор уже применённой пачки, как если бы сеть доставила её дважды
+            for payload in list(transport.pushes):
+                transport.request(payload)
+            again = replication.sync(transport, path)
+            if again["sales_sent"]:
+                problems.append(f"касса {till_id}: повторный sync отправил {again['sales_sent']} продаж")
+            sent += transport.sent_bytes
+            received += transport.received_bytes
+            transport.close()
+            print(f"касса {till_id}: отправлено продаж {stats['sales_sent']}, сообщений push с повторами {len(transport.pushes)}")
+        # Остатки центра изменили и другие кассы — ещё один круг pull
+        for path in paths.values():
+            transport = replication.LoopbackTransport(central)
+            replication.sync(transport, path)
+            transport.close()
+
+        central_conn = db.connect(central)
+        try:
+            sold = {}
+            for till_id, path in paths.items():
+                till_conn = db.connect(path)
+                try:
+                    local = snapshot(till_conn)
+                    low, high = replication.id_range(till_id)
+                    if snapshot(central_conn, low, high) != local:
+                        problems.append(f"касса {till_id}: продажи в центре не совпадают с кассой")
+                    if len(local[0]) != sales:
+                        problems.append(f"касса {till_id}: ожидалось {sales} продаж, на кассе {len(local[0])}")
+                    for _, product_id, quantity, _ in local[1]:
+                        sold[product_id] = sold.get(product_id, 0) + quantity
+                    till_stock = dict(till_conn.execute("SELECT id, stock FROM products"))
+                    if till_conn.execute(ledger.AUDIT_STOCK).fetchall():
+                        problems.append(f"касса {till_id}: остатки не сходятся с журналом движения")
+                finally:
+                    till_conn.close()
+                central_stock = dict(central_conn.execute("SELECT id, stock FROM products"))
+                if till_stock != central_stock:
+                    problems.append(f"касса {till_id}: остатки после pull не совпадают с центром")
+            wrong = [pid for pid, stock in central_conn.execute("SELECT id, stock FROM products")
+                     if stock != STOCK - sold.get(pid, 0)]
+            if wrong:
+                problems.append(f"остатки центра не сходятся с продажами: товаров {len(wrong)}")
+            if central_conn.execute(ledger.AUDIT_STOCK).fetchall():
+                problems.append("остатки центра не сходятся с журналом движения")
+        finally:
+            central_conn.close()
+        problems += customer_collisions(central, paths[1])
+        problems += central_sales(central, paths[1], workdir)
+    print(f"передано {sent} Б, принято {received} Б (сжатый JSON)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tills", type=int, default=2, help="число касс")
+    parser.add_argument("--sales", type=int, default=300, help="продаж на каждой кассе")
+    args = parser.parse_args()
+    problems = check(args.tills, args.sales)
+    for problem in problems:
+        print(f"ОШИБКА: {problem}")
+    print("расхождений нет" if not problems else f"расхождений: {len(problems)}")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
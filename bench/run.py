@@ -0,0 +1,130 @@
+"""Замеры основных сценариев приложения на БД, созданной bench.generate.
+
+Результат — JSON: параметры окружения и по каждому сценарию число прогонов,
+среднее, медиана, p95, минимум и максимум в миллисекундах. Файлы разных
+версий можно сравнивать между собой, чтобы ловить регрессии.
+
+    python -m bench.run bench.sqlite3 --out results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "runs": repeat,
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "min_ms": round(timings[0], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def cold_start(path):
+    """Запуск в новом процессе: импорт main и bootstrap() (схема, миграции, проверка CSV)."""
+    env = dict(os.environ, SUPERMARKET_DB=path)
+    subprocess.run([sys.executable, "-c", "import main; main.bootstrap()"], cwd=ROOT, env=env, check=True)
+
+
+def run(path, repeat=20, sales=200, seed=1):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        # make_sale меняет данные — работаем на копии
+        work = os.path.join(workdir, "bench.sqlite3")
+        shutil.copy(path, work)
+        results = {"cold_start": measure(lambda: cold_start(work), max(3, repeat // 5))}
+
+        db.configure(work)
+        import main
+        main.bootstrap()
+        results["init_db"] = measure(main.init_db, repeat)
+
+        with db.connection() as conn:
+            max_sale = conn.execute("SELECT MAX(id) FROM sales").fetchone()[0] or 0
+            last_day = conn.execute("SELECT MAX(datetime) FROM sales").fetchone()[0]
+            sizes = {
+                table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("products", "customers", "employees", "sales", "sale_items")
+            }
+        year, month = (int(part) for part in (last_day or "2024-01").split("-")[:2])
+        bounds = main.period_bounds(year, month)
+        for name, sql in main.REPORT_QUERIES.items():
+            params = bounds if "?" in sql else ()
+            results[name] = measure(lambda name=name, params=params: main.run_report(name, *params), repeat)
+
+        if max_sale:
+            results["receipt"] = measure(lambda: main.fetch_receipt(rng.randint(1, max_sale)), repeat)
+        results["history.first_page"] = measure(main.fetch_sales_page, repeat)
+        deep = main.fetch_sales_page(limit=main.HISTORY_PAGE_SIZE * 50)
+        if deep:
+            key = (deep[-1][1], deep[-1][0])
+            results["history.deep_page"] = measure(lambda: main.fetch_sales_page(after=key), repeat)
+
+        in_stock = [p[0] for p in main.get_products() if p[3] >= 1000]
+        if not in_stock:
+            with db.transaction() as conn:
+                conn.execute("UPDATE products SET stock = stock + 100000")
+            main.catalog.invalidate("products")
+            in_stock = [p[0] for p in main.get_products()]
+        customers = [c[0] for c in main.get_customers()]
+        employees = [e[0] for e in main.get_employees()]
+
+        def sell():
+            items = [(pid, 1) for pid in rng.sample(in_stock, min(4, len(in_stock)))]
+            main.make_sale(items, rng.choice(customers), rng.choice(employees))
+
+        results["make_sale"] = measure(sell, sales)
+        db.get_pool().close()
+
+    return {
+        "meta": {
+            "database": os.path.abspath(path),
+            "sizes": sizes,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="БД, созданная bench.generate")
+    parser.add_argument("--repeat", type=int, default=20, help="прогонов каждого сценария")
+    parser.add_argument("--sales", type=int, default=200, help="продаж в сценарии make_sale")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args.path, repeat=args.repeat, sales=args.sales), ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Проверка холодного старта: время импорта main и bootstrap() в новом процессе.
+
+Импорт замеряется через python -X importtime. Скрипт печатает самые дорогие
+модули и завершается с кодом 1, если превышен бюджет или при импорте main
+подгрузился модуль из FORBIDDEN (тяжёлые зависимости должны грузиться лениво).
+
+    python -m bench.startup --db bench.sqlite3 --budget-ms 1000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Не должны импортироваться вместе с main: нужны только окнам или вовсе не нужны
+FORBIDDEN = ("pandas", "numpy", "ttkbootstrap", "PIL")
+
+
+def import_times(code="import main", env=None):
+    """{модуль: (собственное время, накопленное время) в мкс} по выводу -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():
+            times[name] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def cold_start_ms(env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main; main.bootstrap()"], cwd=ROOT, env=env, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def check(path=None, budget_ms=1000, top=10):
+    """Печатает отчёт; возвращает список нарушений (пустой — всё в порядке)."""
+    with tempfile.TemporaryDirectory() as workdir:
+        # Без --db проверяется старт на новой БД: схема и импорт CSV с нуля
+        env = dict(os.environ, SUPERMARKET_DB=path or os.path.join(workdir, "startup.sqlite3"))
+        times = import_times(env=env)
+        first_ms = cold_start_ms(env)
+        warm_ms = cold_start_ms(env)
+
+    problems = []
+    main_ms = times.get("main", (0, 0))[1] / 1000
+    print(f"Импорт main: {main_ms:.1f} мс")
+    for name, (_, cumulative) in sorted(times.items(), key=lambda item: -item[1][1])[:top]:
+        print(f"  {cumulative / 1000:8.1f} мс  {name}")
+    print(f"Процесс с bootstrap(): первый запуск {first_ms:.0f} мс, повторный {warm_ms:.0f} мс")
+
+    loaded = sorted({name.split(".")[0] for name in times} & set(FORBIDDEN))
+    if loaded:
+        problems.append(f"при импорте main загружены тяжёлые модули: {', '.join(loaded)}")
+    if warm_ms > budget_ms:
+        problems.append(f"холодный старт {warm_ms:.0f} мс превышает бюджет {budget_ms} мс")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="БД для замера (по умолчанию — новая во временном каталоге)")
+    parser.add_argument("--budget-ms", type=int, default=1000, help="допустимое время повторного запуска")
+    args = parser.parse_args()
+    problems = check(args.db, budget_ms=args.budget_ms)
+    for problem in problems:
+        print(f"ОШИБКА: {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Нагрузочный тест продаж с нескольких касс.
+
+Каждая касса — отдельный процесс со своим пулом соединений к общему файлу БД.
+Все кассы одновременно продают один и тот же товар, остатка которого заведомо
+не хватает на всех. Тест проверяет, что склад не ушёл в минус и каждая списанная
+единица соответствует строке в sale_items, и выводит пропускную способность.
+
+    python -m bench.stress_sales --tills 1 2 4 8 --sales 200 --stock 500
+"""
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import db
+
+PRODUCT_ID = 1
+CUSTOMER_ID = 1
+EMPLOYEE_ID = 1
+
+
+def prepare_template(path):
+    """Создаёт БД со схемой и справочниками из CSV."""
+    db.configure(path)
+    import main
+    main.bootstrap()
+    with db.connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.get_pool().close()
+
+
+def till(path, barrier, sales, results):
+    db.configure(path)
+    import main
+    barrier.wait()
+    sold = rejected = 0
+    start = time.perf_counter()
+    for _ in range(sales):
+        try:
+            main.make_sale([(PRODUCT_ID, 1)], CUSTOMER_ID, EMPLOYEE_ID)
+            sold += 1
+        except Exception as ex:
+            if "Недостаточно" not in str(ex):
+                raise
+            rejected += 1
+    results.put((sold, rejected, time.perf_counter() - start))
+
+
+def run(template, workdir, tills, sales, stock):
+    path = os.path.join(workdir, f"tills_{tills}.sqlite3")
+    shutil.copy(template, path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE products SET stock = ? WHERE id = ?", (stock, PRODUCT_ID))
+
+    barrier = mp.Barrier(tills)
+    results = mp.Queue()
+    procs = [mp.Process(target=till, args=(path, barrier, sales, results)) for _ in range(tills)]
+    for proc in procs:
+        proc.start()
+    stats = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    sold = sum(s[0] for s in stats)
+    rejected = sum(s[1] for s in stats)
+    elapsed = max(s[2] for s in stats)
+    with sqlite3.connect(path) as conn:
+        left = conn.execute("SELECT stock FROM products WHERE id = ?", (PRODUCT_ID,)).fetchone()[0]
+        recorded = conn.execute(
+            "SELECT COALESCE(SUM(quantity), 0) FROM sale_items WHERE product_id = ?", (PRODUCT_ID,)
+        ).fetchone()[0]
+    consistent = left >= 0 and recorded == sold == stock - left
+    return {
+        "tills": tills,
+        "sold": sold,
+        "rejected": rejected,
+        "stock_left": left,
+        "consistent": consistent,
+        "sales_per_sec": round(sold / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tills", type=int, nargs="+", default=[1, 2, 4, 8], help="число касс в каждом прогоне")
+    parser.add_argument("--sales", type=int, default=200, help="попыток продажи на одну кассу")
+    parser.add_argument("--stock", type=int, default=500, help="начальный остаток товара")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        template = os.path.join(workdir, "template.sqlite3")
+        prepare_template(template)
+        print(f"{'касс':>5} {'продано':>8} {'отказов':>8} {'остаток':>8} {'продаж/с':>9}  без перепродажи")
+        failed = False
+        for tills in args.tills:
+            r = run(template, workdir, tills, args.sales, args.stock)
+            failed |= not r["consistent"]
+            print(f"{r['tills']:>5} {r['sold']:>8} {r['rejected']:>8} {r['stock_left']:>8} "
+                  f"{r['sales_per_sec']:>9}  {'да' if r['consistent'] else 'НЕТ'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
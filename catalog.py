@@ -0,0 +1,87 @@
+"""Кэш справочников в памяти процесса; пути записи вызывают invalidate(), и таблица перечитывается."""
+import bisect
+import threading
+
+import db
+import metrics
+
+QUERIES = {
+    "products": "SELECT id, name, price, stock, category_id FROM products",
+    "customers": "SELECT id, name FROM customers",
+    "employees": "SELECT id, name, role FROM employees",
+    # Правила скидок (pricing.py), таблица миграции 5
+    "promotions": "SELECT id, name, percent, category_id, product_id, customer_id, starts_at, ends_at, "
+                  "weekdays, hour_from, hour_to FROM promotions",
+}
+# Триграммные FTS5-индексы (миграция 3): поиск по подстроке от 3 символов
+FTS_TABLES = {"products": "products_fts", "customers": "customers_fts"}
+SEARCH_LIMIT = 20
+
+_lock = threading.Lock()
+_versions = {name: 0 for name in QUERIES}
+_tables = {}
+
+
+class Table:
+    """Снимок справочника: строки в порядке БД, индекс по id и по имени."""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.rows = rows
+        self.by_id = {row[0]: row for row in rows}
+        self._names = sorted(((row[1] or "").lower(), row[0]) for row in rows)
+
+    def prefix(self, text, limit=20):
+        """Строки, имя которых начинается с text (без учёта регистра), в алфавитном порядке."""
+        text = text.lower()
+        found = []
+        for name, row_id in self._names[bisect.bisect_left(self._names, (text,)):]:
+            if not name.startswith(text) or len(found) == limit:
+                break
+            found.append(self.by_id[row_id])
+        return found
+
+
+def table(name):
+    with _lock:
+        version = _versions[name]
+        cached = _tables.get(name)
+    if cached is not None and cached.version == version:
+        return cached
+    with db.connection() as conn:
+        cached = Table(metrics.fetchall(conn, f"catalog.{name}", QUERIES[name]), version)
+    with _lock:
+        # За время чтения таблицу могли изменить — тогда снимок не сохраняем
+        if _versions[name] == version:
+            _tables[name] = cached
+    return cached
+
+
+def invalidate(*names):
+    with _lock:
+        for name in names:
+            if name in _versions:
+                _versions[name] += 1
+
+
+def search(name, text, limit=SEARCH_LIMIT):
+    """Подбор строк по вводу: число — как id, короче 3 символов — по префиксу имени, иначе через FTS5."""
+    snapshot = table(name)
+    text = text.strip()
+    if not text:
+        return snapshot.rows[:limit]
+    found = []
+    if text.isdigit() and int(text) in snapshot.by_id:
+        found.append(snapshot.by_id[int(text)])
+    fts = FTS_TABLES.get(name)
+    if fts is None or len(text) < 3:
+        matches = snapshot.prefix(text, limit)
+    else:
+        phrase = '"' + text.replace('"', '""') + '"'
+        with db.connection() as conn:
+            ids = metrics.fetchall(
+                conn, f"search.{name}", f"SELECT rowid FROM {fts} WHERE {fts} MATCH ? LIMIT ?", (phrase, limit)
+            )
+        matches = [snapshot.by_id[row_id] for (row_id,) in ids if row_id in snapshot.by_id]
+    found.extend(row for row in matches if row not in found)
+    return found[:limit]
@@ -0,0 +1,390 @@
+import glob
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# --- Конфигурация ---
+# SUPERMARKET_DB позволяет запустить кассу или бенчмарк на другом файле БД
+DB_PATH = os.environ.get("SUPERMARKET_DB") or os.path.join(os.path.dirname(__file__), "db.sqlite3")
+POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256  # подготовленные выражения, живущие вместе с соединением
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA cache_size = -32000",  # ~32 МБ страничного кэша
+    "PRAGMA mmap_size = 268435456",  # 256 МБ
+    "PRAGMA busy_timeout = 5000",
+)
+BUSY_RETRIES = 5  # повторы транзакции, если БД занята дольше busy_timeout
+BUSY_BACKOFF = 0.05  # начальная пауза между повторами, сек.; удваивается с каждой попыткой
+ARCHIVED_TABLES = ("sales", "sale_items")  # таблицы, закрытые периоды которых уходят в архив (archive.py)
+GROUP_COMMIT_MAX = 64  # заданий в одной транзакции группой фиксации
+GROUP_COMMIT_WAIT = 0.001  # сколько, сек., пачка ждёт попутчиков после первого задания
+
+
+# --- Пул соединений ---
+class Connection(sqlite3.Connection):
+    """Соединение с атрибутами подключённых архивов (attach_archives); запросы выполняются как есть."""
+
+
+def connect(path=None):
+    """Новое соединение в режиме autocommit с применёнными PRAGMA."""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        factory=Connection,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+        isolation_level=None,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    attach_archives(conn, path or DB_PATH)
+    return conn
+
+
+# --- Архивы закрытых периодов ---
+# Архивы прошлых лет (db.archive_<год>.sqlite3) подключаются через ATTACH; представления
+# all_sales, all_sale_items и all_sale_lines объединяют их с рабочей БД (UNION ALL).
+# ORDER BY ... LIMIT по всей истории строится по веткам archived_selects().
+ARCHIVE_CHECK_INTERVAL = 5.0  # как часто, сек., искать архивы, созданные другим процессом
+_archive_generation = 0
+_archive_files = {}  # путь БД -> (время проверки, файлы архивов)
+# Суммы в копейках (миграция 5) для архивных строк, записанных до неё, выводятся из рублёвых
+DERIVED_COLUMNS = {
+    "total_kop": "CAST(ROUND(total_amount * 100) AS INTEGER)",
+    "price_kop": "CAST(ROUND(price * 100) AS INTEGER)",
+    "discount_kop": "(quantity * CAST(ROUND(price * 100) AS INTEGER) + 5) / 10",  # прежняя скидка 10%
+}
+SALE_LINE_COLUMNS = {
+    "sales": ("total_amount", "total_kop"),
+    "sale_items": ("product_id", "quantity", "price", "price_kop", "discount_kop"),
+}
+
+
+def archive_path(year, path=None):
+    base, ext = os.path.splitext(path or DB_PATH)
+    return f"{base}.archive_{year}{ext}"
+
+
+def archive_paths(path=None):
+    """{год: файл} существующих архивов БД path по возрастанию года."""
+    base, ext = os.path.splitext(path or DB_PATH)
+    found = {}
+    for file in glob.glob(glob.escape(base) + ".archive_*" + glob.escape(ext)):
+        year = file[len(base) + len(".archive_"):len(file) - len(ext)]
+        if year.isdigit():
+            found[int(year)] = file
+    return dict(sorted(found.items()))
+
+
+def current_archives(path):
+    """Файлы архивов БД path; каталог перечитывается не чаще раза в ARCHIVE_CHECK_INTERVAL."""
+    checked = _archive_files.get(path)
+    now = time.monotonic()
+    if checked is None or now - checked[0] >= ARCHIVE_CHECK_INTERVAL:
+        checked = _archive_files[path] = (now, tuple(archive_paths(path).values()))
+    return checked[1]
+
+
+def refresh_archives():
+    """Появился новый архив или таблицы: соединения пула переподключат архивы при следующей выдаче."""
+    global _archive_generation
+    _archive_generation += 1
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def attach_archives(conn, path=None):
+    """Подключает к conn архивы и (пере)создаёт представления all_*."""
+    conn.archive_generation = _archive_generation
+    conn.archive_selects = {}
+    files = archive_paths(path)
+    conn.archive_files = tuple(files.values())
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    schemas = ["main"]
+    for year, file in files.items():
+        schema = f"archive_{year}"
+        if schema not in attached:
+            conn.execute("ATTACH DATABASE ? AS " + schema, (file,))
+        schemas.append(schema)
+
+    main_columns = {table: _columns(conn, "main", table) for table in ARCHIVED_TABLES}
+    if not all(main_columns.values()):
+        return  # новая БД: таблиц ещё нет, представления появятся после init_db()
+
+    present = {(schema, table): set(_columns(conn, schema, table)) for schema in schemas for table in ARCHIVED_TABLES}
+
+    def column(schema, table, col, alias=""):
+        # Колонки, добавленные в рабочую БД после создания архива, в архиве читаются как NULL
+        # или выводятся по DERIVED_COLUMNS
+        derived = DERIVED_COLUMNS.get(col) if schema != "main" else None
+        if col in present[schema, table]:
+            return f"COALESCE({alias}{col}, {derived}) AS {col}" if derived else f"{alias}{col}"
+        return f"{derived or 'NULL'} AS {col}"
+
+    def select(schema, table):
+        return ", ".join(column(schema, table, col) for col in main_columns[table])
+
+    conn.archive_selects = {
+        table: [f"SELECT {select(schema, table)} FROM {schema}.{table}" for schema in schemas]
+        for table in ARCHIVED_TABLES
+    }
+    views = {f"all_{table}": " UNION ALL ".join(selects) for table, selects in conn.archive_selects.items()}
+
+    def line_select(schema):
+        return ", ".join(
+            column(schema, table, col, alias)
+            for table, alias in (("sales", "s."), ("sale_items", "si."))
+            for col in SALE_LINE_COLUMNS[table] if col in main_columns[table]
+        )
+
+    views["all_sale_lines"] = " UNION ALL ".join(f"""
+        SELECT s.id AS sale_id, s.datetime, s.customer_id, s.employee_id, {line_select(schema)}
+        FROM {schema}.sales s JOIN {schema}.sale_items si ON si.sale_id = s.id""" for schema in schemas)
+    for name, sql in views.items():
+        conn.execute(f"DROP VIEW IF EXISTS temp.{name}")
+        conn.execute(f"CREATE TEMP VIEW {name} AS {sql}")
+
+
+class ConnectionPool:
+    """Ограниченный пул: не больше size соединений, свободные переиспользуются."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("Нет свободных соединений с БД")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return connect(self.path)
+            except Exception:
+                self._slots.release()
+                raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path):
+    """Переключает модуль на другой файл БД (тесты, бенчмарки, отдельная касса)."""
+    global DB_PATH, _pool
+    close_group_writer()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        DB_PATH = path
+        _pool = None
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+_local = threading.local()
+
+
+def archived_selects(conn, table):
+    """Ветки представления all_{table}: SELECT колонок table из рабочей БД и из каждого архива."""
+    return conn.archive_selects[table]
+
+
+def _fresh(conn):
+    # ATTACH внутри транзакции невозможен — тогда архивы подключатся при следующей выдаче
+    if conn.in_transaction:
+        return conn
+    path = get_pool().path
+    if conn.archive_generation != _archive_generation or conn.archive_files != current_archives(path):
+        attach_archives(conn, path)
+    return conn
+
+
+def pin_connection():
+    """Закрепляет за долгоживущим потоком соединение из пула: connection() будет отдавать его же."""
+    if getattr(_local, "conn", None) is None:
+        _local.conn = get_pool().acquire()
+    return _fresh(_local.conn)
+
+
+def unpin_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        get_pool().release(conn)
+
+
+@contextmanager
+def connection():
+    """Соединение из пула на время блока with (autocommit, для чтения)."""
+    pinned = getattr(_local, "conn", None)
+    if pinned is not None:
+        yield _fresh(pinned)
+        return
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield _fresh(conn)
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(immediate=True):
+    """Соединение из пула внутри одной транзакции: COMMIT при успехе, ROLLBACK при ошибке."""
+    # BEGIN IMMEDIATE сразу берёт блокировку на запись: кассы не упрутся в SQLITE_BUSY посреди транзакции
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def is_busy(exc):
+    """SQLITE_BUSY/SQLITE_LOCKED: другая касса держит блокировку на запись."""
+    return isinstance(exc, sqlite3.OperationalError) and "locked" in str(exc)
+
+
+def run_in_transaction(work, immediate=True, retries=BUSY_RETRIES):
+    """Выполняет work(conn) в транзакции, повторяя её с экспоненциальной паузой при SQLITE_BUSY."""
+    for attempt in range(retries + 1):
+        try:
+            with transaction(immediate) as conn:
+                return work(conn)
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc) or attempt == retries:
+                raise
+            time.sleep(BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+# --- Групповая фиксация ---
+class GroupCommitWriter:
+    """Поток-писатель: задания из очереди выполняются пачками (до max_batch или wait сек.), одна транзакция на пачку."""
+
+    def __init__(self, max_batch=GROUP_COMMIT_MAX, wait=GROUP_COMMIT_WAIT):
+        self.max_batch = max_batch
+        self.wait = wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, work):
+        """Ставит work(conn) в очередь; возвращает Future с его результатом."""
+        future = Future()
+        self._queue.put((work, future))
+        return future
+
+    def close(self):
+        """Фиксирует уже поставленные задания и останавливает поток."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.wait
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)  # остановка — после этой пачки
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self):
+        pin_connection()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                batch = [(work, future) for work, future in batch if future.set_running_or_notify_cancel()]
+                if batch:
+                    self._flush(batch)
+        finally:
+            unpin_connection()
+
+    def _flush(self, batch):
+        def work_all(conn):
+            outcomes = []
+            # Каждое задание — в своей точке сохранения: ошибка откатывает только его
+            for work, _ in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((True, work(conn)))
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    outcomes.append((False, exc))
+                conn.execute("RELEASE job")
+            return outcomes
+
+        try:
+            outcomes = run_in_transaction(work_all)
+        except Exception as exc:
+            # Пачка не зафиксирована: ни одно задание не выполнено
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for (ok, value), (_, future) in zip(outcomes, batch):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_writer = None
+
+
+def group_writer():
+    """Общий поток-писатель процесса; создаётся при первом обращении."""
+    global _writer
+    with _pool_lock:
+        if _writer is None:
+            _writer = GroupCommitWriter()
+        return _writer
+
+
+def close_group_writer():
+    global _writer
+    with _pool_lock:
+        writer, _writer = _writer, None
+    # Поток берёт соединение из пула под той же блокировкой — ждём его вне её
+    if writer is not None:
+        writer.close()
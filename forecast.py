@@ -0,0 +1,97 @@
+"""Прогноз расхода товаров по daily_product_agg: скорость продаж, дни запаса и точка заказа (product_forecast)."""
+import json
+import math
+import time
+from datetime import datetime, timedelta
+
+import db
+import metrics
+
+WINDOW_DAYS = 28  # окно скользящей скорости продаж
+LEAD_TIME_DAYS = 3  # срок поставки
+SAFETY_Z = 1.65  # страховой запас: ~95% дней без дефицита при нормальном спросе
+
+
+def compute(product_ids, stocks, demand, days):
+    """Строки product_forecast по demand = [(product_id, day, quantity)] за дни days; пропуски — нули."""
+    import numpy as np  # нужен только задаче прогноза, не окнам
+
+    rows = {product_id: index for index, product_id in enumerate(product_ids)}
+    columns = {day: index for index, day in enumerate(days)}
+    demand = [row for row in demand if row[0] in rows and row[1] in columns]
+    daily = np.zeros((len(product_ids), len(days)))
+    if demand:
+        np.add.at(
+            daily,
+            (np.fromiter((rows[row[0]] for row in demand), dtype=np.intp, count=len(demand)),
+             np.fromiter((columns[row[1]] for row in demand), dtype=np.intp, count=len(demand))),
+            np.fromiter((row[2] or 0 for row in demand), dtype=float, count=len(demand)),
+        )
+    velocity = daily.mean(axis=1)
+    sigma = daily.std(axis=1)
+    stock = np.maximum(np.asarray(stocks, dtype=float), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_left = np.where(velocity > 0, stock / velocity, np.nan)
+    # Точка заказа — спрос за срок поставки плюс страховой запас; у товара без продаж её нет (NULL)
+    reorder_point = np.ceil(velocity * LEAD_TIME_DAYS + SAFETY_Z * sigma * math.sqrt(LEAD_TIME_DAYS))
+    return [
+        (product_id, round(v, 4), None if math.isnan(left) else round(left, 1), int(point) if v > 0 else None)
+        for product_id, v, left, point in zip(product_ids, velocity.tolist(), days_left.tolist(), reorder_point.tolist())
+    ]
+
+
+def run(now=None):
+    """Обновляет product_forecast; возвращает статистику запуска."""
+    start = time.perf_counter()
+    now = now or datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    days = [(now - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(WINDOW_DAYS - 1, -1, -1)]
+
+    with db.connection() as conn:
+        state = conn.execute("SELECT last_sale_id, last_day FROM forecast_state WHERE id = 1").fetchone()
+        last_sale_id, last_day = state or (0, None)
+        max_sale_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+        # В тот же день пересчитываются только товары из новых продаж, со сменой дня — все
+        full = last_day != today
+        if not full and max_sale_id == last_sale_id:
+            return {"products": 0, "full": False, "seconds": time.perf_counter() - start}
+
+        if full:
+            products = metrics.fetchall(conn, "forecast.products", "SELECT id, stock FROM products ORDER BY id")
+            demand = metrics.fetchall(conn, "forecast.demand", """
+                SELECT product_id, day, quantity FROM daily_product_agg WHERE day >= ? AND day <= ?
+            """, (days[0], today))
+        else:
+            # Только товары из новых продаж: их набор передаётся одним параметром через json_each
+            changed = json.dumps([row[0] for row in conn.execute(
+                "SELECT DISTINCT product_id FROM sale_items WHERE sale_id > ? AND sale_id <= ?",
+                (last_sale_id, max_sale_id)
+            )])
+            products = metrics.fetchall(conn, "forecast.products", """
+                SELECT id, stock FROM products WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+            """, (changed,))
+            demand = metrics.fetchall(conn, "forecast.demand", """
+                SELECT product_id, day, quantity FROM daily_product_agg
+                WHERE day >= ? AND day <= ? AND product_id IN (SELECT value FROM json_each(?))
+            """, (days[0], today, changed))
+
+    rows = compute([p[0] for p in products], [p[1] or 0 for p in products], demand, days) if products else []
+    updated_at = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    def work(conn):
+        conn.executemany("""
+            INSERT INTO product_forecast (product_id, velocity, days_left, reorder_point, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(product_id) DO UPDATE SET
+                velocity = excluded.velocity,
+                days_left = excluded.days_left,
+                reorder_point = excluded.reorder_point,
+                updated_at = excluded.updated_at
+        """, [row + (updated_at,) for row in rows])
+        conn.execute("""
+            INSERT INTO forecast_state (id, last_sale_id, last_day) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET last_sale_id = excluded.last_sale_id, last_day = excluded.last_day
+        """, (max_sale_id, today))
+
+    db.run_in_transaction(work)
+    return {"products": len(rows), "full": full, "seconds": time.perf_counter() - start}
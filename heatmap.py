@@ -0,0 +1,101 @@
+"""Тепловая карта продаж: день недели × час за произвольный период, с архивами."""
+import threading
+import time
+from collections import OrderedDict
+
+import db
+import metrics
+
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+HOURS = 24
+FETCH_SIZE = 20000
+CACHE_SIZE = 16
+QUERY = """
+    SELECT sale_id, datetime, total_kop, quantity
+    FROM all_sale_lines
+    WHERE datetime >= ? AND datetime < ?
+"""
+# Показатели карты: ключ результата -> подпись
+MEASURES = {
+    "revenue": "Выручка",
+    "sales": "Продаж",
+    "avg_check": "Средний чек",
+    "basket": "Товаров в корзине",
+}
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def compute(sale_ids, moments, totals, quantities):
+    """Показатели по ячейкам 7 × 24 из массивов позиций; totals в копейках, выручка — в рублях."""
+    import numpy as np  # нужен только отчёту, не окнам
+
+    days = moments.astype("datetime64[D]")
+    hours = (moments - days) // np.timedelta64(1, "h")
+    weekdays = (days.astype(np.int64) + 3) % 7  # 1970-01-01 — четверг
+    cells = weekdays * HOURS + hours
+    size = len(WEEKDAYS) * HOURS
+
+    # Продажа учитывается в ячейке один раз (по первой позиции), количество товара — по всем
+    _, first = np.unique(sale_ids, return_index=True)
+    sales = np.bincount(cells[first], minlength=size).astype(float)
+    revenue = np.bincount(cells[first], weights=totals[first], minlength=size) / 100
+    items = np.bincount(cells, weights=quantities, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_check = np.where(sales > 0, revenue / sales, 0.0)
+        basket = np.where(sales > 0, items / sales, 0.0)
+    shape = (len(WEEKDAYS), HOURS)
+    return {
+        "revenue": revenue.reshape(shape),
+        "sales": sales.reshape(shape),
+        "avg_check": avg_check.reshape(shape),
+        "basket": basket.reshape(shape),
+    }
+
+
+def _read(conn, date_from, date_to):
+    """Позиции периода в массивы NumPy одним потоковым проходом."""
+    import numpy as np
+
+    parts = ([], [], [], [])
+    cursor = conn.execute(QUERY, (date_from, date_to))
+    while True:
+        chunk = cursor.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+        sale_ids, moments, totals, quantities = zip(*chunk)
+        parts[0].append(np.array(sale_ids, dtype=np.int64))
+        parts[1].append(np.array(moments, dtype="datetime64[s]"))
+        parts[2].append(np.array(totals, dtype=np.int64))
+        parts[3].append(np.array(quantities, dtype=float))
+    if not parts[0]:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype="datetime64[s]"), np.zeros(0, dtype=np.int64), np.zeros(0))
+    return tuple(np.concatenate(part) for part in parts)
+
+
+def sales_heatmap(date_from, date_to):
+    """Карта за [date_from, date_to): показатели MEASURES (массивы 7 × 24), число позиций, время, cached."""
+    start = time.perf_counter()
+    with db.connection() as conn:
+        # Новая продажа, в том числе догруженная кассой с меньшим id, меняет ключ кэша
+        key = (date_from, date_to) + conn.execute("""
+            SELECT (SELECT MAX(id) FROM sales),
+                   (SELECT SUM(sales_count) FROM daily_sales_agg WHERE day >= ? AND day < ?)
+        """, (date_from, date_to)).fetchone()
+        with _lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+        if cached is not None:
+            return dict(cached, cached=True, seconds=time.perf_counter() - start)
+
+        with metrics.timed("report.heatmap"):
+            columns = _read(conn, date_from, date_to)
+            result = compute(*columns)
+    result["lines"] = len(columns[0])
+    with _lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return dict(result, cached=False, seconds=time.perf_counter() - start)
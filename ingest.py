@@ -0,0 +1,174 @@
+"""Пакетная загрузка продаж из журналов JSONL и CSV без интерфейса: журналы других касс, восстановление после сбоя."""
+import csv
+import json
+import math
+import time
+from datetime import datetime
+from itertools import count
+
+import catalog
+import db
+import ledger
+import pricing
+import replication
+
+INGEST_BATCH_SIZE = 5000  # продаж на одну транзакцию
+MAX_REPORTED_ERRORS = 20
+# Пределы позиции: сумма со скидкой в базисных пунктах (pricing.quote_many) должна уместиться в int64
+MAX_QUANTITY = 10 ** 5
+MAX_AMOUNT_KOP = 10 ** 9  # 10 млн ₽
+CSV_COLUMNS = ("sale_ref", "datetime", "customer_id", "employee_id", "product_id", "quantity")
+
+
+# JSONL — одна продажа на строку: {"datetime", "customer_id", "employee_id", "items": [{"product_id",
+# "quantity", "price"}], "total_amount"}; price и total_amount необязательны
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as ex:
+                yield line_no, ex  # битая строка отклоняется, загрузка продолжается
+
+
+def read_csv(path):
+    """Собирает подряд идущие строки с одинаковым sale_ref в одну продажу (колонки CSV_COLUMNS, price, total_amount)."""
+    with open(path, encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"В CSV нет колонок: {', '.join(missing)}")
+        sale, ref, start = None, None, 0
+        for line_no, row in enumerate(reader, start=2):
+            if sale is not None and row["sale_ref"] != ref:
+                yield start, sale
+                sale = None
+            if sale is None:
+                ref, start = row["sale_ref"], line_no
+                sale = {
+                    "datetime": row["datetime"],
+                    "customer_id": row["customer_id"],
+                    "employee_id": row["employee_id"],
+                    "total_amount": row.get("total_amount") or None,
+                    "items": [],
+                }
+            sale["items"].append({
+                "product_id": row["product_id"],
+                "quantity": row["quantity"],
+                "price": row.get("price") or None,
+            })
+        if sale is not None:
+            yield start, sale
+
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+def amount(value, what):
+    """Сумма в рублях -> копейки; бесконечность, NaN и суммы вне [0, MAX_AMOUNT_KOP] отклоняются."""
+    if not math.isfinite(float(value)) or not 0 <= pricing.kopecks(value) <= MAX_AMOUNT_KOP:
+        raise ValueError(f"{what} {value} вне допустимого диапазона")
+    return pricing.kopecks(value)
+
+
+def validate(record, products, customers, employees):
+    """Приводит запись к (datetime, customer_id, employee_id, итог или None, [(product_id, quantity, цена, category_id)])."""
+    moment = datetime.fromisoformat(str(record["datetime"]))
+    customer_id = int(record["customer_id"])
+    employee_id = int(record["employee_id"])
+    if customer_id not in customers:
+        raise ValueError(f"неизвестный покупатель {customer_id}")
+    if employee_id not in employees:
+        raise ValueError(f"неизвестный сотрудник {employee_id}")
+    items = []
+    for item in record["items"]:
+        product_id = int(item["product_id"])
+        quantity = int(item["quantity"])
+        if product_id not in products:
+            raise ValueError(f"неизвестный товар {product_id}")
+        if quantity <= 0:
+            raise ValueError(f"количество товара {product_id} должно быть больше нуля")
+        if quantity > MAX_QUANTITY:
+            raise ValueError(f"количество товара {product_id} больше {MAX_QUANTITY}")
+        price = item.get("price")
+        price = amount(products[product_id][2] if price is None else price, f"цена товара {product_id}")
+        items.append((product_id, quantity, price, products[product_id][4]))
+    if not items:
+        raise ValueError("продажа без позиций")
+    total = record.get("total_amount")
+    return moment, customer_id, employee_id, None if total is None else amount(total, "сумма продажи"), items
+
+
+def write_batch(batch, update_stock, rules):
+    """Считает скидки пачки проверенных продаж и записывает её одной транзакцией; id продаж выдаются подряд."""
+    quotes = pricing.quote_many([(lines, customer_id, moment) for moment, customer_id, _, _, lines in batch], rules)
+
+    def work(conn):
+        next_id = replication.new_id(conn, "sales")
+        sales, items, sold = [], [], {}
+        for sale_id, (moment, customer_id, employee_id, total, _), quote in zip(count(next_id), batch, quotes):
+            total = quote.total if total is None else total
+            sales.append((sale_id, moment.strftime("%Y-%m-%d %H:%M:%S"), customer_id, employee_id,
+                          pricing.rubles(total), total))
+            for product_id, quantity, price, discount in quote.lines:
+                items.append((sale_id, product_id, quantity, pricing.rubles(price), price, discount))
+                sold[product_id] = sold.get(product_id, 0) + quantity
+        conn.executemany(
+            "INSERT INTO sales (id, datetime, customer_id, employee_id, total_amount, total_kop) VALUES (?, ?, ?, ?, ?, ?)",
+            sales
+        )
+        conn.executemany(
+            "INSERT INTO sale_items (sale_id, product_id, quantity, price, price_kop, discount_kop) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            items
+        )
+        if update_stock:
+            conn.executemany(
+                "UPDATE products SET stock = stock - ? WHERE id = ?",
+                [(quantity, product_id) for product_id, quantity in sold.items()]
+            )
+            ledger.record(conn, [(product_id, -quantity, sale_id) for sale_id, product_id, quantity, *_ in items], "sale")
+        return len(items)
+
+    return db.run_in_transaction(work)
+
+
+def ingest_sales(path, batch_size=INGEST_BATCH_SIZE, fmt=None, update_stock=True):
+    """Загружает продажи из jsonl или csv; update_stock=False не трогает остатки. Возвращает статистику."""
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+    if fmt not in READERS:
+        raise ValueError(f"Неизвестный формат {fmt}: ожидается jsonl или csv")
+    products = catalog.table("products").by_id
+    customers = catalog.table("customers").by_id
+    employees = catalog.table("employees").by_id
+    rules = pricing.rules()
+
+    stats = {"sales": 0, "items": 0, "rejected": 0, "errors": []}
+    start = time.perf_counter()
+    batch = []
+    for line_no, record in READERS[fmt](path):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            batch.append(validate(record, products, customers, employees))
+        except (KeyError, TypeError, ValueError, OverflowError) as ex:
+            stats["rejected"] += 1
+            if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                stats["errors"].append(f"строка {line_no}: {ex}")
+            continue
+        if len(batch) >= batch_size:
+            stats["items"] += write_batch(batch, update_stock, rules)
+            stats["sales"] += len(batch)
+            batch = []
+    if batch:
+        stats["items"] += write_batch(batch, update_stock, rules)
+        stats["sales"] += len(batch)
+    if update_stock and stats["sales"]:
+        catalog.invalidate("products")
+
+    stats["seconds"] = time.perf_counter() - start
+    rows = stats["sales"] + stats["items"]
+    stats["rows_per_sec"] = rows / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
@@ -0,0 +1,135 @@
+"""Журнал движения остатков (stock_movements): история products.stock и остаток на любой момент."""
+import json
+import time
+from datetime import datetime
+
+import db
+import metrics
+
+# sale — продажа (ref_id — её id), restock — пополнение, adjustment — установка остатка
+# (миграция, остатки центра на кассе), import — начальный остаток нового товара из CSV
+KINDS = ("sale", "restock", "adjustment", "import")
+SNAPSHOT_EVERY = 50000  # движений между снимками
+# Остаток на момент: снимок не позже момента + хвост журнала по (product_id, moment);
+# товары — json-массив id или NULL (все)
+STOCK_AT = """
+    WITH base AS MATERIALIZED (  -- без MATERIALIZED поиск снимка выполнялся бы дважды
+        SELECT p.id AS product_id,
+               (SELECT MAX(movement_id) FROM stock_snapshots s
+                WHERE s.product_id = p.id AND s.moment <= :moment) AS snapshot_id
+        FROM products p
+        WHERE :products IS NULL OR p.id IN (SELECT value FROM json_each(:products))
+    )
+    SELECT b.product_id,
+           COALESCE(s.stock, 0)
+           + COALESCE((SELECT SUM(delta) FROM stock_movements m
+                       WHERE m.product_id = b.product_id
+                         AND m.moment >= COALESCE(s.moment, '') AND m.moment <= :moment
+                         AND m.id > COALESCE(b.snapshot_id, 0)), 0)
+    FROM base b
+    LEFT JOIN stock_snapshots s ON s.product_id = b.product_id AND s.movement_id = b.snapshot_id
+    ORDER BY b.product_id
+"""
+# Расхождения: остаток товара не равен сумме его движений; снимок не равен сумме движений до него
+AUDIT_STOCK = """
+    SELECT p.id, COALESCE(p.stock, 0), COALESCE(l.stock, 0)
+    FROM products p
+    LEFT JOIN (SELECT product_id, SUM(delta) AS stock FROM stock_movements GROUP BY product_id) l
+        ON l.product_id = p.id
+    WHERE COALESCE(p.stock, 0) != COALESCE(l.stock, 0)
+    ORDER BY p.id
+"""
+AUDIT_SNAPSHOTS = """
+    SELECT s.product_id, s.movement_id, s.stock,
+           (SELECT COALESCE(SUM(delta), 0) FROM stock_movements m
+            WHERE m.product_id = s.product_id AND m.id <= s.movement_id)
+    FROM stock_snapshots s
+    WHERE s.stock != (SELECT COALESCE(SUM(delta), 0) FROM stock_movements m
+                      WHERE m.product_id = s.product_id AND m.id <= s.movement_id)
+"""
+
+
+def _now(conn, moment=None):
+    """Время движения: не раньше последнего записанного (журнал упорядочен по времени)."""
+    moment = moment or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    last = conn.execute("SELECT moment FROM stock_movements ORDER BY id DESC LIMIT 1").fetchone()
+    return max(moment, last[0]) if last else moment
+
+
+def record(conn, movements, kind, moment=None):
+    """Дописывает движения [(product_id, delta, ref_id)] вида kind; вызывается в транзакции изменения."""
+    if kind not in KINDS:
+        raise ValueError(f"Неизвестный вид движения: {kind}")
+    moment = _now(conn, moment)
+    conn.executemany(
+        "INSERT INTO stock_movements (product_id, moment, delta, kind, ref_id) VALUES (?, ?, ?, ?, ?)",
+        [(product_id, moment, delta, kind, ref_id) for product_id, delta, ref_id in movements if delta]
+    )
+
+
+def record_new_products(conn, kind="import", moment=None):
+    """Начальные остатки товаров, которых ещё нет в журнале (новые строки products)."""
+    conn.execute("""
+        INSERT INTO stock_movements (product_id, moment, delta, kind)
+        SELECT p.id, ?, p.stock, ? FROM products p
+        WHERE COALESCE(p.stock, 0) != 0
+          AND NOT EXISTS (SELECT 1 FROM stock_movements m WHERE m.product_id = p.id)
+    """, (_now(conn, moment), kind))
+
+
+def stocks(conn):
+    """Текущие остатки {product_id: stock}."""
+    return dict(conn.execute("SELECT id, COALESCE(stock, 0) FROM products"))
+
+
+def record_changes(conn, before, kind="adjustment", moment=None):
+    """Записывает разницу между остатками before (stocks() до изменения) и текущими; новые товары — import."""
+    after = stocks(conn)
+    record(conn, [(pid, stock - before[pid], None) for pid, stock in after.items() if pid in before], kind, moment)
+    record(conn, [(pid, stock, None) for pid, stock in after.items() if pid not in before], "import", moment)
+
+
+def stock_at(moment, product_ids=None):
+    """Остатки {product_id: stock} на момент moment ('ГГГГ-ММ-ДД ЧЧ:ММ:СС') по снимкам и журналу."""
+    products = None if product_ids is None else json.dumps(list(product_ids))
+    with db.connection() as conn:
+        return dict(metrics.fetchall(conn, "ledger.stock_at", STOCK_AT, {"moment": moment, "products": products}))
+
+
+def snapshot(force=False):
+    """Снимки остатков товаров, двигавшихся с прошлого снимка; без force — раз в SNAPSHOT_EVERY движений."""
+    start = time.perf_counter()
+
+    def work(conn):
+        head = conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0]
+        last = conn.execute("SELECT COALESCE(MAX(movement_id), 0) FROM stock_snapshots").fetchone()[0]
+        if head == last or (not force and head - last < SNAPSHOT_EVERY):
+            return 0
+        # От прошлого снимка товара: движений между ним и прошлым общим снимком у товара не было.
+        # moment снимка — самое позднее из учтённых движений товара: снимок применим к моменту t,
+        # только если все они не позже t, даже если часы касс шли неровно
+        return conn.execute("""
+            INSERT INTO stock_snapshots (product_id, movement_id, moment, stock)
+            WITH prev AS (
+                SELECT product_id, stock, moment FROM stock_snapshots s
+                WHERE movement_id = (SELECT MAX(movement_id) FROM stock_snapshots WHERE product_id = s.product_id)
+            )
+            SELECT m.product_id, :head, MAX(COALESCE(MAX(prev.moment), ''), MAX(m.moment)),
+                   COALESCE(MAX(prev.stock), 0) + SUM(m.delta)
+            FROM stock_movements m LEFT JOIN prev ON prev.product_id = m.product_id
+            WHERE m.id > :last AND m.id <= :head
+            GROUP BY m.product_id
+        """, {"head": head, "last": last}).rowcount
+
+    with metrics.timed("ledger.snapshot"):
+        products = db.run_in_transaction(work)
+    return {"products": products, "seconds": time.perf_counter() - start}
+
+
+def audit():
+    """Расхождения журнала: {"stock": [(товар, остаток, по журналу)], "snapshots": [(товар, движение, снимок, по журналу)]}."""
+    with db.connection() as conn:
+        return {
+            "stock": metrics.fetchall(conn, "ledger.audit", AUDIT_STOCK),
+            "snapshots": metrics.fetchall(conn, "ledger.audit_snapshots", AUDIT_SNAPSHOTS),
+        }
@@ -1,215 +1,688 @@
+import argparse
+import csv
 import os
 import sqlite3
-import pandas as pd
 import tkinter as tk
 from tkinter import ttk, messagebox
-import ttkbootstrap as tb
-from datetime import datetime
+from datetime import datetime, timedelta
 import hashlib
 
+import catalog
+import archive
+import auth
+import db
+import forecast
+import heatmap
+import ingest
+import ledger
+import metrics
+import pricing
+import receipts
+import replication
+import warehouse
+import workers
+
 # --- Конфигурация ---
 BASE_DIR = os.path.dirname(__file__)
-DB_PATH = os.path.join(BASE_DIR, "db.sqlite3")
+DB_PATH = db.DB_PATH
 CSV_FILES = {
     "categories": os.path.join(BASE_DIR, "categories.csv"),
     "products": os.path.join(BASE_DIR, "products.csv"),
     "customers": os.path.join(BASE_DIR, "customers.csv"),
     "employees": os.path.join(BASE_DIR, "employees.csv"),
+    "promotions": os.path.join(BASE_DIR, "promotions.csv"),  # необязательный: правила скидок (pricing.py)
 }
-DISCOUNT = 0.1  # 10% скидка
+# Продажи фиксируются пачками в общем потоке-писателе (db.GroupCommitWriter), а не по одной
+SALE_GROUP_COMMIT = bool(os.environ.get("SUPERMARKET_GROUP_COMMIT"))
+executor = None  # фоновый пул запросов (workers.TkExecutor), создаётся в main()
+admin_session = None  # токен сессии администратора (auth.login)
 
 
 # --- Инициализация БД ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.executescript("""
-        CREATE TABLE IF NOT EXISTS admins (
+# Декларированная схема таблиц; {name} подставляется при пересоздании таблицы
+SCHEMA = {
+    "admins": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY,
             login TEXT UNIQUE,
             password_hash TEXT
-        );
-        CREATE TABLE IF NOT EXISTS categories (
+        )""",
+    "categories": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY, 
             name TEXT
-        );
-        CREATE TABLE IF NOT EXISTS products (
+        )""",
+    "products": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY,
             name TEXT,
             price REAL,
             stock INTEGER,
             category_id INTEGER,
             FOREIGN KEY(category_id) REFERENCES categories(id)
-        );
-        CREATE TABLE IF NOT EXISTS customers (
+        )""",
+    "customers": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY, 
             name TEXT, 
             phone TEXT UNIQUE
-        );
-        CREATE TABLE IF NOT EXISTS employees (
+        )""",
+    "employees": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY, 
             name TEXT, 
             role TEXT
-        );
-        CREATE TABLE IF NOT EXISTS sales (
+        )""",
+    "sales": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY,
             datetime TEXT,
             customer_id INTEGER,
             employee_id INTEGER,
             total_amount REAL
-        );
-        CREATE TABLE IF NOT EXISTS sale_items (
+        )""",
+    "sale_items": """
+        CREATE TABLE IF NOT EXISTS {name} (
             id INTEGER PRIMARY KEY,
             sale_id INTEGER,
             product_id INTEGER,
             quantity INTEGER,
             price REAL
-        );
-    """)
+        )""",
+    # Отпечатки импортированных CSV: по ним неизменённые файлы пропускаются
+    "csv_imports": """
+        CREATE TABLE IF NOT EXISTS {name} (
+            table_name TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            sha256 TEXT,
+            imported_at TEXT
+        )""",
+}
+# Пересчёт дневных агрегатов продаж с нуля (бэкфилл и команда rebuild-aggregates)
+# {sales}/{sale_lines}: таблицы рабочей БД в миграции, представления с архивами (all_*) при пересчёте
+# Выручка — в копейках (миграция 5); выручка товара, как и прежде, — по цене, без скидок
+SALES_AGG_REBUILD = """
+    DELETE FROM daily_sales_agg;
+    DELETE FROM daily_product_agg;
+    INSERT INTO daily_sales_agg (day, employee_id, customer_id, sales_count, revenue_kop)
+        SELECT substr(datetime, 1, 10), employee_id, customer_id, COUNT(*), SUM(total_kop)
+        FROM {sales}
+        GROUP BY 1, 2, 3;
+    INSERT INTO daily_product_agg (day, product_id, quantity, revenue_kop)
+        SELECT substr(datetime, 1, 10), product_id, SUM(quantity), SUM(quantity * price_kop)
+        FROM {sale_lines}
+        GROUP BY 1, 2;
+"""
+# Миграции схемы: номер миграции = её индекс + 1, применённая версия хранится в PRAGMA user_version
+MIGRATIONS = [
+    # 1: индексы под отчёты за период, чеки и детализацию
+    """
+    CREATE INDEX IF NOT EXISTS idx_sales_datetime ON sales(datetime);
+    CREATE INDEX IF NOT EXISTS idx_sales_employee ON sales(employee_id);
+    CREATE INDEX IF NOT EXISTS idx_sales_customer ON sales(customer_id);
+    CREATE INDEX IF NOT EXISTS idx_sale_items_sale_product ON sale_items(sale_id, product_id);
+    """,
+    # 2: материализованные дневные агрегаты для отчётов, поддерживаются триггерами
+    """
+    CREATE TABLE IF NOT EXISTS daily_sales_agg (
+        day TEXT,
+        employee_id INTEGER,
+        customer_id INTEGER,
+        sales_count INTEGER,
+        revenue REAL,
+        PRIMARY KEY (day, employee_id, customer_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS daily_product_agg (
+        day TEXT,
+        product_id INTEGER,
+        quantity INTEGER,
+        revenue REAL,
+        PRIMARY KEY (day, product_id)
+    ) WITHOUT ROWID;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_agg AFTER INSERT ON sales
+    BEGIN
+        INSERT INTO daily_sales_agg (day, employee_id, customer_id, sales_count, revenue)
+        VALUES (substr(NEW.datetime, 1, 10), NEW.employee_id, NEW.customer_id, 1, NEW.total_amount)
+        ON CONFLICT (day, employee_id, customer_id) DO UPDATE SET
+            sales_count = sales_count + 1,
+            revenue = revenue + excluded.revenue;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sale_items_agg AFTER INSERT ON sale_items
+    BEGIN
+        INSERT INTO daily_product_agg (day, product_id, quantity, revenue)
+        VALUES (
+            (SELECT substr(datetime, 1, 10) FROM sales WHERE id = NEW.sale_id),
+            NEW.product_id, NEW.quantity, NEW.quantity * NEW.price
+        )
+        ON CONFLICT (day, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue;
+    END;
+    DELETE FROM daily_sales_agg;
+    DELETE FROM daily_product_agg;
+    INSERT INTO daily_sales_agg (day, employee_id, customer_id, sales_count, revenue)
+        SELECT substr(datetime, 1, 10), employee_id, customer_id, COUNT(*), SUM(total_amount)
+        FROM sales
+        GROUP BY 1, 2, 3;
+    INSERT INTO daily_product_agg (day, product_id, quantity, revenue)
+        SELECT substr(s.datetime, 1, 10), si.product_id, SUM(si.quantity), SUM(si.quantity * si.price)
+        FROM sale_items si JOIN sales s ON s.id = si.sale_id
+        GROUP BY 1, 2;
+    """,
+    # 3: триграммные FTS5-индексы для поиска товаров и покупателей по мере ввода
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, content='products', content_rowid='id', tokenize='trigram'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+        name, phone, content='customers', content_rowid='id', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF name ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_customers_fts_insert AFTER INSERT ON customers BEGIN
+        INSERT INTO customers_fts (rowid, name, phone) VALUES (NEW.id, NEW.name, NEW.phone);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_customers_fts_delete AFTER DELETE ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, phone) VALUES ('delete', OLD.id, OLD.name, OLD.phone);
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_customers_fts_update AFTER UPDATE OF name, phone ON customers BEGIN
+        INSERT INTO customers_fts (customers_fts, rowid, name, phone) VALUES ('delete', OLD.id, OLD.name, OLD.phone);
+        INSERT INTO customers_fts (rowid, name, phone) VALUES (NEW.id, NEW.name, NEW.phone);
+    END;
+    INSERT INTO products_fts (products_fts) VALUES ('rebuild');
+    INSERT INTO customers_fts (customers_fts) VALUES ('rebuild');
+    """,
+    # 4: прогноз расхода товаров (forecast.py) и отметка последнего запуска
+    """
+    CREATE TABLE IF NOT EXISTS product_forecast (
+        product_id INTEGER PRIMARY KEY,
+        velocity REAL,
+        days_left REAL,
+        reorder_point INTEGER,
+        updated_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS forecast_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_sale_id INTEGER,
+        last_day TEXT
+    );
+    """,
+    # 5: суммы в целых копейках, правила скидок (pricing.py); агрегаты переходят на копейки
+    """
+    CREATE TABLE IF NOT EXISTS promotions (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        percent REAL,
+        category_id INTEGER,
+        product_id INTEGER,
+        customer_id INTEGER,
+        starts_at TEXT,
+        ends_at TEXT,
+        weekdays TEXT,
+        hour_from INTEGER,
+        hour_to INTEGER
+    );
+    ALTER TABLE sales ADD COLUMN total_kop INTEGER;
+    ALTER TABLE sale_items ADD COLUMN price_kop INTEGER;
+    ALTER TABLE sale_items ADD COLUMN discount_kop INTEGER;
+    UPDATE sales SET total_kop = CAST(ROUND(total_amount * 100) AS INTEGER);
+    -- До миграции скидка была одна — 10% на всё
+    UPDATE sale_items SET
+        price_kop = CAST(ROUND(price * 100) AS INTEGER),
+        discount_kop = (quantity * CAST(ROUND(price * 100) AS INTEGER) + 5) / 10;
+    -- Запись только рублёвых сумм (старые выгрузки и скрипты) дополняется копейками
+    CREATE TRIGGER IF NOT EXISTS trg_sales_kop AFTER INSERT ON sales WHEN NEW.total_kop IS NULL
+    BEGIN
+        UPDATE sales SET total_kop = CAST(ROUND(NEW.total_amount * 100) AS INTEGER) WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sale_items_kop AFTER INSERT ON sale_items WHEN NEW.price_kop IS NULL
+    BEGIN
+        UPDATE sale_items SET price_kop = CAST(ROUND(NEW.price * 100) AS INTEGER) WHERE id = NEW.id;
+    END;
+    -- Агрегаты переводятся на месте: в них учтены и продажи, уже перенесённые в архивы
+    -- (точный пересчёт по копейкам — команда rebuild-aggregates)
+    DROP TRIGGER IF EXISTS trg_sales_agg;
+    DROP TRIGGER IF EXISTS trg_sale_items_agg;
+    ALTER TABLE daily_sales_agg ADD COLUMN revenue_kop INTEGER;
+    UPDATE daily_sales_agg SET revenue_kop = CAST(ROUND(revenue * 100) AS INTEGER);
+    ALTER TABLE daily_sales_agg DROP COLUMN revenue;
+    ALTER TABLE daily_product_agg ADD COLUMN revenue_kop INTEGER;
+    UPDATE daily_product_agg SET revenue_kop = CAST(ROUND(revenue * 100) AS INTEGER);
+    ALTER TABLE daily_product_agg DROP COLUMN revenue;
+    CREATE TRIGGER IF NOT EXISTS trg_sales_agg AFTER INSERT ON sales
+    BEGIN
+        INSERT INTO daily_sales_agg (day, employee_id, customer_id, sales_count, revenue_kop)
+        VALUES (
+            substr(NEW.datetime, 1, 10), NEW.employee_id, NEW.customer_id, 1,
+            COALESCE(NEW.total_kop, CAST(ROUND(NEW.total_amount * 100) AS INTEGER))
+        )
+        ON CONFLICT (day, employee_id, customer_id) DO UPDATE SET
+            sales_count = sales_count + 1,
+            revenue_kop = revenue_kop + excluded.revenue_kop;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_sale_items_agg AFTER INSERT ON sale_items
+    BEGIN
+        INSERT INTO daily_product_agg (day, product_id, quantity, revenue_kop)
+        VALUES (
+            (SELECT substr(datetime, 1, 10) FROM sales WHERE id = NEW.sale_id),
+            NEW.product_id, NEW.quantity,
+            NEW.quantity * COALESCE(NEW.price_kop, CAST(ROUND(NEW.price * 100) AS INTEGER))
+        )
+        ON CONFLICT (day, product_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue_kop = revenue_kop + excluded.revenue_kop;
+    END;
+    """,
+    # 6: журнал движения остатков и снимки остатков (ledger.py); текущие остатки — начальные движения
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        moment TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('sale', 'restock', 'adjustment', 'import')),
+        ref_id INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id, moment);
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        product_id INTEGER,
+        movement_id INTEGER,
+        moment TEXT,
+        stock INTEGER,
+        PRIMARY KEY (product_id, movement_id)
+    ) WITHOUT ROWID;
+    INSERT INTO stock_movements (product_id, moment, delta, kind)
+        SELECT id, strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'), stock, 'adjustment'
+        FROM products
+        WHERE COALESCE(stock, 0) != 0;
+    """,
+]
+CSV_BATCH_SIZE = 500
+# Колонки, которые CSV задаёт только для новых строк: остатками дальше управляют продажи и пополнения
+CSV_INSERT_ONLY = {"products": ("stock",)}
+
+
+def init_db():
+    with db.connection() as conn:
+        # Схема и справочники из CSV загружаются как есть, без проверки внешних ключей
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for table, ddl in SCHEMA.items():
+                restore_declared_schema(conn, table)
+                conn.execute(ddl.format(name=table))
+
+            migrate(conn)
+
+            # Создание администратора по умолчанию
+            if not conn.execute("SELECT * FROM admins").fetchall():
+                conn.execute(
+                    "INSERT INTO admins (login, password_hash) VALUES (?, ?)",
+                    ("admin", auth.hash_password("admin123"))
+                )
+
+            # Импорт данных из CSV
+            import_csv_files(conn)
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.executescript(f"BEGIN IMMEDIATE; {script} PRAGMA user_version = {number}; COMMIT;")
+
+
+def rebuild_sales_aggregates():
+    """Пересчитывает daily_sales_agg/daily_product_agg по сырым продажам."""
+    with db.connection() as conn:
+        rebuild = SALES_AGG_REBUILD.format(sales="all_sales", sale_lines="all_sale_lines")
+        conn.executescript(f"BEGIN IMMEDIATE; {rebuild} COMMIT;")
+
+
+def restore_declared_schema(conn, table):
+    """Пересоздаёт таблицу по SCHEMA, если её создал старый to_sql (без первичного ключа)."""
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    if not columns or any(col[5] for col in columns):
+        return
+    names = ", ".join(col[1] for col in columns)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(SCHEMA[table].format(name=f"{table}_new"))
+        conn.execute(f"INSERT OR REPLACE INTO {table}_new ({names}) SELECT {names} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    except Exception:
+        conn.rollback()
+        raise
     conn.commit()
 
-    # Создание администратора по умолчанию
-    if not conn.execute("SELECT * FROM admins").fetchall():
-        default_password = hashlib.sha256("admin123".encode()).hexdigest()
-        conn.execute(
-            "INSERT INTO admins (login, password_hash) VALUES (?, ?)",
-            ("admin", default_password)
-        )
-        conn.commit()
 
-    # Импорт данных из CSV
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def import_csv_files(conn):
+    """Инкрементальный импорт CSV: изменённые файлы upsert-ятся одной транзакцией, остальные пропускаются."""
+    known = {
+        row[0]: row[1:]
+        for row in conn.execute("SELECT table_name, mtime, size, sha256 FROM csv_imports")
+    }
+    changed = []
     for table, path in CSV_FILES.items():
-        if os.path.exists(path):
-            df = pd.read_csv(path)
-            df.to_sql(table, conn, if_exists="replace", index=False)
-    conn.close()
+        if not os.path.exists(path):
+            continue
+        st = os.stat(path)
+        prev = known.get(table)
+        if prev and prev[0] == st.st_mtime and prev[1] == st.st_size:
+            continue
+        digest = file_sha256(path)
+        changed.append((table, path, st, digest, bool(prev) and prev[2] == digest))
+    if not changed:
+        return
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, path, st, digest, same_content in changed:
+            # Файл «потрогали», но содержимое то же — обновляем только отпечаток
+            if not same_content:
+                upsert_csv(conn, table, path)
+                if table == "products":
+                    ledger.record_new_products(conn, "import", now)
+            conn.execute("""
+                INSERT INTO csv_imports (table_name, mtime, size, sha256, imported_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET
+                    mtime = excluded.mtime,
+                    size = excluded.size,
+                    sha256 = excluded.sha256,
+                    imported_at = excluded.imported_at
+            """, (table, st.st_mtime, st.st_size, digest, now))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    catalog.invalidate(*(item[0] for item in changed))
 
 
-init_db()
+def upsert_csv(conn, table, path):
+    """Значения передаются строками: типы приводит SQLite по типам колонок; пустая ячейка — NULL."""
+    insert_only = CSV_INSERT_ONLY.get(table, ())
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        cols = next(reader, None)
+        if not cols:
+            return
+        updated = [col for col in cols if col != "id" and col not in insert_only]
+        # Неизменённые строки не перезаписываются: иначе каждая правка файла гоняла бы
+        # триггеры поиска и журнал изменений касс (replica_changes) по всему справочнику
+        conflict = (
+            f"DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in updated)} "
+            f"WHERE ({', '.join(updated)}) IS NOT ({', '.join(f'excluded.{col}' for col in updated)})"
+            if updated else "DO NOTHING"
+        )
+        sql = (
+            f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+            f"ON CONFLICT(id) {conflict}"
+        )
+        batch = []
+        for row in reader:
+            if not row:
+                continue
+            batch.append([value if value != "" else None for value in row])
+            if len(batch) >= CSV_BATCH_SIZE:
+                conn.executemany(sql, batch)
+                batch = []
+        if batch:
+            conn.executemany(sql, batch)
+
+
+_bootstrapped = set()
+
+
+def bootstrap():
+    # Вызывается точками входа (окно, cli, bench), а не при импорте: импорт main не трогает БД
+    if db.DB_PATH not in _bootstrapped:
+        init_db()
+        db.refresh_archives()  # на новой БД представления all_* создаются, когда появились таблицы
+        _bootstrapped.add(db.DB_PATH)
 
 
 # --- Вспомогательные функции ---
+def toplevel():
+    """Новое окно ttkbootstrap; сам ttkbootstrap (~0.1 с) импортируется при первом окне."""
+    import ttkbootstrap as tb
+    return tb.Toplevel()
+
+
 def get_products():
-    with sqlite3.connect(DB_PATH) as conn:
-        return conn.execute(
-            "SELECT id, name, price, stock, category_id FROM products"
-        ).fetchall()
+    return catalog.table("products").rows
 
 
 def get_customers():
-    with sqlite3.connect(DB_PATH) as conn:
-        return conn.execute("SELECT id, name FROM customers").fetchall()
+    return catalog.table("customers").rows
 
 
 def get_employees():
-    with sqlite3.connect(DB_PATH) as conn:
-        return conn.execute("SELECT id, name, role FROM employees").fetchall()
-
-
-def make_sale(product_id, quantity, customer_id, employee_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT price, stock FROM products WHERE id=?", (product_id,))
-        price, stock = c.fetchone()
-        if stock < quantity:
-            raise Exception("Недостаточно товара на складе")
-        total = price * quantity * (1 - DISCOUNT)
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.execute(
-            "INSERT INTO sales (datetime, customer_id, employee_id, total_amount) VALUES (?, ?, ?, ?)",
-            (now, customer_id, employee_id, total)
-        )
-        sale_id = c.lastrowid
-        c.execute(
-            "INSERT INTO sale_items (sale_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
-            (sale_id, product_id, quantity, price)
-        )
-        c.execute(
-            "UPDATE products SET stock = stock - ? WHERE id = ?",
-            (quantity, product_id)
-        )
-        conn.commit()
+    return catalog.table("employees").rows
+
+
+SEARCH_DELAY_MS = 200  # пауза ввода, после которой SearchBox ищет варианты
+# Подписи строк справочников в выпадающих списках
+LABELS = {
+    "products": lambda p: f"{p[0]} – {p[1]} (ост. {p[3]})",
+    "customers": lambda c: f"{c[0]} – {c[1]}",
+    "employees": lambda e: f"{e[0]} – {e[1]} ({e[2]})",
+}
+
+
+class SearchBox(ttk.Combobox):
+    """Combobox с поиском по мере ввода: варианты подбирает catalog.search, id хранится рядом с подписью."""
+
+    def __init__(self, master, table, **kwargs):
+        super().__init__(master, **kwargs)
+        self.table = table
+        self._ids = {}  # подпись -> id
+        self._pending = None  # отложенный поиск (after)
+        self._task = None  # поиск в фоновом пуле
+        self.bind("<KeyRelease>", self._on_key, add="+")
+        self.bind("<<ComboboxSelected>>", self._cancel, add="+")
+        self.bind("<Destroy>", self._cancel, add="+")
+
+    def refresh(self, text=""):
+        # Поиск идёт в фоновом пуле; ответ прежнего, уже ненужного поиска отбрасывается
+        self._cancel()
+        self._task = executor.submit(catalog.search, self.table, text, on_done=self._show, owner=self.winfo_toplevel())
+
+    def _show(self, rows):
+        self._task = None
+        label = LABELS[self.table]
+        self._ids = {label(row): row[0] for row in rows}
+        self.config(values=list(self._ids))
+
+    def _cancel(self, event=None):
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+            self._pending = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def selected_id(self):
+        return self._ids.get(self.get())
+
+    def _on_key(self, event):
+        # Стрелки, модификаторы и Home/End текст не меняют (event.char пуст); выбранная подпись уже есть в _ids
+        if not event.char or event.keysym in ("Return", "Escape", "Tab") or self.get() in self._ids:
+            return
+        self._cancel()
+        self._pending = self.after(SEARCH_DELAY_MS, lambda: self.refresh(self.get()))
+
+
+def sale_work(items, customer_id, employee_id):
+    """Проверяет корзину items = [(product_id, quantity), ...]; возвращает work(conn) -> sale_id для транзакции."""
+    basket = {}
+    for product_id, quantity in items:
+        basket[product_id] = basket.get(product_id, 0) + quantity
+    if not basket:
+        raise Exception("Корзина пуста")
+    if any(quantity <= 0 for quantity in basket.values()):
+        raise Exception("Количество должно быть больше нуля")
+
+    marks = ", ".join("?" * len(basket))
+    cases = " ".join("WHEN ? THEN ?" for _ in basket)
+    pairs = [value for line in basket.items() for value in line]
+    # Правила скидок читаются до транзакции: внутри неё второе соединение пула могло бы не найтись
+    rules = pricing.rules()
+
+    def sell(conn):
+        products = {row[0]: row for row in metrics.fetchall(
+            conn, "sale.prices", f"SELECT id, price, category_id FROM products WHERE id IN ({marks})", list(basket)
+        )}
+        missing = [str(pid) for pid in basket if pid not in products]
+        if missing:
+            raise Exception(f"Товар не найден: ID {', '.join(missing)}")
+
+        # Условное списание: строка обновляется, только если остатка хватает,
+        # поэтому две кассы не смогут продать больше, чем есть на складе
+        with metrics.timed("sale.reserve"):
+            updated = conn.execute(
+                f"UPDATE products SET stock = stock - CASE id {cases} END "
+                f"WHERE id IN ({marks}) AND stock >= CASE id {cases} END",
+                pairs + list(basket) + pairs
+            ).rowcount
+        if updated != len(basket):
+            short = [
+                str(row[0]) for row in conn.execute(
+                    f"SELECT id FROM products WHERE id IN ({marks}) AND stock < CASE id {cases} END",
+                    list(basket) + pairs
+                )
+            ]
+            raise Exception(f"Недостаточно товара на складе: ID {', '.join(short)}")
+
+        moment = datetime.now()
+        with metrics.timed("sale.price"):
+            quote = pricing.quote(
+                [(pid, quantity, pricing.kopecks(products[pid][1]), products[pid][2]) for pid, quantity in basket.items()],
+                customer_id, moment, rules
+            )
+        now = moment.strftime("%Y-%m-%d %H:%M:%S")
+        with metrics.timed("sale.insert"):
+            sale_id = replication.new_id(conn, "sales")
+            conn.execute(
+                "INSERT INTO sales (id, datetime, customer_id, employee_id, total_amount, total_kop) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (sale_id, now, customer_id, employee_id, pricing.rubles(quote.total), quote.total)
+            )
+            conn.executemany(
+                "INSERT INTO sale_items (sale_id, product_id, quantity, price, price_kop, discount_kop) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(sale_id, pid, quantity, pricing.rubles(price), price, discount)
+                 for pid, quantity, price, discount in quote.lines]
+            )
+            ledger.record(conn, [(pid, -quantity, sale_id) for pid, quantity in basket.items()], "sale", now)
         return sale_id
 
+    return sell
+
+
+def submit_sale(items, customer_id, employee_id):
+    """Ставит продажу в очередь группой фиксации; Future вернёт sale_id после COMMIT её пачки."""
+    future = db.group_writer().submit(sale_work(items, customer_id, employee_id))
+    future.add_done_callback(lambda _: catalog.invalidate("products"))
+    return future
 
-# --- Окно чека ---
-def show_receipt(sale_id):
-    win = tb.Toplevel()
-    win.title(f"Чек №{sale_id}")
-    win.geometry("500x600")
 
-    with sqlite3.connect(DB_PATH) as conn:
-        sale_info = conn.execute("""
-            SELECT s.datetime, s.total_amount, c.name, e.name
-            FROM sales s
+def make_sale(items, customer_id, employee_id):
+    """Оформляет продажу одной транзакцией; при SALE_GROUP_COMMIT — в общей пачке потока-писателя."""
+    if SALE_GROUP_COMMIT:
+        with metrics.timed("sale.total"):
+            return submit_sale(items, customer_id, employee_id).result()
+    sell = sale_work(items, customer_id, employee_id)
+    with metrics.timed("sale.total"):
+        sale_id = db.run_in_transaction(sell)
+    catalog.invalidate("products")
+    return sale_id
+
+
+# --- Окно чека ---
+def fetch_receipt(sale_id):
+    """Шапка чека (дата, сумма, покупатель, сотрудник) и его позиции; суммы — в копейках."""
+    with db.connection() as conn:
+        header = metrics.fetchall(conn, "receipt.header", """
+            SELECT s.datetime, s.total_kop, c.name, e.name
+            FROM all_sales s
             JOIN customers c ON s.customer_id = c.id
             JOIN employees e ON s.employee_id = e.id
             WHERE s.id = ?
-        """, (sale_id,)).fetchone()
+        """, (sale_id,))
 
-        items = conn.execute("""
-            SELECT p.name, si.quantity, si.price, (si.quantity * si.price) as total
-            FROM sale_items si
+        items = metrics.fetchall(conn, "receipt.items", """
+            SELECT p.name, si.quantity, si.price_kop, (si.quantity * si.price_kop - COALESCE(si.discount_kop, 0)) as total
+            FROM all_sale_items si
             JOIN products p ON si.product_id = p.id
             WHERE si.sale_id = ?
-        """, (sale_id,)).fetchall()
+        """, (sale_id,))
+    return (header[0] if header else None), items
 
-    datetime_str, total_amount, customer_name, employee_name = sale_info
 
-    receipt_text = f"""
-    Чек №{sale_id}
-    Дата: {datetime_str}
-    Покупатель: {customer_name}
-    Сотрудник: {employee_name}
-    -------------------------------
-    Товары:
-    """
-    for item in items:
-        name, qty, price, total = item
-        receipt_text += f"{name} x{qty} @{price:.2f}₽ = {total:.2f}₽\n"
-
-    receipt_text += f"""
-    -------------------------------
-    Итого: {total_amount:.2f}₽
-    Скидка: {DISCOUNT * 100}%
-    """
+@metrics.window("window.receipt")
+def show_receipt(sale_id):
+    win = toplevel()
+    win.title(f"Чек №{sale_id}")
+    win.geometry("500x600")
 
     text_widget = tk.Text(win, font=("Courier New", 12))
-    text_widget.insert(tk.END, receipt_text)
     text_widget.pack(fill="both", expand=True, padx=10, pady=10)
+    receipt = {}
+
+    def show(result):
+        sale_info, items = result
+        receipt["datetime"] = sale_info[0]
+        receipt["text"] = receipts.render((sale_id, *sale_info), [item[:3] for item in items])
+        text_widget.insert(tk.END, receipt["text"])
+        save_btn.config(state="normal")
 
     def save_receipt():
-        filename = f"Чек_{sale_id}_{datetime_str.replace(':', '-')}.txt"
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(receipt_text)
+        filename = receipts.save(receipt["text"], sale_id, receipt["datetime"])
         messagebox.showinfo("Сохранено", f"Чек сохранён как {filename}")
 
-    ttk.Button(win, text="Сохранить чек", command=save_receipt).pack(pady=10)
+    save_btn = ttk.Button(win, text="Сохранить чек", command=save_receipt, state="disabled")
+    save_btn.pack(pady=10)
+    executor.submit(fetch_receipt, sale_id, on_done=show, owner=win)
 
 
 # --- Окно продажи ---
+@metrics.window("window.sale")
 def sale_window():
-    win = tb.Toplevel()
+    win = toplevel()
     win.title("Продажа товара")
-    win.geometry("500x450")
+    win.geometry("600x700")
 
     # Элементы формы
     ttk.Label(win, text="Покупатель:").pack(anchor="w", padx=10, pady=(10, 0))
-    custs = get_customers()
-    cust_var = tk.StringVar()
-    cust_cb = ttk.Combobox(win, textvariable=cust_var, values=[f"{c[0]} – {c[1]}" for c in custs])
+    cust_cb = SearchBox(win, "customers")
     cust_cb.pack(fill="x", padx=10)
 
     ttk.Label(win, text="Сотрудник:").pack(anchor="w", padx=10, pady=(10, 0))
-    emps = get_employees()
-    emp_var = tk.StringVar()
-    emp_cb = ttk.Combobox(win, textvariable=emp_var, values=[f"{e[0]} – {e[1]} ({e[2]})" for e in emps])
+    emp_cb = SearchBox(win, "employees")
     emp_cb.pack(fill="x", padx=10)
 
     ttk.Label(win, text="Товар:").pack(anchor="w", padx=10, pady=(10, 0))
-    prods = get_products()
-    prod_var = tk.StringVar()
-    prod_cb = ttk.Combobox(win, textvariable=prod_var, values=[f"{p[0]} – {p[1]} (ост. {p[3]})" for p in prods])
+    prod_cb = SearchBox(win, "products")
     prod_cb.pack(fill="x", padx=10)
 
     ttk.Label(win, text="Количество:").pack(anchor="w", padx=10, pady=(10, 0))
@@ -217,41 +690,136 @@ def sale_window():
     qty_entry = ttk.Entry(win, textvariable=qty_var)
     qty_entry.pack(fill="x", padx=10)
 
+    line_lbl = ttk.Label(win, text="Позиция: 0.00₽")
+    line_lbl.pack(pady=(10, 0))
+
+    # Корзина
+    cart = {}  # product_id -> количество
+    cart_cols = ("ID", "Товар", "Кол-во", "Сумма")
+    cart_tree = ttk.Treeview(win, columns=cart_cols, show="headings", height=8)
+    for col in cart_cols:
+        cart_tree.heading(col, text=col)
+    cart_tree.column("ID", width=50)
+    cart_tree.column("Кол-во", width=70, anchor="e")
+    cart_tree.column("Сумма", width=100, anchor="e")
+    cart_tree.pack(fill="both", expand=True, padx=10, pady=10)
+
     check_lbl = ttk.Label(win, text="Предварительный чек: 0.00₽", font=("Segoe UI", 12))
-    check_lbl.pack(pady=15)
+    check_lbl.pack(pady=5)
+
+    progress = ttk.Progressbar(win, mode="indeterminate")
+    progress.pack(fill="x", padx=10)
+
+    def load_catalog():
+        lists = get_customers(), get_employees(), get_products()
+        pricing.rules()  # правила скидок компилируются вместе со справочниками, не в обработчике ввода
+        return lists
+
+    def show_catalog(lists):
+        progress.stop()
+        for box in (cust_cb, emp_cb, prod_cb):
+            box.refresh()
 
     # Обработчики событий
+    def quote(items):
+        """Расчёт позиций items = [(product_id, кол-во)] тем же pricing.quote, что и продажа."""
+        products = catalog.table("products").by_id
+        return pricing.quote(
+            [(pid, qty, pricing.kopecks(products[pid][2]), products[pid][4]) for pid, qty in items],
+            cust_cb.selected_id()
+        )
+
     def update_check(event=None):
         try:
-            pid = int(prod_var.get().split("–")[0].strip())
-            qty = qty_var.get()
-            price = next(p[2] for p in prods if p[0] == pid)
-            total = price * qty * (1 - DISCOUNT)
-            check_lbl.config(text=f"Предварительный чек: {total:.2f}₽")
+            total = quote([(prod_cb.selected_id(), qty_var.get())]).total
+            line_lbl.config(text=f"Позиция: {total / 100:.2f}₽")
         except:
-            check_lbl.config(text="Предварительный чек: 0.00₽")
+            line_lbl.config(text="Позиция: 0.00₽")
+
+    def refresh_cart():
+        cart_tree.delete(*cart_tree.get_children())
+        check = quote(cart.items()) if cart else None
+        amounts = check.amounts() if check else {}
+        for pid, qty in cart.items():
+            name = catalog.table("products").by_id[pid][1]
+            cart_tree.insert("", "end", iid=str(pid), values=(pid, name, qty, f"{amounts[pid] / 100:.2f}₽"))
+        check_lbl.config(text=f"Предварительный чек: {(check.total if check else 0) / 100:.2f}₽")
+
+    def add_to_cart():
+        pid = prod_cb.selected_id()
+        try:
+            qty = qty_var.get()
+        except Exception:
+            qty = None
+        if pid is None or qty is None:
+            messagebox.showerror("Ошибка", "Выберите товар и количество")
+            return
+        if qty <= 0:
+            messagebox.showerror("Ошибка", "Количество должно быть больше нуля")
+            return
+        cart[pid] = cart.get(pid, 0) + qty
+        refresh_cart()
+
+    def remove_from_cart():
+        for iid in cart_tree.selection():
+            cart.pop(int(iid), None)
+        refresh_cart()
+
+    def customer_changed(event=None):
+        # У покупателя могут быть свои скидки — пересчитываем позицию и корзину
+        update_check()
+        refresh_cart()
 
     prod_cb.bind("<<ComboboxSelected>>", update_check)
+    cust_cb.bind("<<ComboboxSelected>>", customer_changed)
     qty_entry.bind("<KeyRelease>", update_check)
 
+    def sale_done(sale_id):
+        win.destroy()
+        show_receipt(sale_id)
+
+    def sale_failed(ex):
+        progress.stop()
+        sell_btn.config(state="normal")
+        messagebox.showerror("Ошибка", str(ex))
+
     def process_sale():
-        try:
-            cid = int(cust_var.get().split("–")[0].strip())
-            eid = int(emp_var.get().split("–")[0].strip())
-            pid = int(prod_var.get().split("–")[0].strip())
-            qty = qty_var.get()
-            sale_id = make_sale(pid, qty, cid, eid)
-            win.destroy()
-            show_receipt(sale_id)
-        except Exception as ex:
-            messagebox.showerror("Ошибка", str(ex))
+        cid = cust_cb.selected_id()
+        eid = emp_cb.selected_id()
+        if cid is None or eid is None:
+            messagebox.showerror("Ошибка", "Выберите покупателя и сотрудника из списка")
+            return
+        sell_btn.config(state="disabled")
+        progress.start()
+        executor.submit(
+            make_sale, list(cart.items()), cid, eid,
+            on_done=sale_done, on_error=sale_failed, owner=win
+        )
+
+    btns = ttk.Frame(win)
+    btns.pack(pady=10)
+    ttk.Button(btns, text="Добавить в корзину", command=add_to_cart).grid(row=0, column=0, padx=5)
+    ttk.Button(btns, text="Убрать из корзины", command=remove_from_cart).grid(row=0, column=1, padx=5)
+    sell_btn = ttk.Button(btns, text="Оформить продажу", command=process_sale)
+    sell_btn.grid(row=0, column=2, padx=5)
 
-    ttk.Button(win, text="Оформить продажу", command=process_sale).pack(pady=10)
+    progress.start()
+    executor.submit(load_catalog, on_done=show_catalog, owner=win)
 
 
 # --- Окно добавления покупателя ---
+def add_customer(name, phone):
+    # id — из диапазона этой БД (кассы или центра), чтобы не совпасть с покупателями других касс
+    with db.transaction() as conn:
+        customer_id = replication.new_id(conn, "customers")
+        conn.execute("INSERT INTO customers (id, name, phone) VALUES (?, ?, ?)", (customer_id, name, phone))
+    catalog.invalidate("customers")
+    return customer_id
+
+
+@metrics.window("window.add_customer")
 def add_customer_window():
-    win = tb.Toplevel()
+    win = toplevel()
     win.title("Новый покупатель")
     win.geometry("450x250")
 
@@ -268,12 +836,7 @@ def add_customer_window():
             messagebox.showerror("Ошибка", "Все поля обязательны для заполнения")
             return
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                conn.execute(
-                    "INSERT INTO customers (name, phone) VALUES (?, ?)",
-                    (name_var.get(), phone_var.get())
-                )
-                conn.commit()
+            add_customer(name_var.get(), phone_var.get())
             messagebox.showinfo("Успех", "Покупатель добавлен")
             win.destroy()
         except sqlite3.IntegrityError:
@@ -284,7 +847,16 @@ def add_customer_window():
 
 # --- Авторизация администратора ---
 def restock_auth_window():
-    login_win = tb.Toplevel()
+    # Пока сессия жива, пароль не спрашивается и не хешируется заново
+    if auth.check(admin_session):
+        restock_window()
+        return
+    login_form()
+
+
+@metrics.window("window.restock_auth")
+def login_form():
+    login_win = toplevel()
     login_win.title("Авторизация администратора")
     login_win.geometry("350x200")
 
@@ -296,90 +868,398 @@ def restock_auth_window():
     pass_var = tk.StringVar()
     ttk.Entry(login_win, textvariable=pass_var, show="*").pack(fill="x", padx=10)
 
-    def check_auth():
-        with sqlite3.connect(DB_PATH) as conn:
-            admin = conn.execute(
-                "SELECT password_hash FROM admins WHERE login = ?",
-                (login_var.get(),)
-            ).fetchone()
-
-        if not admin:
-            messagebox.showerror("Ошибка", "Неверный логин")
-            return
+    def logged_in(token):
+        global admin_session
+        admin_session = token
+        login_win.destroy()
+        restock_window()
 
-        input_hash = hashlib.sha256(pass_var.get().encode()).hexdigest()
-        if input_hash == admin[0]:
-            login_win.destroy()
-            restock_window()
-        else:
-            messagebox.showerror("Ошибка", "Неверный пароль")
+    def login_failed(ex):
+        login_btn.config(state="normal")
+        messagebox.showerror("Ошибка", str(ex), parent=login_win)
+
+    def check_auth():
+        # Проверка пароля медленная (auth.KDF_COST), поэтому идёт в фоновом пуле
+        login_btn.config(state="disabled")
+        executor.submit(
+            auth.login, login_var.get(), pass_var.get(), on_done=logged_in, on_error=login_failed, owner=login_win
+        )
 
-    ttk.Button(login_win, text="Войти", command=check_auth).pack(pady=10)
+    login_btn = ttk.Button(login_win, text="Войти", command=check_auth)
+    login_btn.pack(pady=10)
 
 
 # --- Окно управления запасами ---
+LOW_STOCK_THRESHOLD = 5  # порог для товаров без прогноза; с прогнозом — его точка заказа
+RESTOCK_TARGET = 20  # автопополнение доводит остаток как минимум до этого уровня
+RESTOCK_COVER_DAYS = 14  # ...или до продаж товара за столько последних дней, если их больше
+FORECAST_INTERVAL_MS = 5 * 60 * 1000  # как часто приложение обновляет прогноз и снимки остатков в фоне
+
+
+def restock(quantities):
+    """Пополняет склад одной транзакцией по парам (product_id, кол-во); возвращает новые остатки."""
+    merged = {}
+    for product_id, quantity in quantities:
+        if quantity <= 0:
+            raise Exception(f"Количество для товара ID {product_id} должно быть больше нуля")
+        merged[product_id] = merged.get(product_id, 0) + quantity
+    if not merged:
+        return {}
+
+    def work(conn):
+        updated = conn.executemany(
+            "UPDATE products SET stock = stock + ? WHERE id = ?",
+            [(quantity, product_id) for product_id, quantity in merged.items()]
+        ).rowcount
+        if updated != len(merged):
+            raise Exception("Товар не найден")
+        ledger.record(conn, [(product_id, quantity, None) for product_id, quantity in merged.items()], "restock")
+        ids = list(merged)
+        return dict(conn.execute(
+            f"SELECT id, stock FROM products WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ))
+
+    with metrics.timed("restock.apply"):
+        stocks = db.run_in_transaction(work)
+    catalog.invalidate("products")
+    return stocks
+
+
+def fetch_forecast():
+    """Прогноз из product_forecast: {product_id: (точка заказа, продаж в день)}."""
+    with db.connection() as conn:
+        return {
+            row[0]: row[1:]
+            for row in metrics.fetchall(
+                conn, "restock.forecast", "SELECT product_id, reorder_point, velocity FROM product_forecast"
+            )
+        }
+
+
+def reorder_quantities(threshold=LOW_STOCK_THRESHOLD, target=RESTOCK_TARGET, cover_days=RESTOCK_COVER_DAYS):
+    # Остаток ниже точки заказа (без прогноза — threshold) доводится до наибольшего
+    # из target, продаж за cover_days дней и точки заказа
+    since = (datetime.now() - timedelta(days=cover_days)).strftime("%Y-%m-%d")
+    with db.connection() as conn:
+        return metrics.fetchall(conn, "restock.reorder", """
+            WITH demand AS (
+                SELECT product_id, SUM(quantity) AS sold
+                FROM daily_product_agg
+                WHERE day >= ?
+                GROUP BY product_id
+            )
+            SELECT p.id, MAX(?, COALESCE(d.sold, 0), COALESCE(f.reorder_point, 0)) - p.stock
+            FROM products p
+            LEFT JOIN demand d ON d.product_id = p.id
+            LEFT JOIN product_forecast f ON f.product_id = p.id
+            WHERE p.stock < COALESCE(f.reorder_point, ?)
+            ORDER BY p.id
+        """, (since, target, threshold))
+
+
+@metrics.window("window.restock")
 def restock_window():
-    win = tb.Toplevel()
+    win = toplevel()
     win.title("Остатки и пополнение")
     win.geometry("650x450")
 
-    cols = ("ID", "Название", "Остаток")
-    tree = ttk.Treeview(win, columns=cols, show="headings", height=10)
+    cols = ("ID", "Название", "Остаток", "Точка заказа", "Дней запаса")
+    tree = ttk.Treeview(win, columns=cols, show="headings", height=10, selectmode="extended")
     for c in cols:
         tree.heading(c, text=c)
     tree.pack(fill="both", expand=True, padx=10, pady=(10, 0))
-
-    prods = get_products()
-    for p in prods:
-        tag = "low" if p[3] < 5 else ""
-        tree.insert("", "end", values=(p[0], p[1], p[3]), tags=(tag,))
     tree.tag_configure("low", background="#ffd6d6")
 
+    plan = {}  # прогноз, загружается вместе с товарами в фоне
+
+    def row_values(product_id, name, stock):
+        # Дни запаса считаются от текущего остатка, чтобы пополнение сразу отражалось в таблице
+        reorder_point, velocity = plan.get(product_id, (None, None))
+        return (product_id, name, stock, "" if reorder_point is None else reorder_point,
+                round(max(stock, 0) / velocity, 1) if velocity else "")
+
+    def stock_tags(product_id, stock):
+        reorder_point = plan.get(product_id, (None, None))[0]
+        return ("low",) if stock < (LOW_STOCK_THRESHOLD if reorder_point is None else reorder_point) else ()
+
+    def show_products(loaded):
+        forecast_plan, products = loaded
+        plan.update(forecast_plan)
+        for p in products:
+            tree.insert("", "end", iid=str(p[0]), values=row_values(p[0], p[1], p[3]), tags=stock_tags(p[0], p[3]))
+        order_btn.config(state="normal")
+        auto_btn.config(state="normal")
+
     qty_var = tk.IntVar(value=5)
     frm = ttk.Frame(win)
     frm.pack(pady=10)
     ttk.Label(frm, text="Кол-во для пополнения:").grid(row=0, column=0)
     ttk.Entry(frm, textvariable=qty_var, width=5).grid(row=0, column=1, padx=5)
 
+    def update_rows(stocks):
+        # Меняются только строки пополненных товаров, остальная таблица не перестраивается
+        for product_id, stock in stocks.items():
+            iid = str(product_id)
+            if tree.exists(iid):
+                name = tree.item(iid, "values")[1]
+                tree.item(iid, values=row_values(product_id, name, stock), tags=stock_tags(product_id, stock))
+
+    def apply(quantities, message):
+        if not auth.check(admin_session):
+            messagebox.showerror("Ошибка", "Сессия администратора истекла, войдите заново", parent=win)
+            win.destroy()
+            login_form()
+            return
+        order_btn.config(state="disabled")
+        auto_btn.config(state="disabled")
+
+        def done(stocks):
+            order_btn.config(state="normal")
+            auto_btn.config(state="normal")
+            update_rows(stocks)
+            messagebox.showinfo("OK", message, parent=win)
+
+        def failed(ex):
+            order_btn.config(state="normal")
+            auto_btn.config(state="normal")
+            messagebox.showerror("Ошибка", str(ex), parent=win)
+
+        executor.submit(restock, quantities, on_done=done, on_error=failed, owner=win)
+
     def order():
         sel = tree.selection()
         if not sel:
+            messagebox.showerror("Ошибка", "Выберите товары в таблице", parent=win)
+            return
+        try:
+            q = qty_var.get()
+        except Exception:
+            q = 0
+        if q <= 0:
+            messagebox.showerror("Ошибка", "Количество должно быть больше нуля", parent=win)
             return
-        pid = int(tree.item(sel[0])["values"][0])
-        q = qty_var.get()
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (q, pid))
-            conn.commit()
-        messagebox.showinfo("OK", f"ID {pid} пополнен на {q} шт.")
+        apply([(int(iid), q) for iid in sel], f"Пополнено товаров: {len(sel)}, по {q} шт.")
+
+    def auto_order():
+        def confirm(quantities):
+            if not quantities:
+                messagebox.showinfo("OK", "Нет товаров с остатком ниже точки заказа", parent=win)
+                return
+            total = sum(quantity for _, quantity in quantities)
+            if messagebox.askyesno(
+                "Автопополнение",
+                f"Заказать {total} шт. для {len(quantities)} товаров с остатком ниже точки заказа?",
+                parent=win
+            ):
+                apply(quantities, f"Пополнено товаров: {len(quantities)}, всего {total} шт.")
+
+        executor.submit(reorder_quantities, on_done=confirm, owner=win)
+
+    order_btn = ttk.Button(frm, text="Заказать выбранные", command=order, state="disabled")
+    order_btn.grid(row=0, column=2, padx=10)
+    def logout():
+        # Следующее открытие окна снова спросит пароль
+        global admin_session
+        auth.logout(admin_session)
+        admin_session = None
         win.destroy()
-        restock_window()
 
-    ttk.Button(frm, text="Заказать на склад", command=order).grid(row=0, column=2, padx=10)
+    auto_btn = ttk.Button(frm, text="Автопополнение", command=auto_order, state="disabled")
+    auto_btn.grid(row=0, column=3)
+    ttk.Button(frm, text="Выйти", command=logout).grid(row=0, column=4, padx=10)
+    executor.submit(lambda: (fetch_forecast(), get_products()), on_done=show_products, owner=win)
 
 
 # --- История продаж ---
+HISTORY_PAGE_SIZE = 100  # строк за одну подгрузку
+HISTORY_MAX_ROWS = 500  # больше строк в таблице не держим: дальние страницы выгружаются
+
+
+def sales_page_query(conn, filters=None, after=None, before=None, limit=HISTORY_PAGE_SIZE):
+    # after/before — ключ (datetime, id) крайней показанной строки: страница старше или новее неё
+    filters = filters or {}
+    where, params = [], []
+    if filters.get("date_from"):
+        where.append("s.datetime >= ?")
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        where.append("s.datetime < ?")
+        params.append(filters["date_to"])
+    if filters.get("employee_id"):
+        where.append("s.employee_id = ?")
+        params.append(filters["employee_id"])
+    if filters.get("customer_id"):
+        where.append("s.customer_id = ?")
+        params.append(filters["customer_id"])
+    if after:
+        where.append("(s.datetime, s.id) < (?, ?)")
+        params.extend(after)
+    if before:
+        where.append("(s.datetime, s.id) > (?, ?)")
+        params.extend(before)
+    order = "ASC" if before else "DESC"
+    where = "WHERE " + " AND ".join(where) if where else ""
+
+    # Страница берётся из каждого файла (рабочая БД и архивы) по idx_sales_datetime
+    # и сливается: сортировка всего all_sales стоила бы времени, растущего с историей
+    branches = db.archived_selects(conn, "sales")
+    pages = " UNION ALL ".join(
+        f"SELECT * FROM ({branch} s {where} ORDER BY s.datetime {order}, s.id {order} LIMIT ?)"
+        for branch in branches
+    )
+    return f"""
+        SELECT page.id, page.datetime, page.total_kop / 100.0, c.name, e.name
+        FROM ({pages}) page
+        JOIN customers c ON page.customer_id = c.id
+        JOIN employees e ON page.employee_id = e.id
+        ORDER BY page.datetime {order}, page.id {order}
+        LIMIT ?
+    """, (params + [limit]) * len(branches) + [limit]
+
+
+def fetch_sales_page(filters=None, after=None, before=None, limit=HISTORY_PAGE_SIZE):
+    with db.connection() as conn:
+        rows = metrics.fetchall(conn, "history.page", *sales_page_query(conn, filters, after, before, limit))
+    if before:
+        rows.reverse()
+    return rows
+
+
+@metrics.window("window.history")
 def sales_history_window():
-    win = tb.Toplevel()
+    win = toplevel()
     win.title("История продаж")
     win.geometry("1000x700")
 
+    # Фильтры
+    flt = ttk.Frame(win)
+    flt.pack(fill="x", padx=10, pady=(10, 0))
+    ttk.Label(flt, text="С (ГГГГ-ММ-ДД):").grid(row=0, column=0, padx=5)
+    date_from_var = tk.StringVar()
+    ttk.Entry(flt, textvariable=date_from_var, width=12).grid(row=0, column=1, padx=5)
+    ttk.Label(flt, text="По:").grid(row=0, column=2, padx=5)
+    date_to_var = tk.StringVar()
+    ttk.Entry(flt, textvariable=date_to_var, width=12).grid(row=0, column=3, padx=5)
+
+    ttk.Label(flt, text="Сотрудник:").grid(row=0, column=4, padx=5)
+    emp_cb = SearchBox(flt, "employees", width=20)
+    emp_cb.grid(row=0, column=5, padx=5)
+
+    ttk.Label(flt, text="Покупатель:").grid(row=0, column=6, padx=5)
+    cust_cb = SearchBox(flt, "customers", width=20)
+    cust_cb.grid(row=0, column=7, padx=5)
+
+    def show_filter_values(lists):
+        emp_cb.refresh()
+        cust_cb.refresh()
+
     cols = ("ID", "Дата", "Сумма", "Покупатель", "Сотрудник")
-    tree = ttk.Treeview(win, columns=cols, show="headings", height=20)
+    table = ttk.Frame(win)
+    table.pack(fill="both", expand=True, padx=10, pady=10)
+    tree = ttk.Treeview(table, columns=cols, show="headings", height=20)
     for col in cols:
         tree.heading(col, text=col)
-    tree.pack(fill="both", expand=True, padx=10, pady=10)
+    vsb = ttk.Scrollbar(table, orient="vertical", command=tree.yview)
+    vsb.pack(side="right", fill="y")
+    tree.pack(side="left", fill="both", expand=True)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        sales = conn.execute("""
-            SELECT s.id, s.datetime, s.total_amount, c.name, e.name
-            FROM sales s
-            JOIN customers c ON s.customer_id = c.id
-            JOIN employees e ON s.employee_id = e.id
-            ORDER BY s.datetime DESC
-        """).fetchall()
+    progress = ttk.Progressbar(win, mode="indeterminate")
+    progress.pack(fill="x", padx=10, pady=(0, 10))
+
+    # Окно подгруженных строк: ключи (datetime, id) крайних строк и признаки «есть ещё».
+    # Страницы грузятся в фоне; пока страница в пути (task), новые не запрашиваются
+    state = {"filters": {}, "more_above": False, "more_below": True, "check_pending": False, "task": None}
+
+    def key_of(iid):
+        return tree.item(iid, "values")[1], int(iid)
+
+    def fetch(on_done, after=None, before=None):
+        progress.start()
+        state["task"] = executor.submit(
+            fetch_sales_page, state["filters"], after, before,
+            on_done=on_done, on_error=page_failed, owner=win
+        )
 
-    for sale in sales:
-        tree.insert("", "end", values=sale)
+    def page_loaded():
+        state["task"] = None
+        progress.stop()
+
+    def page_failed(ex):
+        page_loaded()
+        messagebox.showerror("Ошибка", str(ex))
+
+    def load_below():
+        if state["task"] is not None:
+            return
+        rows_now = tree.get_children()
+        fetch(show_below, after=key_of(rows_now[-1]) if rows_now else None)
+
+    def show_below(rows):
+        page_loaded()
+        for sale in rows:
+            tree.insert("", "end", iid=str(sale[0]), values=sale)
+        state["more_below"] = len(rows) == HISTORY_PAGE_SIZE
+        rows_now = tree.get_children()
+        if len(rows_now) > HISTORY_MAX_ROWS:
+            tree.delete(*rows_now[:len(rows_now) - HISTORY_MAX_ROWS])
+            state["more_above"] = True
+
+    def load_above():
+        rows_now = tree.get_children()
+        if state["task"] is not None or not rows_now:
+            return
+        fetch(show_above, before=key_of(rows_now[0]))
+
+    def show_above(rows):
+        page_loaded()
+        anchor = tree.get_children()[0]
+        for pos, sale in enumerate(rows):
+            tree.insert("", pos, iid=str(sale[0]), values=sale)
+        state["more_above"] = len(rows) == HISTORY_PAGE_SIZE
+        rows_now = tree.get_children()
+        if len(rows_now) > HISTORY_MAX_ROWS:
+            tree.delete(*rows_now[HISTORY_MAX_ROWS:])
+            state["more_below"] = True
+        tree.see(anchor)
+
+    def check_edges():
+        state["check_pending"] = False
+        first, last = tree.yview()
+        if last >= 0.95 and state["more_below"]:
+            load_below()
+        elif first <= 0.05 and state["more_above"]:
+            load_above()
+
+    def on_scroll(first, last):
+        vsb.set(first, last)
+        if not state["check_pending"]:
+            state["check_pending"] = True
+            win.after_idle(check_edges)
+
+    tree.configure(yscrollcommand=on_scroll)
+
+    def apply_filters():
+        try:
+            filters = {
+                "employee_id": emp_cb.selected_id(),
+                "customer_id": cust_cb.selected_id(),
+            }
+            if date_from_var.get().strip():
+                filters["date_from"] = datetime.strptime(date_from_var.get().strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+            if date_to_var.get().strip():
+                day = datetime.strptime(date_to_var.get().strip(), "%Y-%m-%d")
+                filters["date_to"] = (day + timedelta(days=1)).strftime("%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Ошибка", "Неверный фильтр: дата в формате ГГГГ-ММ-ДД")
+            return
+        if state["task"] is not None:
+            state["task"].cancel()
+            page_loaded()
+        state.update(filters=filters, more_above=False, more_below=True)
+        tree.delete(*tree.get_children())
+        load_below()
+
+    ttk.Button(flt, text="Применить", command=apply_filters).grid(row=0, column=8, padx=10)
 
     def on_double_click(event):
         item = tree.selection()[0]
@@ -387,17 +1267,124 @@ def sales_history_window():
         show_receipt(sale_id)
 
     tree.bind("<Double-1>", on_double_click)
+    executor.submit(lambda: (get_employees(), get_customers()), on_done=show_filter_values, owner=win)
+    load_below()
 
 
 # --- Отчёты и аналитика ---
+# Период задаётся полуоткрытым диапазоном [начало месяца, начало следующего).
+# Сводные отчёты читают дневные агрегаты (число строк зависит от числа дней, а не продаж),
+# детализация — сырые продажи через индекс idx_sales_datetime
+REPORT_QUERIES = {
+    "report.years": """
+        SELECT DISTINCT substr(day, 1, 4)
+        FROM daily_sales_agg
+        ORDER BY 1 DESC
+    """,
+    "report.total": """
+        SELECT SUM(revenue_kop) / 100.0
+        FROM daily_sales_agg 
+        WHERE day >= ? AND day < ?
+    """,
+    "report.premium": """
+        SELECT 
+            e.name,
+            SUM(a.sales_count),
+            SUM(a.revenue_kop) / 100.0,
+            ROUND(SUM(a.revenue_kop) / 100.0 / SUM(a.sales_count), 2)
+        FROM daily_sales_agg a
+        JOIN employees e ON a.employee_id = e.id
+        WHERE a.day >= ? AND a.day < ?
+        GROUP BY e.id
+        ORDER BY SUM(a.revenue_kop) DESC
+    """,
+    "report.top_sellers": """
+        SELECT e.name, SUM(a.revenue_kop) / 100.0
+        FROM daily_sales_agg a
+        JOIN employees e ON a.employee_id = e.id
+        GROUP BY e.id
+        ORDER BY SUM(a.revenue_kop) DESC
+        LIMIT 5
+    """,
+    "report.top_customers": """
+        SELECT c.name, SUM(a.revenue_kop) / 100.0
+        FROM daily_sales_agg a
+        JOIN customers c ON a.customer_id = c.id
+        GROUP BY c.id
+        ORDER BY SUM(a.revenue_kop) DESC
+        LIMIT 5
+    """,
+    "report.details": """
+        SELECT 
+            l.datetime,
+            e.name,
+            c.name,
+            l.total_kop / 100.0,
+            GROUP_CONCAT(p.name || ' x' || l.quantity, ', ')
+        FROM all_sale_lines l
+        JOIN employees e ON l.employee_id = e.id
+        JOIN customers c ON l.customer_id = c.id
+        JOIN products p ON l.product_id = p.id
+        WHERE l.datetime >= ? AND l.datetime < ?
+        -- продажи с позициями и архивы — all_sale_lines (db.attach_archives); условие по datetime
+        -- проталкивается в каждую ветку и идёт по idx_sales_datetime
+        GROUP BY l.datetime, l.sale_id
+        ORDER BY l.datetime DESC
+    """,
+}
+# Таблицы фактов, которые отчёты не должны читать полным сканированием
+FACT_TABLES = ("sales", "sale_items")
+
+
+def period_bounds(year, month):
+    """Границы месяца [начало, начало следующего) в формате столбца sales.datetime."""
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year}-{month:02d}-01", f"{next_year}-{next_month:02d}-01"
+
+
+def period_range(year, month, months):
+    """Границы months месяцев, последний из которых — month года year."""
+    index = year * 12 + month - 1 - (months - 1)
+    return f"{index // 12}-{index % 12 + 1:02d}-01", period_bounds(year, month)[1]
+
+
+def run_report(name, *params):
+    with db.connection() as conn:
+        return metrics.fetchall(conn, name, REPORT_QUERIES[name], params)
+
+
+def plan_problems(conn, queries):
+    # (имя запроса, строка плана) для полных проходов по sales/sale_items (или их псевдонимам s, si)
+    problems = []
+    for name, (sql, args) in queries.items():
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", args):
+            detail = row[3]
+            words = detail.split()
+            if words[0] == "SCAN" and "INDEX" not in words and (
+                words[1].split(".")[-1] in FACT_TABLES or words[-1] in ("s", "si")
+            ):
+                problems.append((name, detail))
+    return problems
+
+
+def report_plan_problems(conn, year=None, month=None):
+    """plan_problems запросов отчётов за месяц (по умолчанию текущий)."""
+    params = period_bounds(year or datetime.now().year, month or datetime.now().month)
+    return plan_problems(conn, {name: (sql, params if "?" in sql else ()) for name, sql in REPORT_QUERIES.items()})
+
+
+@metrics.window("window.report")
 def report_window():
-    win = tb.Toplevel()
+    win = toplevel()
     win.title("Расширенные отчёты")
     win.geometry("1200x900")
 
     notebook = ttk.Notebook(win)
     notebook.pack(fill='both', expand=True, padx=10, pady=10)
 
+    progress = ttk.Progressbar(win, mode='indeterminate')
+    progress.pack(fill='x', padx=10, pady=(0, 10))
+
     # Вкладка 1: Премия за период
     premium_frame = ttk.Frame(notebook)
     notebook.add(premium_frame, text="Премия за период")
@@ -423,24 +1410,21 @@ def report_window():
     ttk.Label(period_frame, text="Год:", font=('Segoe UI', 10)).grid(row=0, column=2, padx=5)
     year_var = tk.IntVar()
 
-    with sqlite3.connect(DB_PATH) as conn:
-        years = conn.execute("""
-            SELECT DISTINCT strftime('%Y', datetime) 
-            FROM sales 
-            ORDER BY datetime DESC
-        """).fetchall()
-
-    year_values = [int(y[0]) for y in years] if years else [datetime.now().year]
     year_combo = ttk.Combobox(
         period_frame,
         textvariable=year_var,
-        values=year_values,
+        values=[datetime.now().year],
         state='readonly',
         width=8
     )
     year_combo.grid(row=0, column=3, padx=5)
     year_combo.current(0)
 
+    def show_years(years):
+        year_values = [int(y[0]) for y in years] if years else [datetime.now().year]
+        year_combo.config(values=year_values)
+        year_combo.current(0)
+
     # Кнопка обновления
     ttk.Button(
         period_frame,
@@ -544,45 +1528,151 @@ def report_window():
 
     details_tree.pack(fill='both', expand=True, padx=10, pady=10)
 
+    # Вкладка 4: Тепловая карта по дням недели и часам
+    heat_frame = ttk.Frame(notebook)
+    notebook.add(heat_frame, text="По часам")
+
+    heat_controls = ttk.Frame(heat_frame)
+    heat_controls.pack(pady=15, fill='x')
+
+    ttk.Label(heat_controls, text="Месяцев до выбранного:", font=('Segoe UI', 10)).grid(row=0, column=0, padx=5)
+    heat_months_var = tk.IntVar(value=3)
+    ttk.Combobox(
+        heat_controls,
+        textvariable=heat_months_var,
+        values=[1, 3, 6, 12],
+        state='readonly',
+        width=5
+    ).grid(row=0, column=1, padx=5)
+
+    ttk.Label(heat_controls, text="Показатель:", font=('Segoe UI', 10)).grid(row=0, column=2, padx=5)
+    measure_var = tk.StringVar(value=heatmap.MEASURES["revenue"])
+    measure_combo = ttk.Combobox(
+        heat_controls,
+        textvariable=measure_var,
+        values=list(heatmap.MEASURES.values()),
+        state='readonly',
+        width=18
+    )
+    measure_combo.grid(row=0, column=3, padx=5)
+
+    ttk.Button(
+        heat_controls,
+        text="Построить",
+        command=lambda: update_heatmap(month_var.get(), year_var.get(), heat_months_var.get()),
+        style='primary.TButton'
+    ).grid(row=0, column=4, padx=10)
+
+    heat_label = ttk.Label(heat_frame, text="", font=('Segoe UI', 10))
+    heat_label.pack(pady=(0, 5))
+    heat_canvas = tk.Canvas(heat_frame, background='white', highlightthickness=0)
+    heat_canvas.pack(fill='both', expand=True, padx=10, pady=10)
+    heat_state = {"result": None}
+
+    def draw_heatmap(event=None):
+        # Перерисовка и смена показателя берут уже посчитанную карту, без запроса к БД
+        result = heat_state["result"]
+        heat_canvas.delete('all')
+        if result is None:
+            return
+        measure = next(key for key, label in heatmap.MEASURES.items() if label == measure_var.get())
+        values = result[measure]
+        left, top = 40, 25
+        cell_w = max(20, (heat_canvas.winfo_width() - left - 10) / heatmap.HOURS)
+        cell_h = max(20, (heat_canvas.winfo_height() - top - 10) / len(heatmap.WEEKDAYS))
+        peak = values.max() or 1
+        for hour in range(heatmap.HOURS):
+            heat_canvas.create_text(left + (hour + 0.5) * cell_w, top / 2, text=str(hour), font=('Segoe UI', 8))
+        for day, name in enumerate(heatmap.WEEKDAYS):
+            y = top + day * cell_h
+            heat_canvas.create_text(left / 2, y + cell_h / 2, text=name, font=('Segoe UI', 9))
+            for hour in range(heatmap.HOURS):
+                value = values[day][hour]
+                share = value / peak
+                # От белого к насыщенному синему пропорционально значению
+                color = "#%02x%02x%02x" % (
+                    int(255 - share * 224), int(255 - share * 136), int(255 - share * 75)
+                )
+                x = left + hour * cell_w
+                heat_canvas.create_rectangle(x, y, x + cell_w, y + cell_h, fill=color, outline='#dddddd')
+                if value and cell_w >= 36:
+                    text = f"{value:.1f}" if measure == "basket" else f"{value:.0f}"
+                    heat_canvas.create_text(
+                        x + cell_w / 2, y + cell_h / 2, text=text, font=('Segoe UI', 7),
+                        fill='white' if share > 0.6 else 'black'
+                    )
+
+    heat_canvas.bind('<Configure>', draw_heatmap)
+    measure_combo.bind('<<ComboboxSelected>>', draw_heatmap)
+
+    def show_heatmap(bounds, result):
+        heat_state["result"] = result
+        source = "из кэша" if result["cached"] else f"{result['seconds']:.2f} с"
+        heat_label.config(
+            text=f"Период {bounds[0]} — {bounds[1]}: продаж {int(result['sales'].sum())}, "
+                 f"выручка {result['revenue'].sum():.2f}₽ ({source})"
+        )
+        draw_heatmap()
+
+    def update_heatmap(month, year, months):
+        bounds = period_range(year, month, months)
+        pending["count"] += 1
+        progress.start()
+        executor.submit(
+            heatmap.sales_heatmap, *bounds,
+            on_done=lambda result: (report_loaded(), show_heatmap(bounds, result)),
+            on_error=report_failed,
+            owner=win
+        )
+
+    # Вкладки загружаются параллельно в фоновых потоках; прогресс крутится, пока не придут все
+    pending = {"count": 0}
+
+    def report_loaded():
+        pending["count"] -= 1
+        if pending["count"] == 0:
+            progress.stop()
+
+    def report_failed(e):
+        report_loaded()
+        messagebox.showerror("Ошибка", f"Ошибка обновления отчетов: {str(e)}")
+
     def update_all_reports(month, year):
-        try:
-            period = f"{year}-{month:02d}"
+        period = f"{year}-{month:02d}"
+        bounds = period_bounds(year, month)
 
-            with sqlite3.connect(DB_PATH) as conn:
-                # Обновление премиальной вкладки
-                update_premium_report(conn, period)
+        def fetch_premium():
+            return run_report("report.total", *bounds), run_report("report.premium", *bounds)
 
-                # Обновление общей статистики
-                update_general_stats(conn)
+        def fetch_general_stats():
+            return run_report("report.top_sellers"), run_report("report.top_customers")
 
-                # Обновление детализации
-                update_details(conn, period)
+        def fetch_details():
+            return run_report("report.details", *bounds)
 
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Ошибка обновления отчетов: {str(e)}")
+        tasks = (
+            # Обновление премиальной вкладки
+            (fetch_premium, lambda data: update_premium_report(period, *data)),
+            # Обновление общей статистики
+            (fetch_general_stats, lambda data: update_general_stats(*data)),
+            # Обновление детализации
+            (fetch_details, lambda sales: update_details(sales)),
+        )
+        pending["count"] += len(tasks)
+        progress.start()
+        for fetch, show in tasks:
+            executor.submit(
+                fetch,
+                on_done=lambda data, show=show: (report_loaded(), show(data)),
+                on_error=report_failed,
+                owner=win
+            )
 
-    def update_premium_report(conn, period):
+    def update_premium_report(period, total_rows, employees_data):
         # Данные для премии
-        total = conn.execute("""
-            SELECT SUM(total_amount) 
-            FROM sales 
-            WHERE strftime('%Y-%m', datetime) = ?
-        """, (period,)).fetchone()[0] or 0
+        total = total_rows[0][0] or 0
         total_sales_label.config(text=f"Общая выручка: {total:.2f}₽")
 
-        employees_data = conn.execute("""
-            SELECT 
-                e.name,
-                COUNT(s.id),
-                SUM(s.total_amount),
-                ROUND(AVG(s.total_amount), 2)
-            FROM sales s
-            JOIN employees e ON s.employee_id = e.id
-            WHERE strftime('%Y-%m', s.datetime) = ?
-            GROUP BY e.id
-            ORDER BY SUM(s.total_amount) DESC
-        """, (period,)).fetchall()
-
         sales_tree.delete(*sales_tree.get_children())
         if employees_data:
             best_emp = employees_data[0]
@@ -599,53 +1689,20 @@ def report_window():
                 foreground='red'
             )
 
-    def update_general_stats(conn):
+    def update_general_stats(sellers, customers):
         # Топ продавцов
         top_sellers.delete(*top_sellers.get_children())
-        sellers = conn.execute("""
-            SELECT e.name, SUM(s.total_amount)
-            FROM sales s
-            JOIN employees e ON s.employee_id = e.id
-            GROUP BY e.id
-            ORDER BY SUM(s.total_amount) DESC
-            LIMIT 5
-        """).fetchall()
         for seller in sellers:
             top_sellers.insert('', 'end', values=(seller[0], f"{seller[1]:.2f}₽"))
 
         # Топ покупателей
         top_customers.delete(*top_customers.get_children())
-        customers = conn.execute("""
-            SELECT c.name, SUM(s.total_amount)
-            FROM sales s
-            JOIN customers c ON s.customer_id = c.id
-            GROUP BY c.id
-            ORDER BY SUM(s.total_amount) DESC
-            LIMIT 5
-        """).fetchall()
         for cust in customers:
             top_customers.insert('', 'end', values=(cust[0], f"{cust[1]:.2f}₽"))
 
-    def update_details(conn, period):
+    def update_details(sales):
         # Детализация продаж
         details_tree.delete(*details_tree.get_children())
-        sales = conn.execute("""
-            SELECT 
-                s.datetime,
-                e.name,
-                c.name,
-                s.total_amount,
-                GROUP_CONCAT(p.name || ' x' || si.quantity, ', ')
-            FROM sales s
-            JOIN employees e ON s.employee_id = e.id
-            JOIN customers c ON s.customer_id = c.id
-            JOIN sale_items si ON s.id = si.sale_id
-            JOIN products p ON si.product_id = p.id
-            WHERE strftime('%Y-%m', s.datetime) = ?
-            GROUP BY s.id
-            ORDER BY s.datetime DESC
-        """, (period,)).fetchall()
-
         for sale in sales:
             details_tree.insert('', 'end', values=(
                 sale[0],
@@ -656,13 +1713,75 @@ def report_window():
             ))
 
     # Первоначальная загрузка
+    executor.submit(run_report, "report.years", on_done=show_years, owner=win)
     update_all_reports(datetime.now().month, datetime.now().year)
-    win.mainloop()
+
+
+# --- Диагностика ---
+@metrics.window("window.diagnostics")
+def diagnostics_window():
+    win = toplevel()
+    win.title("Диагностика производительности")
+    win.geometry("1000x650")
+
+    enabled_var = tk.BooleanVar(value=metrics.ENABLED)
+    top = ttk.Frame(win)
+    top.pack(fill="x", padx=10, pady=10)
+    ttk.Checkbutton(
+        top, text="Собирать метрики", variable=enabled_var,
+        command=lambda: metrics.enable(enabled_var.get())
+    ).pack(side="left")
+
+    cols = ("Имя", "Тип", "Вызовов", "Среднее, мс", "p50, мс", "p95, мс", "Макс, мс", "Строк")
+    tree = ttk.Treeview(win, columns=cols, show="headings", height=14)
+    for col in cols:
+        tree.heading(col, text=col)
+        tree.column(col, width=100, anchor="e" if col not in ("Имя", "Тип") else "w")
+    tree.column("Имя", width=200)
+    tree.pack(fill="both", expand=True, padx=10)
+
+    ttk.Label(win, text=f"Медленные запросы (от {metrics.SLOW_QUERY_MS:g} мс):").pack(anchor="w", padx=10, pady=(10, 0))
+    slow_text = tk.Text(win, height=10, font=("Courier New", 10))
+    slow_text.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+
+    def refresh():
+        data = metrics.snapshot()
+        tree.delete(*tree.get_children())
+        for name, m in data["metrics"].items():
+            tree.insert("", "end", values=(
+                name, m["kind"], m["count"], m["mean_ms"], m["p50_ms"], m["p95_ms"], m["max_ms"], m["rows"]
+            ))
+        slow_text.delete("1.0", tk.END)
+        for q in reversed(data["slow_queries"]):
+            slow_text.insert(tk.END, f"{q['at']} {q['name']}: {q['elapsed_ms']} мс, строк {q['rows']}\n")
+            for step in q["plan"]:
+                slow_text.insert(tk.END, f"    {step}\n")
+
+    def save():
+        filename = f"metrics_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+        metrics.export(filename)
+        messagebox.showinfo("Сохранено", f"Метрики сохранены в {filename}")
+
+    def clear():
+        metrics.reset()
+        refresh()
+
+    ttk.Button(top, text="Обновить", command=refresh).pack(side="left", padx=10)
+    ttk.Button(top, text="Сбросить", command=clear).pack(side="left")
+    ttk.Button(top, text="Сохранить в файл", command=save).pack(side="left", padx=10)
+    refresh()
+
+
 # --- Главное окно ---
 def main():
+    import ttkbootstrap as tb
+
+    global executor
+    bootstrap()
     app = tb.Window(themename="litera")
+    executor = workers.TkExecutor(app)
     app.title("Система автоматизации супермаркета")
-    app.geometry("500x450")
+    app.geometry("500x500")
 
     ttk.Label(app, text="Система автоматизации супермаркета", font=("Segoe UI", 16)).pack(pady=20)
     ttk.Button(app, text="🛒 Продажа товара", width=30, command=sale_window).pack(pady=5)
@@ -670,10 +1789,172 @@ def main():
     ttk.Button(app, text="📦 Остатки и пополнение", width=30, command=restock_auth_window).pack(pady=5)
     ttk.Button(app, text="📊 Отчёты и выручка", width=30, command=report_window).pack(pady=5)
     ttk.Button(app, text="📜 История продаж", width=30, command=sales_history_window).pack(pady=5)
+    ttk.Button(app, text="🩺 Диагностика", width=30, command=diagnostics_window).pack(pady=5)
     ttk.Button(app, text="❌ Выход", width=30, command=app.destroy).pack(pady=20)
 
+    def schedule_background():
+        # Ошибка фонового пересчёта не показывается: следующий запуск повторит его
+        executor.submit(forecast.run, on_error=lambda ex: None)
+        executor.submit(ledger.snapshot, on_error=lambda ex: None)
+        app.after(FORECAST_INTERVAL_MS, schedule_background)
+
+    schedule_background()
     app.mainloop()
+    executor.shutdown()
+    db.close_group_writer()
+
+
+def cli(argv=None):
+    """Точка входа: без аргументов — окно приложения, иначе служебная команда."""
+    parser = argparse.ArgumentParser(description="Система автоматизации супермаркета")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("rebuild-aggregates", help="пересчитать дневные агрегаты продаж для отчётов")
+    ingest_cmd = commands.add_parser("ingest", help="загрузить продажи из файла JSONL/CSV без интерфейса")
+    ingest_cmd.add_argument("path", help="файл с продажами (.jsonl или .csv)")
+    ingest_cmd.add_argument("--format", choices=sorted(ingest.READERS), help="формат, если не ясен из расширения")
+    ingest_cmd.add_argument("--batch-size", type=int, default=ingest.INGEST_BATCH_SIZE, help="продаж на транзакцию")
+    ingest_cmd.add_argument("--keep-stock", action="store_true", help="не списывать остатки (исторические данные)")
+    commands.add_parser("forecast", help="обновить прогноз расхода и точки заказа (инкрементально)")
+    export_cmd = commands.add_parser("export-parquet", help="выгрузить продажи и справочники в Parquet по месяцам")
+    export_cmd.add_argument("root", help="каталог выгрузки")
+    wh_report_cmd = commands.add_parser("warehouse-report", help="построить отчёт по выгрузке Parquet, не трогая БД")
+    wh_report_cmd.add_argument("root", help="каталог выгрузки")
+    wh_report_cmd.add_argument("name", choices=sorted(warehouse.REPORTS))
+    wh_report_cmd.add_argument("--year", type=int, default=datetime.now().year)
+    wh_report_cmd.add_argument("--month", type=int, default=datetime.now().month)
+    archive_cmd = commands.add_parser("archive", help="перенести закрытые месяцы продаж в годовые архивы")
+    archive_cmd.add_argument("--keep-months", type=int, default=archive.ARCHIVE_KEEP_MONTHS,
+                             help="сколько последних месяцев (включая текущий) оставить в рабочей БД")
+    archive_cmd.add_argument("--dry-run", action="store_true", help="только показать, что будет перенесено")
+    archive_cmd.add_argument("--verify", action="store_true", help="проверить контрольные суммы архивов")
+    replica_cmd = commands.add_parser("replica-init", help="завести в новой БД кассу, синхронизируемую с центральной")
+    replica_cmd.add_argument("till", type=int, help="номер кассы, задаёт её диапазон id продаж")
+    replica_cmd.add_argument("--central", required=True, help="файл центральной БД")
+    sync_cmd = commands.add_parser("sync", help="отправить продажи кассы в центральную БД и получить справочники")
+    sync_cmd.add_argument("--central", required=True, help="файл центральной БД")
+    receipts_cmd = commands.add_parser("receipts", help="выгрузить чеки за период в каталог или zip-архив")
+    receipts_cmd.add_argument("--from", dest="date_from", required=True, help="первый день периода, ГГГГ-ММ-ДД")
+    receipts_cmd.add_argument("--to", dest="date_to", required=True, help="последний день периода, ГГГГ-ММ-ДД")
+    receipts_cmd.add_argument("--out", required=True, help="каталог или файл .zip")
+    receipts_cmd.add_argument("--workers", type=int, default=1, help="число процессов для большого периода")
+    stock_at_cmd = commands.add_parser("stock-at", help="остатки товаров на прошедший момент по журналу движения")
+    stock_at_cmd.add_argument("moment", help="момент, ГГГГ-ММ-ДД ЧЧ:ММ:СС")
+    stock_at_cmd.add_argument("--product", type=int, nargs="+", help="id товаров (по умолчанию все)")
+    stock_snapshot_cmd = commands.add_parser("stock-snapshot", help="записать снимки остатков товаров")
+    stock_snapshot_cmd.add_argument("--force", action="store_true",
+                                    help=f"не ждать {ledger.SNAPSHOT_EVERY} движений с прошлого снимка")
+    commands.add_parser("stock-audit", help="сверить остатки товаров и снимки с журналом движения")
+    password_cmd = commands.add_parser("admin-password", help="задать пароль администратора (или завести нового)")
+    password_cmd.add_argument("login", help="логин администратора")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild-aggregates":
+        bootstrap()
+        rebuild_sales_aggregates()
+        print("Агрегаты продаж пересчитаны")
+    elif args.command == "ingest":
+        bootstrap()
+        try:
+            stats = ingest.ingest_sales(
+                args.path, batch_size=args.batch_size, fmt=args.format, update_stock=not args.keep_stock
+            )
+        except ValueError as ex:  # формат или колонки файла: ничего не загружено
+            raise SystemExit(f"Ошибка: {ex}")
+        for error in stats["errors"]:
+            print(error)
+        print(
+            f"Загружено продаж: {stats['sales']}, позиций: {stats['items']}, отклонено: {stats['rejected']} "
+            f"за {stats['seconds']:.2f} с ({stats['rows_per_sec']:.0f} строк/с)"
+        )
+    elif args.command == "forecast":
+        bootstrap()
+        stats = forecast.run()
+        kind = "полный" if stats["full"] else "по новым продажам"
+        print(f"Прогноз обновлён ({kind}): товаров {stats['products']} за {stats['seconds']:.2f} с")
+    elif args.command == "stock-at":
+        bootstrap()
+        names = {row[0]: row[1] for row in get_products()}
+        for product_id, stock in ledger.stock_at(args.moment, args.product).items():
+            print(f"{product_id}\t{names.get(product_id)}\t{stock}")
+    elif args.command == "stock-snapshot":
+        bootstrap()
+        stats = ledger.snapshot(force=args.force)
+        print(f"Снимки остатков: товаров {stats['products']} за {stats['seconds']:.2f} с")
+    elif args.command == "stock-audit":
+        bootstrap()
+        problems = ledger.audit()
+        for product_id, stock, expected in problems["stock"]:
+            print(f"Товар {product_id}: остаток {stock}, по журналу {expected}")
+        for product_id, movement_id, stock, expected in problems["snapshots"]:
+            print(f"Снимок товара {product_id} после движения {movement_id}: {stock}, по журналу {expected}")
+        print(f"Расхождений: остатков {len(problems['stock'])}, снимков {len(problems['snapshots'])}")
+    elif args.command == "admin-password":
+        import getpass
+
+        bootstrap()
+        password = getpass.getpass("Новый пароль: ")
+        if not password or password != getpass.getpass("Повторите пароль: "):
+            raise SystemExit("Пароли пусты или не совпадают")
+        auth.set_password(args.login, password)
+        print(f"Пароль администратора {args.login} изменён")
+    elif args.command == "export-parquet":
+        bootstrap()
+        stats = warehouse.export(args.root)
+        print(
+            f"Выгружено месяцев: {len(stats['months'])} ({', '.join(stats['months']) or 'нет новых'}), "
+            f"строк: {stats['rows']} за {stats['seconds']:.2f} с"
+        )
+    elif args.command == "warehouse-report":
+        params = () if args.name in ("report.top_sellers", "report.top_customers") else period_bounds(args.year, args.month)
+        for row in warehouse.run_report(args.root, args.name, *params):
+            print(" | ".join("" if value is None else str(value) for value in row))
+    elif args.command == "archive":
+        bootstrap()
+        if args.verify:
+            checked, problems = archive.verify()
+            for problem in problems:
+                print(problem)
+            print(f"Проверено месяцев в архивах: {checked}, расхождений: {len(problems)}")
+            return
+        stats = archive.run(keep_months=args.keep_months, dry_run=args.dry_run)
+        for month, sales, items, path in stats["months"]:
+            print(f"{month}: продаж {sales}, позиций {items} -> {os.path.basename(path)}")
+        if args.dry_run:
+            print(f"Пробный запуск: к переносу месяцев {len(stats['months'])} (до {stats['cutoff']}), БД не изменена")
+        else:
+            print(
+                f"Перенесено месяцев: {len(stats['months'])}; рабочая БД "
+                f"{stats['size_before'] / 2 ** 20:.1f} -> {stats['size_after'] / 2 ** 20:.1f} МБ "
+                f"за {stats['seconds']:.2f} с"
+            )
+    elif args.command in ("replica-init", "sync"):
+        if args.command == "replica-init":
+            replication.init_till(db.DB_PATH, args.till, SCHEMA)
+        bootstrap()
+        transport = replication.LoopbackTransport(args.central)
+        try:
+            stats = replication.sync(transport)
+        finally:
+            transport.close()
+        print(
+            f"Касса {stats['till']}: отправлено продаж {stats['sales_sent']}, получено строк справочников "
+            f"{stats['rows_received']}; передано {transport.sent_bytes} Б, принято {transport.received_bytes} Б "
+            f"за {stats['seconds']:.2f} с"
+        )
+    elif args.command == "receipts":
+        bootstrap()
+        date_from = datetime.strptime(args.date_from, "%Y-%m-%d")
+        date_to = datetime.strptime(args.date_to, "%Y-%m-%d") + timedelta(days=1)
+        stats = receipts.export_receipts(
+            date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d"), args.out, workers=args.workers
+        )
+        print(
+            f"Выгружено чеков: {stats['receipts']} в {', '.join(stats['outputs'])} за {stats['seconds']:.2f} с "
+            f"({stats['receipts_per_sec']:.0f} чеков/с, процессов: {stats['workers']})"
+        )
+    else:
+        main()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""Инструментирование горячих путей: задержки именованных запросов и построения окон."""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+ENABLED = bool(os.environ.get("SUPERMARKET_METRICS"))  # или enable(); по умолчанию выключено
+SLOW_QUERY_MS = float(os.environ.get("SUPERMARKET_SLOW_MS", 50))  # медленнее — сохраняется EXPLAIN QUERY PLAN
+SLOW_LOG_SIZE = 50
+# Верхние границы корзин гистограммы, мс; последняя корзина — всё, что дольше
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_lock = threading.Lock()
+_metrics = {}
+_slow = deque(maxlen=SLOW_LOG_SIZE)
+
+
+class Metric:
+    def __init__(self, kind):
+        self.kind = kind
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms, rows):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if rows is not None:
+            self.rows += rows
+        for index, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, share):
+        """Оценка перцентиля сверху: граница корзины, в которую он попал."""
+        needed = share * self.count
+        seen = 0
+        for index, hits in enumerate(self.buckets):
+            seen += hits
+            if hits and seen >= needed:
+                return BUCKETS_MS[index] if index < len(BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "kind": self.kind,
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "buckets": dict(zip([f"<={bound}" for bound in BUCKETS_MS] + ["inf"], self.buckets)),
+        }
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+
+
+def record(name, elapsed_ms, rows=None, kind="query"):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric(kind)
+        metric.add(elapsed_ms, rows)
+
+
+def fetchall(conn, name, sql, params=()):
+    """conn.execute(sql, params).fetchall() с замером под именем name."""
+    if not ENABLED:
+        return conn.execute(sql, params).fetchall()
+    start = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    record(name, elapsed_ms, len(rows))
+    if elapsed_ms >= SLOW_QUERY_MS:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        with _lock:
+            _slow.append({
+                "name": name,
+                "elapsed_ms": round(elapsed_ms, 3),
+                "rows": len(rows),
+                "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "plan": plan,
+            })
+    return rows
+
+
+@contextmanager
+def timed(name, kind="query"):
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, kind=kind)
+
+
+def window(name):
+    """Декоратор функции, строящей окно: замеряет время построения."""
+    def decorate(build):
+        @wraps(build)
+        def wrapper(*args, **kwargs):
+            with timed(name, kind="window"):
+                return build(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    with _lock:
+        return {
+            "metrics": {name: metric.as_dict() for name, metric in sorted(_metrics.items())},
+            "slow_queries": list(_slow),
+            "slow_query_ms": SLOW_QUERY_MS,
+        }
+
+
+def export(path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=2)
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+        _slow.clear()
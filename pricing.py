@@ -0,0 +1,124 @@
+"""Цены и скидки в целых копейках (скидка — в базисных пунктах, округление по позиции) по правилам promotions."""
+from datetime import datetime
+
+import catalog
+
+# Скидки не складываются: позиции достаётся наибольшая из подходящих, но не меньше базовой
+BASE_PERCENT = 10  # базовая скидка на всё, %
+BASIS_POINTS = 100  # базисных пунктов в проценте
+
+_compiled = None
+
+
+def kopecks(rubles):
+    """Сумма в рублях (число или строка) -> целые копейки."""
+    return int(round(float(rubles) * 100))
+
+
+def rubles(kop):
+    return kop / 100
+
+
+class Rules:
+    """Правила promotions, разложенные по массивам: элемент массива — правило."""
+
+    def __init__(self, rows, version):
+        import numpy as np  # нужен расчёту корзины, не запуску приложения
+
+        def column(index, missing):
+            return np.array([missing if row[index] is None else row[index] for row in rows], dtype=np.int64)
+
+        self.version = version
+        self.ids = column(0, 0)
+        self.points = np.array([round(float(row[2] or 0) * BASIS_POINTS) for row in rows], dtype=np.int64)
+        self.category = column(3, -1)  # -1 — правило для любой категории (товара, покупателя)
+        self.product = column(4, -1)
+        self.customer = column(5, -1)
+        self.starts = np.array([row[6] or "" for row in rows], dtype=str)
+        self.ends = np.array([row[7] or "9999" for row in rows], dtype=str)
+        # weekdays — дни недели цифрами, 1 — понедельник ("67" — выходные); пусто — все дни
+        self.weekdays = np.array(
+            [sum(1 << (int(day) - 1) for day in str(row[8])) if row[8] else 0b1111111 for row in rows], dtype=np.int64
+        )
+        self.hour_from = column(9, 0)  # часы [hour_from, hour_to), можно через полночь (22 -> 6)
+        self.hour_to = column(10, 24)
+
+    def active(self, customers, moments):
+        """Матрица «корзина × правило»: действует ли правило для покупателя корзины в её момент."""
+        import numpy as np
+
+        stamps = np.array([moment.strftime("%Y-%m-%d %H:%M:%S") for moment in moments], dtype=str)[:, None]
+        hours = np.array([moment.hour for moment in moments], dtype=np.int64)[:, None]
+        weekdays = np.array([moment.weekday() for moment in moments], dtype=np.int64)[:, None]
+        customers = np.array([-2 if customer is None else customer for customer in customers], dtype=np.int64)[:, None]
+        in_hours = np.where(
+            self.hour_from <= self.hour_to,
+            (self.hour_from <= hours) & (hours < self.hour_to),
+            (hours >= self.hour_from) | (hours < self.hour_to),
+        )
+        return (
+            (self.starts <= stamps) & (stamps < self.ends)
+            & ((self.weekdays >> weekdays) & 1).astype(bool)
+            & in_hours
+            & ((self.customer == -1) | (self.customer == customers))
+        )
+
+
+class Quote:
+    """Расчёт корзины: позиции (product_id, кол-во, цена, скидка) и итоги — всё в копейках."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.gross = sum(quantity * price for _, quantity, price, _ in lines)
+        self.discount = sum(discount for _, _, _, discount in lines)
+        self.total = self.gross - self.discount
+
+    def amounts(self):
+        """{product_id: сумма позиции со скидкой}."""
+        return {product_id: quantity * price - discount for product_id, quantity, price, discount in self.lines}
+
+
+def rules():
+    """Скомпилированные правила скидок; перекомпилируются после изменения promotions."""
+    global _compiled
+    table = catalog.table("promotions")
+    compiled = _compiled
+    if compiled is None or compiled.version != table.version:
+        compiled = _compiled = Rules(table.rows, table.version)
+    return compiled
+
+
+def quote(lines, customer_id=None, moment=None, compiled=None):
+    """Считает корзину lines = [(product_id, кол-во, цена в копейках, category_id)]; compiled — из rules()."""
+    return quote_many([(lines, customer_id, moment or datetime.now())], compiled)[0]
+
+
+def quote_many(baskets, compiled=None):
+    """Считает корзины baskets = [(lines, customer_id, момент)] одним проходом; возвращает [Quote]."""
+    import numpy as np
+
+    compiled = compiled or rules()
+    lines = [line for basket in baskets for line in basket[0]]
+    products = np.array([line[0] for line in lines], dtype=np.int64)
+    quantities = np.array([line[1] for line in lines], dtype=np.int64)
+    prices = np.array([line[2] for line in lines], dtype=np.int64)
+
+    points = np.full(len(lines), BASE_PERCENT * BASIS_POINTS, dtype=np.int64)
+    if len(compiled.ids) and len(lines):
+        categories = np.array([-1 if line[3] is None else line[3] for line in lines], dtype=np.int64)[:, None]
+        owners = np.repeat(np.arange(len(baskets)), [len(basket[0]) for basket in baskets])
+        matches = (
+            compiled.active([basket[1] for basket in baskets], [basket[2] for basket in baskets])[owners]
+            & ((compiled.category == -1) | (compiled.category == categories))
+            & ((compiled.product == -1) | (compiled.product == products[:, None]))
+        )
+        points = np.maximum(points, np.where(matches, compiled.points, 0).max(axis=1))
+    gross = quantities * prices
+    discounts = (gross * points + 100 * BASIS_POINTS // 2) // (100 * BASIS_POINTS)
+
+    rows = list(zip(products.tolist(), quantities.tolist(), prices.tolist(), discounts.tolist()))
+    quotes, start = [], 0
+    for basket in baskets:
+        quotes.append(Quote(rows[start:start + len(basket[0])]))
+        start += len(basket[0])
+    return quotes
@@ -0,0 +1,148 @@
+"""Текст чеков без интерфейса: окно чека, сохранение в файл и пакетная выгрузка для фискального архива."""
+import os
+import time
+from itertools import groupby
+
+import db
+
+# Шаблоны — связанные методы str.format: строка формата разбирается при каждом вызове, но в C,
+# и на строках чека это быстрее, чем сборка из заранее разобранных частей на Python
+HEADER = (
+    "Чек №{0}\n"
+    "Дата: {1}\n"
+    "Покупатель: {3}\n"
+    "Сотрудник: {4}\n"
+    "-------------------------------\n"
+    "Товары:\n"
+).format
+LINE = "{0} x{1} @{2:.2f}₽ = {3:.2f}₽\n".format
+FOOTER = (
+    "-------------------------------\n"
+    "Итого: {0:.2f}₽\n"
+    "Скидка: {1:.2f}₽\n"
+).format
+
+BATCH_QUERY = """
+    SELECT l.sale_id, l.datetime, l.total_kop, c.name, e.name, p.name, l.quantity, l.price_kop
+    FROM all_sale_lines l
+    JOIN customers c ON l.customer_id = c.id
+    JOIN employees e ON l.employee_id = e.id
+    JOIN products p ON l.product_id = p.id
+    WHERE l.datetime >= ? AND l.datetime < ? AND l.sale_id BETWEEN ? AND ?
+    ORDER BY l.datetime, l.sale_id
+"""
+FETCH_SIZE = 2000  # строк за один fetchmany
+MIN_SALES_PER_WORKER = 5000  # меньше продаж на процесс не делим: запуск процесса дороже
+
+
+def render(header, items):
+    """header — (id, datetime, итог, покупатель, сотрудник); items — (название, кол-во, цена). Суммы — в копейках."""
+    parts = [HEADER(*header)]
+    gross = 0
+    for name, quantity, price in items:
+        gross += quantity * price
+        parts.append(LINE(name, quantity, price / 100, quantity * price / 100))
+    parts.append(FOOTER(header[2] / 100, (gross - header[2]) / 100))
+    return "".join(parts)
+
+
+def filename(sale_id, moment):
+    return f"Чек_{sale_id}_{moment.replace(':', '-')}.txt"
+
+
+def iter_receipts(conn, date_from, date_to, first_id, last_id):
+    """(sale_id, datetime, текст) для продаж с date_from <= datetime < date_to и id в [first_id, last_id]."""
+    cursor = conn.execute(BATCH_QUERY, (date_from, date_to, first_id, last_id))
+
+    def rows():
+        while True:
+            chunk = cursor.fetchmany(FETCH_SIZE)
+            if not chunk:
+                return
+            yield from chunk
+
+    for sale_id, lines in groupby(rows(), key=lambda row: row[0]):
+        first = next(lines)
+        header = first[:5]
+        items = [first[5:]]
+        items.extend(line[5:] for line in lines)
+        yield sale_id, header[1], render(header, items)
+
+
+def export_range(path, out, date_from, date_to, first_id, last_id):
+    """Выгружает часть периода в каталог или zip out; возвращает число чеков. Выполняется и в дочерних процессах."""
+    import zipfile  # нужен только выгрузке, не запуску приложения
+
+    if path != db.DB_PATH:
+        db.configure(path)
+    count = 0
+    with db.connection() as conn:
+        receipts = iter_receipts(conn, date_from, date_to, first_id, last_id)
+        if out.lower().endswith(".zip"):
+            with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+                for sale_id, moment, text in receipts:
+                    archive.writestr(filename(sale_id, moment), text)
+                    count += 1
+        else:
+            os.makedirs(out, exist_ok=True)
+            for sale_id, moment, text in receipts:
+                with open(os.path.join(out, filename(sale_id, moment)), "w", encoding="utf-8") as f:
+                    f.write(text)
+                count += 1
+    return count
+
+
+def split_ids(first_id, last_id, parts):
+    """Делит [first_id, last_id] на parts смежных отрезков примерно равной длины."""
+    step = (last_id - first_id + 1 + parts - 1) // parts
+    return [(start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)]
+
+
+def export_receipts(date_from, date_to, out, workers=1):
+    """Выгружает чеки продаж с date_from <= datetime < date_to в каталог или zip-архив out; возвращает статистику."""
+    import zipfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    with db.connection() as conn:
+        first_id, last_id, sales = conn.execute(
+            "SELECT MIN(id), MAX(id), COUNT(*) FROM all_sales WHERE datetime >= ? AND datetime < ?",
+            (date_from, date_to)
+        ).fetchone()
+    archive = out.lower().endswith(".zip")
+    os.makedirs(os.path.dirname(os.path.abspath(out)) if archive else out, exist_ok=True)
+    workers = max(1, min(workers, sales // MIN_SALES_PER_WORKER))
+    stats = {"receipts": 0, "workers": workers, "outputs": [out]}
+
+    if not sales:
+        if archive:
+            zipfile.ZipFile(out, "w").close()
+    elif workers == 1:
+        stats["receipts"] = export_range(db.DB_PATH, out, date_from, date_to, first_id, last_id)
+    else:
+        ranges = split_ids(first_id, last_id, workers)
+        if archive:
+            # Архив — по части на процесс: сжатие занимает основное время, слияние съело бы выигрыш
+            stem = out[:-len(".zip")]
+            stats["outputs"] = [f"{stem}.part{index}.zip" for index in range(1, len(ranges) + 1)]
+        else:
+            stats["outputs"] = [out] * len(ranges)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(export_range, db.DB_PATH, target, date_from, date_to, low, high)
+                for target, (low, high) in zip(stats["outputs"], ranges)
+            ]
+            stats["receipts"] = sum(future.result() for future in futures)
+        stats["outputs"] = sorted(set(stats["outputs"]))
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["receipts_per_sec"] = stats["receipts"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def save(text, sale_id, moment, directory=None):
+    """Сохраняет один чек в directory (по умолчанию — текущий каталог); возвращает путь к файлу."""
+    path = os.path.join(directory or os.getcwd(), filename(sale_id, moment))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
@@ -0,0 +1,344 @@
+"""Кассы со своей БД: продажи пишутся локально, sync() отправляет их в центральную БД и забирает справочники."""
+import json
+import time
+import zlib
+from datetime import datetime
+
+import catalog
+import db
+import ledger
+
+# Касса N выдаёт id продаж и покупателей из [N * TILL_ID_SPAN, (N + 1) * TILL_ID_SPAN),
+# центр — из диапазона номера 0
+TILL_ID_SPAN = 10 ** 12  # размер диапазона id одной кассы
+CENTRAL_TILL = 0  # номер диапазона центра: кассам не выдаётся
+SYNC_BATCH_SALES = 500  # продаж в одном сообщении push
+COMPRESS_LEVEL = 6
+# Суммы в копейках — последние колонки: касса прежней версии шлёт строки без них,
+# и центр дополняет их триггерами миграции 5
+SALE_COLUMNS = "id, datetime, customer_id, employee_id, total_amount, total_kop"
+ITEM_COLUMNS = "sale_id, product_id, quantity, price, price_kop, discount_kop"
+# Справочники, которые центр раздаёт кассам
+REPLICATED = {
+    "categories": "id, name",
+    "products": "id, name, price, stock, category_id",
+    "customers": "id, name, phone",
+    "employees": "id, name, role",
+    "promotions": "id, name, percent, category_id, product_id, customer_id, starts_at, ends_at, weekdays, hour_from, hour_to",
+}
+# Таблицы кассы с id из её диапазона
+TILL_RANGED = ("sales", "customers")
+
+
+# Сообщения — сжатый zlib JSON; транспорт — объект с методом request(bytes) -> bytes
+def encode(message):
+    return zlib.compress(json.dumps(message, ensure_ascii=False).encode(), COMPRESS_LEVEL)
+
+
+def decode(payload):
+    return json.loads(zlib.decompress(payload))
+
+
+def id_range(till_id):
+    return till_id * TILL_ID_SPAN, (till_id + 1) * TILL_ID_SPAN - 1
+
+
+def own_range(conn):
+    """Диапазон id этой БД: кассы, если она настроена как касса, иначе центра."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'replica_state'").fetchone():
+        return id_range(conn.execute("SELECT till_id FROM replica_state").fetchone()[0])
+    return id_range(CENTRAL_TILL)
+
+
+def new_id(conn, table):
+    """id новой строки table из своего диапазона; вызывается в транзакции вставки."""
+    low, high = own_range(conn)
+    return conn.execute(
+        f"SELECT COALESCE(MAX(id), ?) + 1 FROM {table} WHERE id BETWEEN ? AND ?", (low, low, high)
+    ).fetchone()[0]
+
+
+# --- Центральная БД ---
+def ensure_central(conn):
+    """Журнал изменений справочников с триггерами и учёт касс в центральной БД."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS replica_changes (
+            table_name TEXT,
+            row_id INTEGER,
+            seq INTEGER,
+            PRIMARY KEY (table_name, row_id)
+        ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_replica_changes_seq ON replica_changes(seq)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS replica_tills (
+            till_id INTEGER PRIMARY KEY,
+            last_sale_id INTEGER,
+            last_customer_id INTEGER,
+            last_sync TEXT
+        )""")
+    for table in REPLICATED:
+        for event in ("INSERT", "UPDATE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_replica_{table}_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO replica_changes (table_name, row_id, seq)
+                    VALUES ('{table}', NEW.id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM replica_changes))
+                    ON CONFLICT (table_name, row_id) DO UPDATE SET seq = excluded.seq;
+                END""")
+        # Строки, появившиеся до триггеров (справочник добавлен в REPLICATED позже), попадают в журнал один раз
+        conn.execute(f"""
+            INSERT OR IGNORE INTO replica_changes (table_name, row_id, seq)
+            SELECT '{table}', id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM replica_changes) FROM {table}
+            WHERE NOT EXISTS (SELECT 1 FROM replica_changes WHERE table_name = '{table}')""")
+
+
+def _insert(table, columns, row):
+    """INSERT по первым len(row) колонкам columns."""
+    names = columns.split(", ")[:len(row)]
+    return f"INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+
+def _till_state(conn, till_id):
+    row = conn.execute(
+        "SELECT last_sale_id, last_customer_id FROM replica_tills WHERE till_id = ?", (till_id,)
+    ).fetchone()
+    low, _ = id_range(till_id)
+    return row or (low, low)
+
+
+def apply_push(conn, message):
+    """Применяет пачку продаж кассы одной транзакцией (повтор ничего не меняет); возвращает подтверждённые id."""
+    till_id = message["till"]
+    low, high = id_range(till_id)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_sale_id, last_customer_id = _till_state(conn, till_id)
+        for row in message["customers"]:
+            if not low <= row[0] <= high:
+                raise Exception(f"Касса {till_id}: id покупателя {row[0]} вне её диапазона")
+            if conn.execute("INSERT OR IGNORE INTO customers (id, name, phone) VALUES (?, ?, ?)", row).rowcount:
+                continue
+            existing = conn.execute("SELECT name, phone FROM customers WHERE id = ?", row[:1]).fetchone()
+            if existing is None:
+                # Телефон уже завела другая касса: покупатель сохраняется без него, чтобы не потерять его продажи
+                conn.execute("INSERT INTO customers (id, name, phone) VALUES (?, ?, NULL)", row[:2])
+            elif existing[0] != row[1] or existing[1] not in (row[2], None):
+                # Повтор пачки приносит тех же покупателей; другие данные — id занят в центре не этой кассой
+                raise Exception(f"Касса {till_id}: покупатель с id {row[0]} уже есть в центре с другими данными")
+
+        items = {}
+        for item in message["items"]:
+            items.setdefault(item[0], []).append(item)
+        sold, movements = {}, []
+        for row in message["sales"]:
+            if not low <= row[0] <= high:
+                raise Exception(f"Касса {till_id}: id продажи {row[0]} вне её диапазона")
+            # Уже принятая продажа (повтор после потерянного ответа) могла уйти в архив: её не вставляем
+            if row[0] <= last_sale_id:
+                continue
+            if not conn.execute("INSERT OR IGNORE " + _insert("sales", SALE_COLUMNS, row), row).rowcount:
+                names = ", ".join(SALE_COLUMNS.split(", ")[:len(row)])
+                existing = conn.execute(f"SELECT {names} FROM sales WHERE id = ?", row[:1]).fetchone()
+                if existing != tuple(row):
+                    raise Exception(f"Касса {till_id}: продажа с id {row[0]} уже есть в центре с другими данными")
+                continue
+            lines = items.get(row[0], ())
+            if lines:
+                conn.executemany("INSERT " + _insert("sale_items", ITEM_COLUMNS, lines[0]), lines)
+                for sale_id, product_id, quantity, *_ in lines:
+                    sold[product_id] = sold.get(product_id, 0) + quantity
+                    movements.append((product_id, -quantity, sale_id))
+        # Остаток может уйти в минус: касса продавала, не видя продаж других касс
+        conn.executemany("UPDATE products SET stock = stock - ? WHERE id = ?",
+                         [(quantity, product_id) for product_id, quantity in sold.items()])
+        ledger.record(conn, movements, "sale")
+
+        last_sale_id = max([last_sale_id] + [row[0] for row in message["sales"]])
+        last_customer_id = max([last_customer_id] + [row[0] for row in message["customers"]])
+        conn.execute("""
+            INSERT INTO replica_tills (till_id, last_sale_id, last_customer_id, last_sync) VALUES (?, ?, ?, ?)
+            ON CONFLICT(till_id) DO UPDATE SET
+                last_sale_id = excluded.last_sale_id,
+                last_customer_id = excluded.last_customer_id,
+                last_sync = excluded.last_sync
+        """, (till_id, last_sale_id, last_customer_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return {"last_sale_id": last_sale_id, "last_customer_id": last_customer_id}
+
+
+def changes_since(conn, since):
+    """Строки справочников, изменённые после версии since (None — все), и текущая версия."""
+    conn.execute("BEGIN")
+    try:
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM replica_changes").fetchone()[0]
+        tables = {}
+        for table, columns in REPLICATED.items():
+            if since is not None:
+                tables[table] = conn.execute(f"""
+                    SELECT {columns} FROM {table}
+                    WHERE id IN (SELECT row_id FROM replica_changes WHERE table_name = ? AND seq > ?)
+                    ORDER BY id
+                """, (table, since)).fetchall()
+            else:
+                tables[table] = conn.execute(f"SELECT {columns} FROM {table} ORDER BY id").fetchall()
+    finally:
+        conn.execute("COMMIT")
+    return {"seq": seq, "tables": tables}
+
+
+def handle(conn, payload):
+    """Обработчик центра: сообщение кассы -> ответ. Не зависит от транспорта."""
+    message = decode(payload)
+    if message["type"] == "push":
+        reply = apply_push(conn, message)
+    elif message["type"] == "pull":
+        reply = changes_since(conn, message["since"])
+    else:
+        raise Exception(f"Неизвестное сообщение: {message['type']}")
+    return encode(reply)
+
+
+class LoopbackTransport:
+    """Центр в этом же процессе: сообщения передаются вызовом handle() на его файле."""
+
+    def __init__(self, central_path):
+        self.conn = db.connect(central_path)
+        ensure_central(self.conn)
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+    def request(self, payload):
+        self.sent_bytes += len(payload)
+        reply = handle(self.conn, payload)
+        self.received_bytes += len(reply)
+        return reply
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Касса ---
+def init_till(path, till_id, schema):
+    """Готовит новый файл кассы до bootstrap(): sales и customers (по schema) с id из диапазона кассы."""
+    if not 1 <= till_id < (2 ** 63 - 1) // TILL_ID_SPAN:
+        raise Exception(f"Номер кассы должен быть от 1 до {(2 ** 63 - 1) // TILL_ID_SPAN - 1}")
+    low, _ = id_range(till_id)
+    conn = db.connect(path)
+    try:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'replica_state'").fetchone():
+            raise Exception("БД уже настроена как касса")
+        for table in TILL_RANGED:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+                raise Exception(f"Кассу можно завести только в новой БД: таблица {table} уже есть")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in TILL_RANGED:
+                conn.execute(schema[table].format(name=table).replace(
+                    "id INTEGER PRIMARY KEY", "id INTEGER PRIMARY KEY AUTOINCREMENT", 1
+                ))
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, low))
+            conn.execute("""
+                CREATE TABLE replica_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    till_id INTEGER,
+                    acked_sale_id INTEGER,
+                    acked_customer_id INTEGER,
+                    catalog_seq INTEGER
+                )""")
+            conn.execute("INSERT INTO replica_state VALUES (1, ?, ?, ?, NULL)", (till_id, low, low))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _push(conn, transport, till_id, acked_sale_id, acked_customer_id, batch_sales):
+    """Отправляет неподтверждённые продажи и покупателей пачками; возвращает (продаж, новые подтверждения)."""
+    _, high = id_range(till_id)
+    sent = 0
+    while True:
+        sales = conn.execute(
+            f"SELECT {SALE_COLUMNS} FROM sales WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (acked_sale_id, high, batch_sales)
+        ).fetchall()
+        customers = conn.execute(
+            "SELECT id, name, phone FROM customers WHERE id > ? AND id <= ? ORDER BY id", (acked_customer_id, high)
+        ).fetchall()
+        if not sales and not customers:
+            return sent, acked_sale_id, acked_customer_id
+        items = conn.execute(
+            f"SELECT {ITEM_COLUMNS} FROM sale_items WHERE sale_id > ? AND sale_id <= ? ORDER BY sale_id",
+            (acked_sale_id, sales[-1][0] if sales else acked_sale_id)
+        ).fetchall()
+        reply = decode(transport.request(encode({
+            "type": "push", "till": till_id, "sales": sales, "items": items, "customers": customers,
+        })))
+        acked_sale_id, acked_customer_id = reply["last_sale_id"], reply["last_customer_id"]
+        conn.execute("UPDATE replica_state SET acked_sale_id = ?, acked_customer_id = ? WHERE id = 1",
+                     (acked_sale_id, acked_customer_id))
+        sent += len(sales)
+
+
+def _apply_pull(conn, reply, acked_sale_id):
+    """Записывает справочники центра; остаток — за вычетом неподтверждённых продаж кассы."""
+    # Справочники центра переносятся как есть, как и при импорте CSV: без проверки внешних ключей
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            pending = dict(conn.execute(
+                "SELECT product_id, SUM(quantity) FROM sale_items WHERE sale_id > ? GROUP BY product_id",
+                (acked_sale_id,)
+            ))
+            before = ledger.stocks(conn)
+            low, high = own_range(conn)
+            for table, columns in REPLICATED.items():
+                rows = reply["tables"][table]
+                if table in TILL_RANGED:
+                    rows = [row for row in rows if not low <= row[0] <= high]
+                if table == "products":
+                    rows = [row[:3] + [row[3] - pending.get(row[0], 0)] + row[4:] for row in rows]
+                names = columns.split(", ")
+                updates = ", ".join(f"{name} = ?" for name in names[1:])
+                # OR IGNORE: покупатель с тем же телефоном, заведённый на этой кассе, остаётся как есть
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({', '.join('?' * len(names))})", rows
+                )
+                conn.executemany(f"UPDATE OR IGNORE {table} SET {updates} WHERE id = ?",
+                                 [row[1:] + row[:1] for row in rows])
+            # Остатки центра на кассе — установка остатка (adjustment) в журнале кассы
+            ledger.record_changes(conn, before)
+            conn.execute("UPDATE replica_state SET catalog_seq = ? WHERE id = 1", (reply["seq"],))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return sum(len(rows) for rows in reply["tables"].values())
+
+
+def sync(transport, path=None, batch_sales=SYNC_BATCH_SALES):
+    """Один цикл синхронизации кассы: push продаж, затем pull справочников; прерванный можно повторить."""
+    start = time.perf_counter()
+    conn = db.connect(path or db.get_pool().path)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'replica_state'").fetchone():
+            raise Exception("БД не настроена как касса: выполните replica-init")
+        till_id, acked_sale_id, acked_customer_id, catalog_seq = conn.execute(
+            "SELECT till_id, acked_sale_id, acked_customer_id, catalog_seq FROM replica_state"
+        ).fetchone()
+        sent, acked_sale_id, acked_customer_id = _push(
+            conn, transport, till_id, acked_sale_id, acked_customer_id, batch_sales
+        )
+        reply = decode(transport.request(encode({"type": "pull", "till": till_id, "since": catalog_seq})))
+        received = _apply_pull(conn, reply, acked_sale_id)
+    finally:
+        conn.close()
+    catalog.invalidate(*REPLICATED)
+    return {"till": till_id, "sales_sent": sent, "rows_received": received, "seconds": time.perf_counter() - start}
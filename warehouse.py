@@ -0,0 +1,258 @@
+"""Аналитическая копия БД в Parquet (<root>/<таблица>/year=/month=/) и отчёты main.py по ней; нужен pyarrow."""
+import glob
+import json
+import os
+import time
+
+import db
+
+EXPORT_CHUNK_ROWS = 50000
+MANIFEST = "_manifest.json"
+FORMAT = 2  # 2: суммы в копейках (total_kop, price_kop, discount_kop)
+DIMENSIONS = {
+    "products": "SELECT id, name, price, stock, category_id FROM products ORDER BY id",
+    "customers": "SELECT id, name, phone FROM customers ORDER BY id",
+    "employees": "SELECT id, name, role FROM employees ORDER BY id",
+}
+FACTS = {
+    "sales": """
+        SELECT id, datetime, customer_id, employee_id, total_amount, total_kop
+        FROM all_sales
+        WHERE datetime >= ? AND datetime < ?
+        ORDER BY datetime, id
+    """,
+    "sale_items": """
+        SELECT sale_id, product_id, quantity, price, price_kop, discount_kop
+        FROM all_sale_lines
+        WHERE datetime >= ? AND datetime < ?
+        ORDER BY datetime, sale_id
+    """,
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Для выгрузки в Parquet нужен пакет pyarrow: pip install pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+
+def _schemas(pa):
+    return {
+        "products": pa.schema([("id", pa.int64()), ("name", pa.string()), ("price", pa.float64()),
+                               ("stock", pa.int64()), ("category_id", pa.int64())]),
+        "customers": pa.schema([("id", pa.int64()), ("name", pa.string()), ("phone", pa.string())]),
+        "employees": pa.schema([("id", pa.int64()), ("name", pa.string()), ("role", pa.string())]),
+        "sales": pa.schema([("id", pa.int64()), ("datetime", pa.string()), ("customer_id", pa.int64()),
+                            ("employee_id", pa.int64()), ("total_amount", pa.float64()),
+                            ("total_kop", pa.int64())]),
+        "sale_items": pa.schema([("sale_id", pa.int64()), ("product_id", pa.int64()),
+                                 ("quantity", pa.int64()), ("price", pa.float64()),
+                                 ("price_kop", pa.int64()), ("discount_kop", pa.int64())]),
+    }
+
+
+def month_bounds(month):
+    """'2025-05' -> ('2025-05-01', '2025-06-01')."""
+    year, number = int(month[:4]), int(month[5:7])
+    next_year, next_number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return f"{month}-01", f"{next_year}-{next_number:02d}-01"
+
+
+def partition_path(root, table, month):
+    return os.path.join(root, table, f"year={month[:4]}", f"month={month[5:7]}", "part-0.parquet")
+
+
+def _write(conn, path, schema, sql, params=()):
+    """Потоковая запись результата запроса в path через временный файл; возвращает число строк."""
+    pa, pq = _pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    rows = 0
+    cursor = conn.execute(sql, params)
+    with pq.ParquetWriter(tmp, schema) as writer:
+        while True:
+            chunk = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not chunk:
+                break
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            rows += len(chunk)
+    os.replace(tmp, path)
+    return rows
+
+
+# В манифесте — выгруженные месяцы, число продаж в каждом и последний учтённый id продажи
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {"last_sale_id": 0, "months": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export(root):
+    """Выгружает БД в root; возвращает статистику: месяцы, строки, время."""
+    pa, _ = _pyarrow()
+    schemas = _schemas(pa)
+    start = time.perf_counter()
+    os.makedirs(root, exist_ok=True)
+    manifest = load_manifest(root)
+    if manifest.get("format", 1) != FORMAT:
+        manifest = {"last_sale_id": 0, "months": []}
+    stats = {"months": [], "rows": 0}
+
+    with db.connection() as conn:
+        # Снимок читается в одной транзакции: месяцы и справочники согласованы между собой
+        conn.execute("BEGIN")
+        try:
+            last_sale_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+            # Месяцы и число продаж в них — из дневных агрегатов, а не сканированием sales
+            counts = dict(conn.execute("SELECT substr(day, 1, 7), SUM(sales_count) FROM daily_sales_agg GROUP BY 1"))
+            exported = manifest.get("month_sales", {})
+            touched = {row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(datetime, 1, 7) FROM sales WHERE id > ?", (manifest["last_sale_id"],)
+            )}
+            # Продажи касс и догруженные журналы получают id меньше выгруженных: их видно по числу продаж
+            touched |= {month for month, count in exported.items() if counts.get(month) != count}
+            pending = sorted((set(counts) - set(manifest["months"])) | touched)
+
+            for month in pending:
+                for table, sql in FACTS.items():
+                    stats["rows"] += _write(conn, partition_path(root, table, month), schemas[table], sql,
+                                            month_bounds(month))
+                stats["months"].append(month)
+            for table, sql in DIMENSIONS.items():
+                stats["rows"] += _write(conn, os.path.join(root, f"{table}.parquet"), schemas[table], sql)
+        finally:
+            conn.execute("COMMIT")
+
+    manifest = {
+        "format": FORMAT,
+        "last_sale_id": last_sale_id,
+        "months": sorted(set(manifest["months"]) | set(stats["months"])),
+        "month_sales": {month: counts[month] for month in sorted(counts)},
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(root, MANIFEST + ".tmp"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(os.path.join(root, MANIFEST + ".tmp"), os.path.join(root, MANIFEST))
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+# --- Отчёты по выгрузке ---
+def _read(root, table, columns, date_from=None, date_to=None):
+    """DataFrame с колонками columns из партиций table за [date_from, date_to) или за всё время."""
+    import pandas as pd
+
+    pa, pq = _pyarrow()
+    files = sorted(glob.glob(os.path.join(root, table, "year=*", "month=*", "part-0.parquet")))
+    if date_from is not None:
+        # Партиции вне периода не открываются вовсе
+        files = [path for path in files if _overlaps(_partition_month(path), date_from, date_to)]
+    if not files:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables(pq.read_table(path, columns=columns) for path in files).to_pandas()
+
+
+def _partition_month(path):
+    """.../year=2025/month=05/part-0.parquet -> '2025-05'."""
+    month_dir = os.path.dirname(path)
+    year_dir = os.path.dirname(month_dir)
+    return f"{os.path.basename(year_dir)[len('year='):]}-{os.path.basename(month_dir)[len('month='):]}"
+
+
+def _overlaps(month, date_from, date_to):
+    month_start, month_end = month_bounds(month)
+    return month_start < date_to and month_end > date_from
+
+
+def _dimension(root, table, columns):
+    _, pq = _pyarrow()
+    return pq.read_table(os.path.join(root, f"{table}.parquet"), columns=columns).to_pandas().set_index("id")
+
+
+def _period_sales(root, columns, date_from, date_to):
+    sales = _read(root, "sales", sorted(set(columns) | {"datetime"}), date_from, date_to)
+    sales = sales[(sales["datetime"] >= date_from) & (sales["datetime"] < date_to)]
+    return sales[columns]
+
+
+def report_total(root, date_from, date_to):
+    sales = _period_sales(root, ["total_kop"], date_from, date_to)
+    return [(int(sales["total_kop"].sum()) / 100 if len(sales) else None,)]
+
+
+def report_premium(root, date_from, date_to):
+    sales = _period_sales(root, ["employee_id", "total_kop"], date_from, date_to)
+    names = _dimension(root, "employees", ["id", "name"])["name"]
+    grouped = sales.groupby("employee_id")["total_kop"].agg(["count", "sum"])
+    grouped = grouped[grouped.index.isin(names.index)].sort_values("sum", ascending=False)
+    # Средний чек — в копейках с округлением половины вверх, как ROUND(..., 2) в SQL-отчёте;
+    # round() по float расходится с ним на суммах, оканчивающихся на полкопейки
+    return [
+        (names[employee_id], int(count), int(revenue) / 100, (2 * int(revenue) + int(count)) // (2 * int(count)) / 100)
+        for employee_id, count, revenue in zip(grouped.index, grouped["count"], grouped["sum"])
+    ]
+
+
+def _top(root, key, dimension, limit):
+    sales = _read(root, "sales", [key, "total_kop"])
+    names = _dimension(root, dimension, ["id", "name"])["name"]
+    revenue = sales.groupby(key)["total_kop"].sum()
+    revenue = revenue[revenue.index.isin(names.index)].nlargest(limit)
+    return [(names[row_id], int(total) / 100) for row_id, total in revenue.items()]
+
+
+def report_top_sellers(root, limit=5):
+    return _top(root, "employee_id", "employees", limit)
+
+
+def report_top_customers(root, limit=5):
+    return _top(root, "customer_id", "customers", limit)
+
+
+def report_details(root, date_from, date_to):
+    sales = _period_sales(root, ["id", "datetime", "employee_id", "customer_id", "total_kop"], date_from, date_to)
+    if sales.empty:
+        return []
+    items = _read(root, "sale_items", ["sale_id", "product_id", "quantity"], date_from, date_to)
+    items = items[items["sale_id"].isin(sales["id"])]
+    products = _dimension(root, "products", ["id", "name"])["name"]
+    employees = _dimension(root, "employees", ["id", "name"])["name"]
+    customers = _dimension(root, "customers", ["id", "name"])["name"]
+
+    items = items[items["product_id"].isin(products.index)]
+    items = items.assign(line=products.reindex(items["product_id"]).to_numpy() + " x" + items["quantity"].astype(str))
+    lines = items.groupby("sale_id")["line"].agg(", ".join)
+    sales = sales[
+        sales["id"].isin(lines.index)
+        & sales["employee_id"].isin(employees.index)
+        & sales["customer_id"].isin(customers.index)
+    ].sort_values(["datetime", "id"], ascending=False)
+    return list(zip(
+        sales["datetime"],
+        employees.reindex(sales["employee_id"]).tolist(),
+        customers.reindex(sales["customer_id"]).tolist(),
+        (sales["total_kop"].astype("int64") / 100).tolist(),
+        lines.reindex(sales["id"]).tolist(),
+    ))
+
+
+REPORTS = {
+    "report.total": report_total,
+    "report.premium": report_premium,
+    "report.top_sellers": report_top_sellers,
+    "report.top_customers": report_top_customers,
+    "report.details": report_details,
+}
+
+
+def run_report(root, name, *params):
+    """Отчёт name из REPORT_QUERIES main.py, посчитанный по выгрузке root."""
+    return REPORTS[name](root, *params)
@@ -0,0 +1,105 @@
+"""Фоновое выполнение запросов к БД, чтобы главный цикл Tk не блокировался."""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+
+import db
+
+WORKERS = 2  # меньше db.POOL_SIZE: главному потоку тоже нужны соединения
+POLL_MS = 30
+
+
+def show_error(exc):
+    messagebox.showerror("Ошибка", str(exc))
+
+
+class Task:
+    """Запрос в пуле: future плюс колбэки, вызываемые в потоке Tk."""
+
+    def __init__(self, fn, args, on_done, on_error, owner):
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error or show_error
+        self.owner = owner
+        self.future = None
+        self.conn = None  # соединение потока, пока запрос выполняется
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Снимает задачу: не начатая не запустится, выполняемый запрос прерывается, колбэки не вызываются."""
+        with self._lock:
+            self.cancelled = True
+            if self.future is not None:
+                self.future.cancel()
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class TkExecutor:
+    def __init__(self, root, workers=WORKERS, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="db", initializer=db.pin_connection
+        )
+        self._done = queue.Queue()  # готовые задачи; главный цикл забирает их по after() и зовёт колбэки
+        self._owned = {}  # имя окна -> его незавершённые задачи
+        root.after(poll_ms, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, owner=None):
+        """Ставит fn(*args) в очередь. Если задан owner, задача снимается при закрытии этого окна."""
+        task = Task(fn, args, on_done, on_error, owner)
+        if owner is not None:
+            key = str(owner)
+            if key not in self._owned:
+                self._owned[key] = set()
+                owner.bind("<Destroy>", lambda event, key=key: self._owner_destroyed(event, key), add="+")
+            self._owned[key].add(task)
+        task.future = self._pool.submit(self._run, task)
+        return task
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task):
+        with task._lock:
+            if task.cancelled:
+                return
+            task.conn = db.pin_connection()
+        try:
+            result, error = task.fn(*task.args), None
+        except Exception as exc:
+            result, error = None, exc
+        finally:
+            with task._lock:
+                task.conn = None
+        self._done.put((task, result, error))
+
+    def _owner_destroyed(self, event, key):
+        # <Destroy> приходит и для каждого дочернего виджета окна
+        if str(event.widget) != key:
+            return
+        for task in self._owned.pop(key, ()):
+            task.cancel()
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    task, result, error = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                if task.owner is not None:
+                    self._owned.get(str(task.owner), set()).discard(task)
+                if task.cancelled:
+                    continue
+                if error is None:
+                    if task.on_done is not None:
+                        task.on_done(result)
+                else:
+                    task.on_error(error)
+        finally:
+            self.root.after(self.poll_ms, self._poll)